@@ -0,0 +1,290 @@
+"""
+Microbenchmarks for the protocol codec hot paths.
+
+Runs on CPython and on the MicroPython unix port:
+
+    python codec_bench.py [--out FILE] [--baseline FILE] [--save-baseline]
+                          [--threshold PCT] [--only SUBSTRING] [--quick]
+    micropython codec_bench.py ...
+
+Every case reports ops/s, microseconds per op and bytes allocated per op.
+On MicroPython the allocation figure is the exact number of heap bytes
+allocated (gc disabled during the run); on CPython it is the transient peak
+traced by tracemalloc for a single call.
+
+Results are written as JSON. The baseline file stores one result set per
+implementation (cpython / micropython), so both can live in the same file.
+Both files default to this directory, wherever the script is run from.
+"""
+import gc
+import json
+import sys
+import time
+
+import hostshim
+
+IS_MICROPYTHON = sys.implementation.name == 'micropython'
+
+DEFAULT_OUT = hostshim.bench_dir() + '/codec_results.json'
+DEFAULT_BASELINE = hostshim.bench_dir() + '/codec_baseline.json'
+DEFAULT_THRESHOLD = 10.0
+TARGET_US = 300000
+
+
+if IS_MICROPYTHON:
+    def _now_us():
+        return time.ticks_us()
+
+    def _elapsed_us(start):
+        return time.ticks_diff(time.ticks_us(), start)
+else:
+    def _now_us():
+        return time.perf_counter_ns() // 1000
+
+    def _elapsed_us(start):
+        return time.perf_counter_ns() // 1000 - start
+
+
+def _alloc_per_call(fn, calls):
+    """Return heap bytes allocated per call of `fn`."""
+    if IS_MICROPYTHON:
+        gc.collect()
+        gc.disable()
+        try:
+            before = gc.mem_alloc()
+            for _ in range(calls):
+                fn()
+            return (gc.mem_alloc() - before) / calls
+        finally:
+            gc.enable()
+
+    import tracemalloc
+    tracemalloc.start()
+    try:
+        fn()  # warm caches so only per-call allocations are counted
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        return peak - current
+    finally:
+        tracemalloc.stop()
+
+
+def measure(fn, target_us=TARGET_US):
+    """Time `fn` until roughly `target_us` has elapsed and return the figures."""
+    fn()
+    loops = 1
+    while True:
+        start = _now_us()
+        for _ in range(loops):
+            fn()
+        elapsed = _elapsed_us(start)
+        if elapsed >= target_us or loops >= 1 << 24:
+            break
+        if elapsed <= 0:
+            loops *= 10
+        else:
+            loops = max(loops * 2, int(loops * target_us * 1.2 / elapsed))
+    us_per_op = elapsed / loops
+    return {
+        'ops_per_s': round(1000000 / us_per_op, 1) if us_per_op else 0.0,
+        'us_per_op': round(us_per_op, 3),
+        'alloc_bytes_per_op': round(_alloc_per_call(fn, 100), 1),
+        'loops': loops,
+    }
+
+
+class NullRadio:
+    """ESP_COM stand-in for the SLAVE handler: a fixed MAC address, sent frames are dropped."""
+    last_peer = b'\x02\x00\x00\x00\x00\xfe'
+
+    def __init__(self, mac):
+        self.mac = mac
+
+    def get_mac(self):
+        return self.mac
+
+    def send_message(self, payload):
+        return True
+
+
+def build_cases():
+    """Instantiate the firmware codecs and return a list of (name, callable)."""
+    hostshim.install()
+    master_stats = hostshim.load_firmware('MASTER', 'stats')
+    master_ch = hostshim.load_firmware('MASTER', 'command_handler')
+    master_pc = hostshim.load_firmware('MASTER', 'pcCOM')
+    slave_ch = hostshim.load_firmware('SLAVE', 'command_handler')
+    slave_led = hostshim.load_firmware('SLAVE', 'ledControl')
+    binframe = hostshim.load_firmware('MASTER', 'binframe')
+
+    counters = master_stats.MasterStats()
+    master = master_ch.CMDHandler(None, counters)
+    slave = slave_ch.CMDHandler(None, None, None, None, None)
+    lamp = slave_ch.CMDHandler(NullRadio('aa:bb:cc:dd:ee:ff'), None, None, None, None)
+    uart = master_pc.UARTtoPC(1, 115200, 43, 44, [4, 5, 6, 7], counters)
+    led = slave_led.LEDController()
+
+    mac = 'aa:bb:cc:dd:ee:ff'
+    colour = [255, 128, 0, 64, 32, 16]
+    hex_colour = master.encode_to_hex_string(colour)
+    sens_payload = '23.45$45.67$123$1234.5'
+    to_lamp = master.encode_message(mac, 'COLR', hex_colour, 7)
+    from_lamp = slave.encode_message(mac, 'SENS', sens_payload, 7)
+    # The master sends '*'-framed messages and parses '#'-framed ones, the
+    # lamp does the opposite, so each side decodes what the other encodes.
+    raw_from_lamp = from_lamp.encode('utf-8')
+    raw_to_lamp = to_lamp.encode('utf-8')
+    frame_to_lamp = bytearray(raw_to_lamp)
+    frame_to_other = bytearray(master.encode_message('aa:bb:cc:dd:ee:00', 'COLR', hex_colour, 7).encode('utf-8'))
+    lamp.dedup.remember(NullRadio.last_peer, frame_to_lamp, None)
+    led_payload = '0255128000064032016'
+    pc_frame = '#COLR' + uart.pad_payload(led_payload)
+    pc_frame += uart.calculate_checksum('COLR' + uart.pad_payload(led_payload)) + '#'
+    pc_frame = pc_frame.encode('utf-8')
+
+    bin_frame = binframe.encode('SENS', sens_payload)
+    bin_body = bytes(bin_frame[:-1])
+
+    def receive_command():
+        uart.uart.feed(pc_frame)
+        return uart.receive_command()
+
+    return [
+        ('master.xor_checksum', lambda: master.xor_checksum(raw_to_lamp[1:56])),
+        ('master.encode_message', lambda: master.encode_message(mac, 'COLR', hex_colour, 7)),
+        ('master.decode_message', lambda: master.decode_message(from_lamp)),
+        ('master.encode_to_hex_string', lambda: master.encode_to_hex_string(colour)),
+        ('master.decode_sensor_data', lambda: master.decode_sensor_data(sens_payload)),
+        ('slave.xor_checksum', lambda: slave.xor_checksum(raw_from_lamp[1:56])),
+        ('slave.encode_message', lambda: slave.encode_message(mac, 'SENS', sens_payload, 7)),
+        ('slave.decode_message', lambda: slave.decode_message(to_lamp)),
+        ('slave.encode_to_hex_string', lambda: slave.encode_to_hex_string(colour)),
+        ('slave.decode_sensor_data', lambda: slave.decode_sensor_data(sens_payload)),
+        ('slave.accepts', lambda: lamp.accepts(frame_to_lamp)),
+        ('slave.accepts_other', lambda: lamp.accepts(frame_to_other)),
+        ('slave.decode_frame', lambda: lamp.decode_message(frame_to_lamp)),
+        ('slave.reply', lambda: lamp._CMDHandler__reply(b'SENS', sens_payload, 7)),
+        ('slave.dedup_lookup', lambda: lamp.dedup.lookup(NullRadio.last_peer, frame_to_lamp)),
+        ('uart.calculate_checksum', lambda: uart.calculate_checksum('COLR' + led_payload)),
+        ('uart.decode_string_led', lambda: uart.decode_string_led(led_payload)),
+        ('uart.receive_command', receive_command),
+        ('binframe.encode', lambda: binframe.encode('SENS', sens_payload)),
+        ('binframe.decode', lambda: binframe.decode(bin_body)),
+        ('led.hex_to_duty', lambda: led.hex_to_duty(hex_colour)),
+    ]
+
+
+def compare(results, baseline, threshold):
+    """Print a comparison table and return the names of regressed cases."""
+    regressions = []
+    print('{:<30} {:>12} {:>12} {:>8} {:>10}'.format('case', 'ops/s', 'base ops/s', 'delta', 'alloc B'))
+    for name in sorted(results):
+        current = results[name]
+        base = baseline.get(name)
+        if base and base.get('ops_per_s'):
+            delta = (current['ops_per_s'] - base['ops_per_s']) * 100 / base['ops_per_s']
+            flag = ''
+            if delta < -threshold:
+                flag = ' SLOWER'
+                regressions.append(name)
+            elif current['alloc_bytes_per_op'] > base.get('alloc_bytes_per_op', 0) * 1.05 + 8:
+                flag = ' MORE-ALLOC'
+                regressions.append(name)
+            print('{:<30} {:>12.1f} {:>12.1f} {:>7.1f}% {:>10.1f}{}'.format(
+                name, current['ops_per_s'], base['ops_per_s'], delta, current['alloc_bytes_per_op'], flag))
+        else:
+            print('{:<30} {:>12.1f} {:>12} {:>8} {:>10.1f}'.format(
+                name, current['ops_per_s'], '-', '-', current['alloc_bytes_per_op']))
+    return regressions
+
+
+def load_json(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except OSError:
+        return {}
+
+
+def parse_args(argv):
+    """Minimal argument parser (argparse is not available on MicroPython)."""
+    options = {
+        'out': DEFAULT_OUT,
+        'baseline': DEFAULT_BASELINE,
+        'save_baseline': False,
+        'threshold': DEFAULT_THRESHOLD,
+        'only': None,
+        'target_us': TARGET_US,
+        'help': False,
+    }
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg == '--out':
+            i += 1
+            options['out'] = argv[i]
+        elif arg == '--baseline':
+            i += 1
+            options['baseline'] = argv[i]
+        elif arg == '--save-baseline':
+            options['save_baseline'] = True
+        elif arg == '--threshold':
+            i += 1
+            options['threshold'] = float(argv[i])
+        elif arg == '--only':
+            i += 1
+            options['only'] = argv[i]
+        elif arg == '--quick':
+            options['target_us'] = TARGET_US // 10
+        elif arg in ('-h', '--help'):
+            options['help'] = True
+        else:
+            raise ValueError("Unknown argument: " + arg)
+        i += 1
+    return options
+
+
+def main(argv):
+    try:
+        options = parse_args(argv)
+    except (ValueError, IndexError) as e:
+        print(e if isinstance(e, ValueError) else "Missing value for " + argv[-1])
+        print(__doc__)
+        return 2
+    if options['help']:
+        print(__doc__)
+        return 0
+    impl = sys.implementation.name
+    results = {}
+    for name, fn in build_cases():
+        if options['only'] and options['only'] not in name:
+            continue
+        results[name] = measure(fn, options['target_us'])
+
+    report = {
+        'implementation': impl,
+        'version': sys.version,
+        'platform': sys.platform,
+        'results': results,
+    }
+    with open(options['out'], 'w') as f:
+        json.dump(report, f)
+
+    baselines = load_json(options['baseline'])
+    regressions = compare(results, baselines.get(impl, {}), options['threshold'])
+
+    if options['save_baseline']:
+        baselines[impl] = results
+        with open(options['baseline'], 'w') as f:
+            json.dump(baselines, f)
+        print("Baseline for", impl, "saved to", options['baseline'])
+    elif regressions:
+        print("Regressions:", ', '.join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,76 @@
+"""
+Helpers to import the MASTER and SLAVE firmware modules on a host.
+
+Works on CPython and on the MicroPython unix port. Both firmware trees use
+the same flat module names (command_handler, espnowcom, ...), so modules
+are loaded one tree at a time and dropped from sys.modules again.
+"""
+import gc
+import sys
+import time
+
+import shim_espnow
+import shim_machine
+import shim_micropython
+import shim_network
+
+
+def bench_dir():
+    """Return the BENCHMARK directory, derived from this file's location."""
+    path = __file__.replace('\\', '/')
+    if '/' not in path:
+        return '.'
+    return path.rsplit('/', 1)[0]
+
+
+def repo_root():
+    """Return the repository root, derived from this file's location."""
+    path = __file__.replace('\\', '/')
+    if '/' not in path:
+        return '..'
+    bench_dir = path.rsplit('/', 1)[0]
+    if '/' not in bench_dir:
+        return '.'
+    return bench_dir.rsplit('/', 1)[0]
+
+
+def install():
+    """Replace hardware modules with host stand-ins and add MicroPython time helpers."""
+    sys.modules['machine'] = shim_machine
+    sys.modules['network'] = shim_network
+    sys.modules['espnow'] = shim_espnow
+    if sys.implementation.name != 'micropython':
+        import binascii
+        sys.modules['micropython'] = shim_micropython
+        sys.modules['ubinascii'] = binascii
+        sys.modules['utime'] = time
+        gc.mem_free = lambda: 0
+        gc.mem_alloc = lambda: 0
+    if not hasattr(time, 'ticks_ms'):
+        # CPython: provide the MicroPython ticks API on top of perf_counter
+        time.ticks_ms = lambda: int(time.perf_counter() * 1000)
+        time.ticks_us = lambda: int(time.perf_counter() * 1000000)
+        time.ticks_diff = lambda new, old: new - old
+        time.ticks_add = lambda ticks, delta: ticks + delta
+        time.sleep_ms = lambda ms: time.sleep(ms / 1000)
+        time.sleep_us = lambda us: time.sleep(us / 1000000)
+
+
+def load_firmware(tree, modname, keep=()):
+    """
+    Import `modname` from MASTER or SLAVE without leaking it into sys.modules.
+
+    Modules listed in `keep` (e.g. shared state like `variabels`) stay
+    loaded so the caller can inspect them.
+    """
+    path = repo_root() + '/' + tree
+    before = set(sys.modules)
+    sys.path.insert(0, path)
+    try:
+        module = __import__(modname)
+    finally:
+        sys.path.pop(0)
+        for name in list(sys.modules):
+            if name not in before and name not in keep:
+                del sys.modules[name]
+    return module
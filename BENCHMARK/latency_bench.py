@@ -0,0 +1,201 @@
+"""
+End-to-end latency harness for PC -> master -> lamp -> master -> PC round-trips.
+
+Drives a master over serial (a real dongle or master_sim.py) with paced
+commands and reports p50/p95/p99 latency per command type, for several lamp
+counts and offered loads:
+
+    python latency_bench.py --port COM5 --commands HRBT,COLR,SENS --lamp-counts 1,3 --rates 1,4
+    python latency_bench.py --port socket://localhost:7007 --baseline latency_baseline.json
+    python latency_bench.py --port COM5 --binary 921600
+
+After every reply the master's TIME command is queried, which returns the
+master-side stage durations of that command:
+
+    rx_tx     PC command accepted -> radio frame sent (send timer wait)
+    tx_ack    radio frame sent -> first lamp reply handled (radio + lamp + poll)
+    ack_reply lamp reply handled -> reply written to the PC
+
+`host` is what is left of the service time: serial transfer both ways and
+the master's UART poll. `total` is measured from the scheduled send time,
+so it includes queueing when the offered load exceeds what the link can do.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'HOST'))
+import pclink  # noqa: E402
+
+REPLIES = ("OKAY", "NACK", "BUSY", "SENS")
+METRICS = ("total", "service", "rx_tx", "tx_ack", "ack_reply", "host")
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an unsorted list."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def build_payload(command, index, song):
+    if command == "COLR":
+        return f"{index}" + "".join(f"{random.randint(0, 255):03}" for _ in range(6))
+    if command == "TONE":
+        return f"{index}{song}"
+    return f"{index}"
+
+
+def fetch_stages(link):
+    """Query TIME and return the stage durations in ms (None if not reached)."""
+    reply = link.request("TIME", replies=("TIME",), timeout=2.0)
+    if reply is None:
+        return None
+    parts = reply[1].split("$")
+    if len(parts) != 4:
+        return None
+    stages = {}
+    for name, value in zip(("rx_tx", "tx_ack", "ack_reply"), parts[1:]):
+        value = int(value)
+        stages[name] = value / 1000 if value >= 0 else None
+    return stages
+
+
+def run_series(link, command, lamps, rate, count, song, stages, timeout):
+    """Send `count` paced commands spread over `lamps` lamps and collect samples."""
+    period = 1.0 / rate
+    samples = []
+    outcome = {"OKAY": 0, "NACK": 0, "BUSY": 0, "TIMEOUT": 0}
+    start = time.perf_counter()
+    for k in range(count):
+        scheduled = start + k * period
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        index = k % lamps
+        sent_at = link.send(command, build_payload(command, index, song))
+        while True:
+            frame = link.wait_for(REPLIES, timeout)
+            # TONE answers BUSY first and OKAY once the song has played
+            if frame is None or not (command == "TONE" and frame[0] == "BUSY"):
+                break
+        if frame is None:
+            outcome["TIMEOUT"] += 1
+            continue
+        reply = "OKAY" if frame[0] == "SENS" else frame[0]
+        outcome[reply] += 1
+        if reply != "OKAY":
+            continue
+        sample = {
+            "lamp": index,
+            "total": (frame[2] - scheduled) * 1000,
+            "service": (frame[2] - sent_at) * 1000,
+        }
+        if stages:
+            master = fetch_stages(link)
+            if master and None not in master.values():
+                sample.update(master)
+                sample["host"] = sample["service"] - sum(master.values())
+        samples.append(sample)
+    return samples, outcome
+
+
+def summarize(samples):
+    summary = {}
+    for metric in METRICS:
+        values = [s[metric] for s in samples if metric in s]
+        if values:
+            summary[metric] = {
+                "p50": round(percentile(values, 50), 3),
+                "p95": round(percentile(values, 95), 3),
+                "p99": round(percentile(values, 99), 3),
+                "max": round(max(values), 3),
+            }
+    return summary
+
+
+def print_report(results, baseline):
+    print(f"{'series':<22} {'ok':>4} {'fail':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+          f" {'rx_tx':>8} {'tx_ack':>8} {'ack_rep':>8} {'host':>8} {'p95 vs base':>12}")
+    for key, result in results.items():
+        total = result["summary"].get("total")
+        failed = sum(v for k, v in result["outcome"].items() if k != "OKAY")
+        if total is None:
+            print(f"{key:<22} {result['outcome']['OKAY']:>4} {failed:>5}   no successful samples")
+            continue
+        stage = [result["summary"].get(m, {}).get("p50") for m in ("rx_tx", "tx_ack", "ack_reply", "host")]
+        stage = [f"{v:>8.1f}" if v is not None else f"{'-':>8}" for v in stage]
+        delta = "-"
+        base = baseline.get(key, {}).get("summary", {}).get("total")
+        if base:
+            delta = f"{(total['p95'] - base['p95']) * 100 / base['p95']:+.1f}%"
+        print(f"{key:<22} {result['outcome']['OKAY']:>4} {failed:>5} {total['p50']:>9.1f} {total['p95']:>9.1f}"
+              f" {total['p99']:>9.1f} {' '.join(stage)} {delta:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PC->lamp->PC latency benchmark")
+    parser.add_argument("--port", default="socket://localhost:7007", help="serial port or pyserial URL")
+    parser.add_argument("--baudrate", type=int, default=115200)
+    parser.add_argument("--binary", type=int, metavar="BAUD", help="switch the master to binary frames at this baud rate")
+    parser.add_argument("--commands", default="HRBT,COLR,SENS", help="comma separated, TONE also supported")
+    parser.add_argument("--lamp-counts", default="1", help="comma separated numbers of lamps to spread over")
+    parser.add_argument("--rates", default="2", help="comma separated offered loads in commands/s")
+    parser.add_argument("--count", type=int, default=30, help="commands per series")
+    parser.add_argument("--song", default="STARUP", help="song used for TONE")
+    parser.add_argument("--timeout", type=float, default=15.0, help="reply timeout in seconds")
+    parser.add_argument("--no-stages", action="store_true", help="skip the TIME query after each reply")
+    parser.add_argument("--out", default=os.path.join(BENCH_DIR, "latency_results.json"),
+                        help="results file, in this directory by default")
+    parser.add_argument("--baseline", default=None, help="earlier results file to compare p95 against")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    link = pclink.MasterLink(args.port, args.baudrate, binary=args.binary)
+    macs = link.search()
+    if not macs:
+        print("No lamps found.")
+        return 1
+    print(f"Found {len(macs)} lamps: {', '.join(macs)}")
+
+    results = {}
+    for command in args.commands.split(","):
+        for lamps in (int(n) for n in args.lamp_counts.split(",")):
+            if lamps > len(macs):
+                print(f"Skipping {lamps} lamps, only {len(macs)} found")
+                continue
+            for rate in (float(r) for r in args.rates.split(",")):
+                key = f"{command}/{lamps}lamps/{rate:g}hz"
+                samples, outcome = run_series(link, command, lamps, rate, args.count,
+                                              args.song, not args.no_stages, args.timeout)
+                results[key] = {
+                    "command": command,
+                    "lamps": lamps,
+                    "rate": rate,
+                    "outcome": outcome,
+                    "summary": summarize(samples),
+                    "samples": samples,
+                }
+    link.close()
+
+    baseline = {}
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f).get("results", {})
+    print_report(results, baseline)
+    with open(args.out, "w") as f:
+        json.dump({"port": args.port, "lamps": macs, "results": results}, f, indent=1)
+    print(f"Results written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,304 @@
+"""
+Local stand-in for a master dongle with a room of lamps (CPython only).
+
+Runs the real MASTER firmware (MASTER/main.py) and the real SLAVE command
+handler on the host. Hardware modules are replaced by the shims in this
+directory: MicroPython timers become a scheduler thread that runs callbacks
+one at a time, ESP-NOW becomes a simulated broadcast medium with
+configurable latency and loss, and the master's UART is exposed on a TCP
+port so host tools can connect with pyserial:
+
+    python master_sim.py --lamps 4 --port 7007
+    python latency_bench.py --port socket://localhost:7007
+"""
+import argparse
+import heapq
+import os
+import queue
+import random
+import socket
+import sys
+import threading
+import time
+
+import hostshim
+import shim_espnow
+import shim_machine
+import shim_network
+
+
+def log(*args):
+    print(*args, file=sys.stderr, flush=True)
+
+
+class TimerScheduler:
+    """Runs shim Timer callbacks in one thread, like the MicroPython scheduler."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._wakeup = threading.Condition(self.lock)
+        self._queue = []
+        self._generation = {}
+        self._counter = 0
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def arm(self, timer):
+        with self.lock:
+            generation = self._generation.get(id(timer), 0) + 1
+            self._generation[id(timer)] = generation
+            self._counter += 1
+            due = time.monotonic() + timer.period / 1000
+            heapq.heappush(self._queue, (due, self._counter, generation, timer))
+            self._wakeup.notify()
+
+    def cancel(self, timer):
+        with self.lock:
+            self._generation[id(timer)] = self._generation.get(id(timer), 0) + 1
+
+    def _run(self):
+        with self.lock:
+            while True:
+                if not self._queue:
+                    self._wakeup.wait()
+                    continue
+                due, _, generation, timer = self._queue[0]
+                now = time.monotonic()
+                if due > now:
+                    self._wakeup.wait(due - now)
+                    continue
+                heapq.heappop(self._queue)
+                if generation != self._generation.get(id(timer)) or timer.callback is None:
+                    continue
+                callback = timer.callback
+                if timer.mode == shim_machine.Timer.PERIODIC:
+                    self._counter += 1
+                    heapq.heappush(self._queue, (due + timer.period / 1000, self._counter, generation, timer))
+                try:
+                    callback(timer)
+                except Exception as e:
+                    log("Timer callback raised:", repr(e))
+
+
+class RadioMedium:
+    """Broadcast medium: every frame reaches every other station after a delay."""
+
+    def __init__(self, latency_ms, jitter_ms, loss):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.loss = loss
+        self.stations = []
+        self.frames = 0
+        self.dropped = 0
+
+    def attach(self, station):
+        self.stations.append(station)
+
+    def transmit(self, sender_mac, peer_mac, msg):
+        self.frames += 1
+        for station in self.stations:
+            if station.mac == sender_mac:
+                continue
+            if random.random() < self.loss:
+                self.dropped += 1
+                continue
+            delay = (self.latency_ms + random.uniform(0, self.jitter_ms)) / 1000
+            threading.Timer(delay, station.deliver, (sender_mac, msg)).start()
+
+
+class SimSensor:
+    """Sensor stand-in with the blocking read time of the real I2C sensors, checked against the alarm rules."""
+
+    def __init__(self, read_ms, rules=None):
+        self.read_ms = read_ms
+        self.rules = rules
+
+    def read_values(self):
+        time.sleep(self.read_ms / 1000)
+        values = (21 + random.uniform(-1, 1), 45 + random.uniform(-5, 5), random.randint(50, 300),
+                  round(random.uniform(100, 800), 3))
+        if self.rules is not None:
+            self.rules.evaluate(values)
+        return values
+
+    def sample_if_due(self):
+        if self.rules is not None and self.rules.sample_due():
+            self.read_values()
+
+    def get_sensor_data(self):
+        temperature, humidity, tvoc, lux = self.read_values()
+        return f"{temperature:.2f}${humidity:.2f}${tvoc}${lux}"
+
+
+class SimLamp:
+    """One lamp: real SLAVE CMDHandler driven by its own receive thread."""
+
+    def __init__(self, index, medium, firmware, sensor_ms):
+        self.mac = bytes([0x02, 0x00, 0x00, 0x00, 0x10, index])
+        self.rssi = -40 - 4 * index
+        self.medium = medium
+        self.last_peer = None
+        self._peers = {}
+        self._inbox = queue.Queue()
+        self.led = firmware['ledControl'].LEDController()
+        self.buzzer = firmware['soundControl'].Buzzer(pin=9)
+        self.buzzer.add_song("STARUP", firmware['sounds'].startup_sound)
+        self.buzzer.add_song("ALARM", firmware['sounds'].alarm_sound)
+        self.health = firmware['telemetry'].LampTelemetry(self)
+        # Settings are kept in RAM, the simulated lamps don't share a flash file
+        self.config = firmware['config'].LampConfig(None)
+        self.scenes = firmware['scenes'].SceneTable(None)
+        self.rules = firmware['rules'].RuleTable(self.led, self.scenes, self.buzzer, None)
+        self.sensor = SimSensor(sensor_ms, self.rules)
+        self.handler = firmware['command_handler'].CMDHandler(self, self.led, self.sensor, self.buzzer,
+                                                              self.health, self.config, self.scenes, self.rules)
+        medium.attach(self)
+        threading.Thread(target=self._run, daemon=True).start()
+
+    # ESP_COM interface used by the SLAVE CMDHandler
+    def get_mac(self):
+        return ':'.join(f"{b:02x}" for b in self.mac)
+
+    def send_message(self, payload):
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        # Copied like ESP-NOW does, the lamp reuses its reply buffer
+        self.medium.transmit(self.mac, b'\xff' * 6, bytes(payload))
+        return True
+
+    def set_channel(self, channel):
+        # The simulated radio has one channel, run a simulator per master instead
+        self.channel = channel
+
+    def peers(self):
+        return self._peers
+
+    def peer_rssi(self, mac):
+        return self._peers.get(mac, [0])[0]
+
+    def deliver(self, mac, msg):
+        self._inbox.put((mac, msg))
+
+    def _run(self):
+        # Same loop body as SLAVE/main.py
+        health = self.health
+        while True:
+            self.led.service()
+            try:
+                mac, msg = self._inbox.get(timeout=0.02)
+            except queue.Empty:
+                self.sensor.sample_if_due()
+                for event in self.rules.take_events():
+                    self.handler.push_event("ALRM", event)
+                self.rules.play()
+                continue
+            loop_start = time.ticks_us()
+            self.last_peer = mac
+            self._peers[mac] = [self.rssi, time.ticks_ms()]
+            health.frame_received()
+            frame = bytearray(msg)
+            if not self.handler.accepts(frame):
+                continue
+            try:
+                source, command, seq, payload = self.handler.decode_message(frame)
+            except Exception:
+                health.decode_failed()
+                continue
+            health.frame_decoded(source, command)
+            handler_start = time.ticks_ms()
+            try:
+                self.handler.handle_command(source, command, payload, seq, frame)
+            except Exception as e:
+                health.handler_failed()
+                log("Lamp", self.get_mac(), "handler error:", repr(e))
+            health.handler_time(time.ticks_diff(time.ticks_ms(), handler_start))
+            health.loop_time(time.ticks_diff(time.ticks_us(), loop_start))
+
+
+def load_slave_firmware():
+    names = ('command_handler', 'config', 'ledControl', 'rules', 'scenes', 'soundControl', 'sounds', 'telemetry')
+    return {name: hostshim.load_firmware('SLAVE', name) for name in names}
+
+
+def start_master(scheduler, medium):
+    """Import MASTER/main.py with the shims wired to the simulator."""
+    shim_network.next_mac = b'\x02\x00\x00\x00\x00\xfe'
+    shim_espnow.medium = medium
+    shim_machine.Timer.scheduler = scheduler
+    sys.path.insert(0, os.path.join(hostshim.repo_root(), 'MASTER'))
+    with scheduler.lock:
+        import main as master_main
+        # Button actions and the channel are kept in RAM, like the settings of the simulated lamps
+        master_main.button_actions.path = None
+        master_main.com.channel_path = None
+    return master_main
+
+
+def serve_uart(uart, scheduler, port):
+    """Bridge the master UART to one TCP client at a time."""
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('127.0.0.1', port))
+    server.listen(1)
+    log(f"Master UART on socket://localhost:{port}")
+    while True:
+        conn, address = server.accept()
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        log("Host connected from", address)
+
+        def forward(data, conn=conn):
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            try:
+                conn.sendall(data)
+            except OSError:
+                pass
+
+        uart.on_write = forward
+        while True:
+            try:
+                data = conn.recv(4096)
+            except OSError:
+                data = b""
+            if not data:
+                break
+            with scheduler.lock:
+                uart.feed(data)
+        uart.on_write = None
+        conn.close()
+        log("Host disconnected")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--port', type=int, default=7007, help='TCP port for the master UART')
+    parser.add_argument('--lamps', type=int, default=3, help='number of simulated lamps')
+    parser.add_argument('--first-lamp', type=int, default=0,
+                        help='number of the first lamp, so simulators run side by side have different lamps')
+    parser.add_argument('--latency-ms', type=float, default=2.0, help='one-way radio latency')
+    parser.add_argument('--jitter-ms', type=float, default=1.0, help='uniform extra radio latency')
+    parser.add_argument('--loss', type=float, default=0.0, help='probability that a frame is lost')
+    parser.add_argument('--sensor-ms', type=float, default=160.0, help='blocking sensor read time')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--verbose', action='store_true', help='show firmware print() output')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    if not args.verbose:
+        sys.stdout = open(os.devnull, 'w')
+
+    hostshim.install()
+    firmware = load_slave_firmware()
+    medium = RadioMedium(args.latency_ms, args.jitter_ms, args.loss)
+    lamps = [SimLamp(args.first_lamp + i, medium, firmware, args.sensor_ms) for i in range(args.lamps)]
+    log(f"{len(lamps)} lamps:", ', '.join(lamp.get_mac() for lamp in lamps))
+
+    scheduler = TimerScheduler()
+    master = start_master(scheduler, medium)
+    try:
+        serve_uart(master.pc_handler.uart, scheduler, args.port)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
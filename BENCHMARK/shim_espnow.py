@@ -0,0 +1,57 @@
+"""
+Host stand-in for the MicroPython `espnow` module.
+
+Frames are exchanged through `medium`, an object installed by a simulator
+with a `transmit(sender_mac, peer_mac, msg)` method. Without a medium,
+sent frames are dropped.
+"""
+import shim_network
+
+medium = None
+
+
+class ESPNow:
+    def __init__(self):
+        self.mac = shim_network.current_mac
+        self._inbox = []
+        self._active = False
+        self.peers_table = {}
+        if medium is not None:
+            medium.attach(self)
+
+    def active(self, flag=None):
+        if flag is None:
+            return self._active
+        self._active = bool(flag)
+
+    def config(self, **kwargs):
+        pass
+
+    def add_peer(self, mac, *args, **kwargs):
+        return None
+
+    def deliver(self, mac, msg, rssi=-50):
+        """Called by the medium when a frame arrives for this interface."""
+        self.peers_table[mac] = [rssi, 0]
+        self._inbox.append((mac, msg))
+
+    def any(self):
+        return len(self._inbox) > 0
+
+    def recv(self, timeout_ms=None):
+        if not self._inbox:
+            return None, None
+        return self._inbox.pop(0)
+
+    def irecv(self, timeout_ms=None):
+        if not self._inbox:
+            return None, None
+        mac, msg = self._inbox.pop(0)
+        return mac, bytearray(msg)
+
+    def send(self, mac, msg, sync=True):
+        if isinstance(msg, str):
+            msg = msg.encode('utf-8')
+        if medium is not None:
+            medium.transmit(self.mac, mac, bytes(msg))
+        return True
@@ -0,0 +1,142 @@
+"""
+Host stand-in for the MicroPython `machine` module.
+
+Only the pieces the MASTER and SLAVE firmware touch are provided, so the
+firmware modules can be imported and exercised on CPython or on the
+MicroPython unix port (which has no UART, PWM or Timer).
+"""
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 1
+    IRQ_RISING = 2
+
+    def __init__(self, pin_id, mode=IN, pull=None, value=0):
+        self.pin_id = pin_id
+        self._value = value
+
+    def value(self, val=None):
+        if val is None:
+            return self._value
+        self._value = 1 if val else 0
+
+    def on(self):
+        self._value = 1
+
+    def off(self):
+        self._value = 0
+
+    def irq(self, handler=None, trigger=None):
+        self._handler = handler
+
+
+class PWM:
+    def __init__(self, pin, freq=1000, duty_u16=0):
+        self.pin = pin
+        self._freq = freq
+        self._duty = duty_u16 >> 6
+
+    def freq(self, value=None):
+        if value is None:
+            return self._freq
+        self._freq = value
+
+    def duty(self, value=None):
+        if value is None:
+            return self._duty
+        self._duty = value
+
+    def duty_u16(self, value=None):
+        if value is None:
+            return self._duty << 6
+        self._duty = value >> 6
+
+
+class UART:
+    def __init__(self, uart_num, baudrate=115200, tx=None, rx=None, rxbuf=256):
+        self.uart_num = uart_num
+        self.baudrate = baudrate
+        self._rx = b""
+        self.written = []
+        # Set by a simulator to forward TX bytes instead of collecting them
+        self.on_write = None
+
+    def feed(self, data):
+        """Queue bytes as if they had arrived on the RX line."""
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self._rx += data
+
+    def any(self):
+        return len(self._rx)
+
+    def read(self, nbytes=None):
+        if not self._rx:
+            return None
+        if nbytes is None:
+            nbytes = len(self._rx)
+        data = self._rx[:nbytes]
+        self._rx = self._rx[nbytes:]
+        return data
+
+    def init(self, baudrate=None, **kwargs):
+        if baudrate is not None:
+            self.baudrate = baudrate
+
+    def flush(self):
+        pass
+
+    def write(self, data):
+        if self.on_write is not None:
+            self.on_write(data)
+        else:
+            self.written.append(data)
+        return len(data)
+
+
+class Timer:
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    # A simulator installs an object with arm(timer)/cancel(timer) here to
+    # actually run the callbacks; without one timers never fire.
+    scheduler = None
+
+    def __init__(self, timer_id):
+        self.timer_id = timer_id
+        self.callback = None
+
+    def init(self, period=0, mode=PERIODIC, callback=None):
+        self.period = period
+        self.mode = mode
+        self.callback = callback
+        if Timer.scheduler is not None:
+            Timer.scheduler.arm(self)
+
+    def deinit(self):
+        self.callback = None
+        if Timer.scheduler is not None:
+            Timer.scheduler.cancel(self)
+
+
+class I2C:
+    def __init__(self, bus_id, scl=None, sda=None, freq=400000):
+        self.bus_id = bus_id
+
+    def _absent(self, *args, **kwargs):
+        raise OSError("no I2C device on host")
+
+    writeto = _absent
+    readfrom_into = _absent
+    readfrom_mem = _absent
+    readfrom_mem_into = _absent
+    writeto_mem = _absent
+
+
+def reset():
+    # A reset is not simulated: the firmware keeps running after an update
+    pass
@@ -0,0 +1,15 @@
+"""
+Host stand-in for the MicroPython `micropython` module.
+"""
+
+
+def const(value):
+    return value
+
+
+def schedule(func, arg):
+    func(arg)
+
+
+def alloc_emergency_exception_buf(size):
+    pass
@@ -0,0 +1,38 @@
+"""
+Host stand-in for the MicroPython `network` module (station interface only).
+"""
+
+STA_IF = 0
+AP_IF = 1
+
+# MAC address handed to the next WLAN interface; set by a simulator
+next_mac = b'\x02\x00\x00\x00\x00\x01'
+current_mac = next_mac
+
+
+class WLAN:
+    def __init__(self, interface=STA_IF):
+        global current_mac
+        self.interface = interface
+        self._mac = next_mac
+        self._active = False
+        self._channel = 1
+        current_mac = self._mac
+
+    def active(self, flag=None):
+        if flag is None:
+            return self._active
+        self._active = bool(flag)
+
+    def disconnect(self):
+        pass
+
+    def config(self, *args, **kwargs):
+        if args:
+            if args[0] == 'mac':
+                return self._mac
+            if args[0] == 'channel':
+                return self._channel
+            raise ValueError("unknown config param")
+        if 'channel' in kwargs:
+            self._channel = kwargs['channel']
@@ -2,6 +2,10 @@ import serial
 import serial.tools.list_ports
 import os
 
+# Lamp index characters of commands and search answers, as in HOST/gateway.py: chr(48 + index) without
+# '@', 'N' and 'S'. A master has up to 10 lamps ('0' to '9'), a fleet of masters behind the gateway more.
+LAMP_CHARS = "".join(chr(code) for code in range(48, 127) if chr(code) not in "@NS")
+
 class SerialDeviceManager:
     def __init__(self):
         self.serial_conn = None
@@ -14,15 +18,12 @@ class SerialDeviceManager:
         return [(port.device, port.description) for port in ports]
 
     def select_serial_port(self):
-        """Prompt the user to select a serial port by index."""
-        ports = self.list_serial_ports()
-        if not ports:
-            print("No serial ports found.")
-            return None
+        """Prompt the user to select a serial port by index, or the gateway (HOST/gateway.py)."""
+        ports = self.list_serial_ports() + [("socket://localhost:7008", "gateway")]
         for idx, (port, desc) in enumerate(ports):
             print(f"{idx}: {port} ({desc})")
         selection = int(input("Select a serial port by index: "))
-        self.serial_conn = serial.Serial(ports[selection][0], 115200, timeout=1)
+        self.serial_conn = serial.serial_for_url(ports[selection][0], baudrate=115200, timeout=1)
 
     @staticmethod
     def calculate_checksum(data):
@@ -32,6 +33,11 @@ class SerialDeviceManager:
             checksum ^= ord(char)
         return f"{checksum:03}"
 
+    @staticmethod
+    def lamp_char(index):
+        """Lamp index as the one character of the payload: 0-9, then ':', ';' ... (a fleet through the gateway)."""
+        return LAMP_CHARS[index]
+
     def format_command(self, command, payload):
         """Format the command with the payload and checksum."""
         payload = (payload + "@" * 32)[:32]
@@ -111,7 +117,7 @@ class SerialDeviceManager:
                     if command == "MACN":
                         print("No MAC addresses found.")
                         break
-                    mac_index = int(command[3])
+                    mac_index = LAMP_CHARS.find(command[3])
                     mac_address = payload.strip("@")
                     self.mac_addresses.append(mac_address)
                 elif command == "OKAY":
@@ -166,7 +172,7 @@ class SerialDeviceManager:
             print(f"{idx}: {mac}")
         index = int(input("Select a MAC address index: "))
         colors = [int(input(f"Enter value for {color} (0-255): ")) for color in ["R", "G", "B", "W", "A", "UV"]]
-        payload = f"{index:01}" + "".join([f"{color:03}" for color in colors])
+        payload = self.lamp_char(index) + "".join([f"{color:03}" for color in colors])
         self.send_command("COLR", payload)
 
     def turn_off_led(self):
@@ -175,7 +181,7 @@ class SerialDeviceManager:
         for idx, mac in enumerate(self.mac_addresses):
             print(f"{idx}: {mac}")
         index = int(input("Select a MAC address index: "))
-        payload = f"{index:01}" + "000000000000000000"
+        payload = self.lamp_char(index) + "000000000000000000"
         self.send_command("COLR", payload)
 
     def set_preset_color(self):
@@ -203,7 +209,7 @@ class SerialDeviceManager:
         preset_index = int(input("Enter a preset color index: "))
         if 0 <= preset_index < len(preset_colors):
             _, colors = preset_colors[preset_index]
-            payload = f"{index:01}" + "".join([f"{color:03}" for color in colors])
+            payload = self.lamp_char(index) + "".join([f"{color:03}" for color in colors])
             self.send_command("COLR", payload)
         else:
             print("Invalid preset color index.")
@@ -223,7 +229,7 @@ class SerialDeviceManager:
         for idx, mac in enumerate(self.mac_addresses):
             print(f"{idx}: {mac}")
         index = int(input("Select a MAC address index: "))
-        payload = f"{index:01}"
+        payload = self.lamp_char(index)
         sensor_payload = self.send_command("SENS", payload)
         if sensor_payload:
             self.decode_sensor_payload(sensor_payload)
@@ -235,7 +241,7 @@ class SerialDeviceManager:
             print(f"{idx}: {mac}")
         index = int(input("Select a MAC address index: "))
         tone = input("Enter the buzzer sound value (uppercase): ").strip().upper()
-        payload = f"{index:01}{tone}"
+        payload = self.lamp_char(index) + tone
         formatted_command = self.format_command("TONE", payload)
         self.serial_conn.write(formatted_command.encode())
 
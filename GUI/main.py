@@ -9,6 +9,19 @@ import serial
 import serial.tools.list_ports
 import time
 import threading
+from collections import deque
+from sensor_store import SensorStore
+from sensor_chart import SensorChartWindow
+
+# Frame port of HOST/gateway.py
+GATEWAY_URL = "socket://localhost:7008"
+# Seconds to wait for the answer to a command before it counts as lost
+REPLY_TIMEOUT = 5.0
+# Frames that end the answer to a command
+FINAL_REPLIES = ("OKAY", "NACK", "BUSY", "MACN", "SENS")
+# Lamp index characters of commands and search answers, as in HOST/gateway.py: chr(48 + index) without
+# '@', 'N' and 'S'. A master has up to 10 lamps ('0' to '9'), a fleet of masters behind the gateway more.
+LAMP_CHARS = "".join(chr(code) for code in range(48, 127) if chr(code) not in "@NS")
 
 class DisplayApp:
     def __init__(self, root):
@@ -23,6 +36,23 @@ class DisplayApp:
 
         # Save lamp Data in Dictionary 
         self.lamp_data = {}
+
+        # Sensor history of all lamps (SQLite)
+        self.history_file = "sensor_history.db"
+        self.sensor_store = SensorStore(self.history_file)
+
+        # MAC addresses reported by the master, position = index used in commands
+        self.master_macs = []
+        # Online state per MAC, from the master's LIVE events
+        self.lamp_online = {}
+        # Command waiting for its answer: (command, MAC of a SENS poll or None, deadline)
+        self.in_flight = None
+        # Commands of the user, sent before the next sensor poll
+        self.outbox = deque()
+        self.last_command = None
+        self.next_sens_index = 0
+        # Open chart window, if any
+        self.chart_window = None
         
         # No lamp should be selected
         self.current_lamp = None
@@ -40,6 +70,28 @@ class DisplayApp:
         self.slider_widget()
 
         self.root.after(25,self.read_serial_data)
+        self.root.after(1000, self.poll_sensors)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
+    def on_close(self):
+        # Write buffered sensor readings before exiting
+        self.sensor_store.close()
+        self.root.destroy()
+
+    def open_charts(self):
+        if self.chart_window is not None:
+            self.chart_window.lift()
+            return
+        # Named lamps, lamps found by the master and lamps that only have history
+        lamps = {}
+        for lamp_id in list(self.lamp_data) + self.master_macs + self.sensor_store.lamps():
+            lamps[lamp_id] = self.lamp_data.get(lamp_id, {}).get("name", lamp_id)
+        self.chart_window = SensorChartWindow(self.root, self.sensor_store, lamps, self.current_lamp)
+        self.chart_window.protocol("WM_DELETE_WINDOW", self.close_charts)
+
+    def close_charts(self):
+        self.chart_window.destroy()
+        self.chart_window = None
 
     def slider_widget(self):
         
@@ -95,6 +147,11 @@ class DisplayApp:
         #settings_menu.add_command(label="Change Icon", command=self.change_icon)
         settings_menu.add_command(label="Ident Lamp", command=self.ident_lamp)
         
+        # Create Submenu for charts
+        view_menu = tk.Menu(menubar, tearoff=0)
+        menubar.add_cascade(label="View", menu=view_menu)
+        view_menu.add_command(label="Sensor Charts", command=self.open_charts)
+
         # Create Submenu for mode
         mode_menu = tk.Menu(menubar, tearoff=0)
         menubar.add_cascade(label="Mode", menu=mode_menu)
@@ -104,6 +161,8 @@ class DisplayApp:
         
         self.port_menu = tk.Menu(menubar, tearoff=0)
         self.port_menu.add_command(label="Refresh Ports", command=self.refresh_ports)
+        # Shares the master with other programs through HOST/gateway.py
+        self.port_menu.add_command(label=f"Gateway ({GATEWAY_URL})", command=lambda: self.select_port(GATEWAY_URL))
         menubar.add_cascade(label="Serial Ports", menu=self.port_menu)
 
         self.refresh_ports()
@@ -164,10 +223,9 @@ class DisplayApp:
         for lamp_number, lamp_info in self.lamp_data.items():
             # lambda gives the Loop Variable to the Method
             btn = tk.Button(self.button_frame, text=lamp_info["name"], command=lambda ln=lamp_number: self.display_lamp_data(ln))
-            if not self.check_connection(lamp_number):
-                btn.config(highlightbackground="red", highlightthickness=2)
             btn.pack(side=tk.LEFT, padx=5)
             self.lamp_buttons[lamp_number] = btn
+            self.show_connection(lamp_number)
 
         if self.lamp_data and self.current_lamp is None:
             self.display_lamp_data(next(iter(self.lamp_data.keys())))
@@ -176,9 +234,16 @@ class DisplayApp:
         self.current_lamp = lamp_number
         data = self.lamp_data[lamp_number]
 
-        self.brightness_label.config(text=f"Brightness: {self.get_bright(lamp_number)} Lux")
-        self.humidity_label.config(text=f"Humidity: {data['humidity']}%")
-        self.temperature_label.config(text=f"Temperature: {self.get_temp(lamp_number)} °C")
+        # Show the newest stored reading if the lamp has reported sensor data
+        latest = self.sensor_store.latest(lamp_number)
+        if latest is not None:
+            self.brightness_label.config(text=f"Brightness: {latest['lux']} Lux")
+            self.humidity_label.config(text=f"Humidity: {latest['humidity']}%")
+            self.temperature_label.config(text=f"Temperature: {latest['temperature']} °C")
+        else:
+            self.brightness_label.config(text=f"Brightness: {self.get_bright(lamp_number)} Lux")
+            self.humidity_label.config(text=f"Humidity: {data['humidity']}%")
+            self.temperature_label.config(text=f"Temperature: {self.get_temp(lamp_number)} °C")
         self.color_label.config(text=f"Color: {data['color']}")
 
     def update_datetime(self):
@@ -197,20 +262,27 @@ class DisplayApp:
         self.save_lamp_data()
 
     def find_new_lamps(self):
-        
-        # Placeholder for the actual WLAN search logic
-        # This should return a list of new lamp IDs found via WLAN
-        return [random.randint(100, 999)]  # Example of a new lamp ID
+        # Lamps reported by the master (SRCH on connect) that have no name yet
+        return [mac for mac in self.master_macs if mac not in self.lamp_data]
 
     def check_lamp_connections(self):
         # Check if lamps are connected on startup
         for lamp_id in self.lamp_data.keys():
-            if not self.check_connection(lamp_id):
-                self.lamp_buttons[lamp_id].config(highlightbackground="red", highlightthickness=2)
+            self.show_connection(lamp_id)
 
     def check_connection(self, lamp_id):
-        # Placeholder for the function to check if the lamp is connected
-        return random.choice([True, False])  # Randomly simulating connection status
+        # The master tracks which lamps answer and reports changes as LIVE frames
+        return self.lamp_online.get(lamp_id, False)
+
+    def show_connection(self, lamp_id):
+        # Red border around the button of a lamp that isn't connected
+        btn = self.lamp_buttons.get(lamp_id)
+        if btn is None:
+            return
+        if self.check_connection(lamp_id):
+            btn.config(highlightthickness=0)
+        else:
+            btn.config(highlightbackground="red", highlightthickness=2)
     
     def remove_lamp(self):
         if len(self.lamp_data) == 0:
@@ -352,11 +424,11 @@ class DisplayApp:
     def connect(self):
         if self.selected_port:
             try:
-                self.serial_port = serial.Serial(self.selected_port, baudrate=115200, timeout=1)
+                self.serial_port = serial.serial_for_url(self.selected_port, baudrate=115200, timeout=1)
                 self.connected = 1
                 messagebox.showinfo("Connection", f"Connected to {self.selected_port}")
                 time.sleep(1)
-                print(self.send_serial_data("#SRCH@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@010#"))
+                self.queue_command("SRCH", "")
             except serial.SerialException as e:
                 messagebox.showerror("Connection Error", f"Failed to connect: {str(e)}")
         else:
@@ -365,6 +437,8 @@ class DisplayApp:
     def disconnect(self):
         if self.serial_port and self.serial_port.is_open:
             self.connected = 0
+            self.in_flight = None
+            self.outbox.clear()
             self.serial_port.close()
             messagebox.showinfo("Disconnection", "Disconnected successfully")
         else:
@@ -384,6 +458,7 @@ class DisplayApp:
                     message = data.decode('utf-8', errors='replace')
                     command, payload = self.decode_string(message)
                     print(f"Command: {command}, Payload: {payload}")
+                    self.handle_reply(command, payload)
                     self.root.after(25,self.read_serial_data)
                     return
                 else:
@@ -401,6 +476,118 @@ class DisplayApp:
             self.root.after(25,self.read_serial_data)
             
     
+    def handle_reply(self, command, payload):
+        """
+        Handles a decoded frame from the master.
+
+        MAC<n> frames list the lamps found by SRCH, LIVE frames
+        "index$online$mac" report a lamp that went online or offline, ALRM
+        frames "index$rule$active$value" an alarm rule of a lamp that fired, a SENS
+        reply is stored in the sensor history of the lamp the request was sent to.
+        A command of the user that got BUSY is sent again.
+        """
+        if command in FINAL_REPLIES and self.in_flight is not None:
+            sent, polled, _ = self.in_flight
+            if command == "SENS" and sent != "SENS":
+                # Late answer to a poll that already timed out
+                return
+            self.in_flight = None
+            if command == "SENS" and polled is not None:
+                self.store_reading(polled, payload)
+            elif command == "BUSY" and polled is None:
+                self.outbox.appendleft(self.last_command)
+            self.root.after(100, self.send_next)
+            return
+        if command[:3] == "MAC" and len(command) == 4 and command[3] in LAMP_CHARS:
+            index = LAMP_CHARS.index(command[3])
+            del self.master_macs[index:]
+            self.master_macs.append(payload)
+            # The lamp just answered the search
+            self.lamp_online[payload] = True
+            self.show_connection(payload)
+        elif command == "LIVE":
+            fields = payload.split('$')
+            if len(fields) == 3:
+                self.lamp_online[fields[2]] = fields[1] == "1"
+                self.show_connection(fields[2])
+        elif command == "ALRM":
+            fields = payload.split('$')
+            if len(fields) == 4 and fields[2] == "1":
+                messagebox.showwarning("Alarm", f"Lamp {fields[0]}: rule {int(fields[1], 16)} fired at {fields[3]}")
+
+    def store_reading(self, mac, payload):
+        """Stores a SENS payload in the sensor history of a lamp and shows it."""
+        values = self.decode_sensor_data(payload)
+        if values is not None:
+            now = time.time()
+            self.sensor_store.add(mac, values, ts=now)
+            if self.chart_window is not None:
+                self.chart_window.add_reading(mac, now, values)
+            if self.current_lamp == mac:
+                self.display_lamp_data(self.current_lamp)
+
+    def decode_sensor_data(self, payload):
+        """
+        Decodes a SENS payload "temperature$humidity$tvoc$lux".
+
+        :return: Dictionary of the readings (missing or invalid values are None), or None if malformed
+        """
+        fields = payload.split('$')
+        if len(fields) != 4:
+            return None
+        values = {}
+        for name, field in zip(("temperature", "humidity", "tvoc", "lux"), fields):
+            try:
+                values[name] = float(field)
+            except ValueError:
+                values[name] = None
+            # Lamps report a sensor that isn't running as nan (TVOC: -1)
+            if values[name] is not None and (values[name] != values[name] or (name == "tvoc" and values[name] < 0)):
+                values[name] = None
+        return values
+
+    def poll_sensors(self):
+        """
+        Requests the sensor data of one lamp per call, cycling through the lamps
+        reported by the master, and flushes the sensor history when due. Nothing
+        is polled while a command is in flight or the user has commands waiting.
+        """
+        if self.in_flight is not None and time.monotonic() > self.in_flight[2]:
+            # The answer was lost or damaged on the way
+            self.in_flight = None
+            self.send_next()
+        if self.connected == 1 and self.in_flight is None and not self.outbox and self.master_macs:
+            # The master addresses lamps with a single character index
+            count = min(len(self.master_macs), len(LAMP_CHARS))
+            index = self.next_sens_index % count
+            self.next_sens_index = index + 1
+            self.in_flight = ("SENS", self.master_macs[index], time.monotonic() + REPLY_TIMEOUT)
+            self.send_serial_data(self.format_command("SENS", LAMP_CHARS[index]))
+        self.sensor_store.flush_if_due()
+        self.root.after(1000, self.poll_sensors)
+
+    def queue_command(self, command, payload):
+        """Sends a command of the user as soon as no other command is waiting for its answer."""
+        self.outbox.append((command, payload))
+        self.send_next()
+
+    def send_next(self):
+        if self.connected == 1 and self.in_flight is None and self.outbox:
+            self.last_command = self.outbox.popleft()
+            command, payload = self.last_command
+            self.in_flight = (command, None, time.monotonic() + REPLY_TIMEOUT)
+            self.send_serial_data(self.format_command(command, payload))
+
+    def format_command(self, command, payload):
+        """
+        Builds a 41-letter frame for the master: "#CMD" + payload padded with '@' to 32 letters + checksum + "#".
+        """
+        body = command + payload.ljust(32, '@')
+        checksum = 0
+        for char in body:
+            checksum ^= ord(char)
+        return "#" + body + format(checksum, '03d') + "#"
+
     def send_serial_data(self, data):
         """
         Sends a 41-letter string to a device through a serial port.
@@ -0,0 +1,259 @@
+import math
+import time
+import tkinter as tk
+from datetime import datetime
+from tkinter import ttk
+
+from sensor_store import METRICS
+
+# Selectable time ranges (label, seconds)
+RANGES = (("1 hour", 3600), ("1 day", 86400), ("1 week", 7 * 86400), ("30 days", 30 * 86400))
+
+# Line colors, one per lamp
+COLORS = ("#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd",
+          "#8c564b", "#e377c2", "#7f7f7f", "#bcbd22", "#17becf")
+
+UNITS = {"temperature": "°C", "humidity": "%", "tvoc": "ppb", "lux": "Lux"}
+
+MARGIN_LEFT = 50
+MARGIN_RIGHT = 10
+MARGIN_TOP = 10
+MARGIN_BOTTOM = 25
+
+
+def decimate(rows, start, end, width):
+    """
+    Reduces (ts, min, max, ...) rows to one min/max pair per pixel column.
+
+    :param rows: Rows as returned by SensorStore.query
+    :param start: Time of the left edge
+    :param end: Time of the right edge
+    :param width: Number of pixel columns
+    :return: Two lists (lows, highs) of length width, None for columns without data
+    """
+    lows = [None] * width
+    highs = [None] * width
+    scale = width / (end - start)
+    for row in rows:
+        column = int((row[0] - start) * scale)
+        if 0 <= column < width:
+            low = row[1]
+            high = row[2]
+            if lows[column] is None or low < lows[column]:
+                lows[column] = low
+            if highs[column] is None or high > highs[column]:
+                highs[column] = high
+    return lows, highs
+
+
+class Series:
+    """Decimated data of one lamp and the canvas line that shows it."""
+
+    def __init__(self, lamp, name, color, lows, highs):
+        self.lamp = lamp
+        self.name = name
+        self.color = color
+        self.lows = lows
+        self.highs = highs
+        self.item = None
+
+
+class SensorChartWindow(tk.Toplevel):
+    """
+    Window with a chart of one sensor value for one lamp or all lamps.
+
+    History is loaded once from the sensor store, already reduced to the
+    rollup that fits the range, and decimated to one min/max pair per pixel
+    column. Each lamp is drawn as a single canvas line through the min/max
+    pairs, so the cost of drawing depends on the chart width and not on the
+    number of stored samples. New readings only update their column, and the
+    chart slides by whole columns as time passes.
+    """
+
+    def __init__(self, root, store, lamps, current_lamp=None):
+        """
+        :param root: Parent window
+        :param store: SensorStore with the sensor history
+        :param lamps: Dictionary lamp id -> lamp name
+        :param current_lamp: Lamp selected when the window opens, None for all lamps
+        """
+        super().__init__(root)
+        self.title("Sensor Charts")
+        self.store = store
+        self.lamps = dict(lamps)
+        self.series = {}
+        self.start = 0
+        self.end = 1
+        self.width = 1
+        self.height = 1
+        self.y_low = 0.0
+        self.y_high = 1.0
+
+        controls = tk.Frame(self)
+        controls.pack(side=tk.TOP, fill=tk.X, padx=5, pady=5)
+
+        self.metric_var = tk.StringVar(value=METRICS[0])
+        ttk.Combobox(controls, textvariable=self.metric_var, values=METRICS, state="readonly",
+                     width=12).pack(side=tk.LEFT, padx=5)
+
+        self.range_var = tk.StringVar(value=RANGES[0][0])
+        ttk.Combobox(controls, textvariable=self.range_var, values=[r[0] for r in RANGES], state="readonly",
+                     width=10).pack(side=tk.LEFT, padx=5)
+
+        self.lamp_choices = {"All lamps": None}
+        for lamp_id, name in self.lamps.items():
+            self.lamp_choices[name] = lamp_id
+        initial = self.lamps.get(current_lamp, "All lamps")
+        self.lamp_var = tk.StringVar(value=initial)
+        ttk.Combobox(controls, textvariable=self.lamp_var, values=list(self.lamp_choices), state="readonly",
+                     width=16).pack(side=tk.LEFT, padx=5)
+
+        for var in (self.metric_var, self.range_var, self.lamp_var):
+            var.trace_add("write", lambda *args: self.reload())
+
+        self.canvas = tk.Canvas(self, width=800, height=300, background="white")
+        self.canvas.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+        self.canvas.bind("<Configure>", self.on_resize)
+
+        self.after(1000, self.tick)
+
+    def on_resize(self, event):
+        self.reload()
+
+    def span(self):
+        for label, seconds in RANGES:
+            if label == self.range_var.get():
+                return seconds
+        return RANGES[0][1]
+
+    def selected_lamps(self):
+        lamp = self.lamp_choices.get(self.lamp_var.get())
+        if lamp is None:
+            return list(self.lamps)
+        return [lamp]
+
+    def reload(self):
+        """Loads the selected range from the store and redraws the whole chart."""
+        self.width = max(self.canvas.winfo_width() - MARGIN_LEFT - MARGIN_RIGHT, 10)
+        self.height = max(self.canvas.winfo_height() - MARGIN_TOP - MARGIN_BOTTOM, 10)
+        self.end = time.time()
+        self.start = self.end - self.span()
+        metric = self.metric_var.get()
+        self.series = {}
+        for i, lamp in enumerate(self.selected_lamps()):
+            # Two rows per column are enough for min/max decimation
+            rows = self.store.query(lamp, metric, self.start, self.end, max_points=2 * self.width)
+            lows, highs = decimate(rows, self.start, self.end, self.width)
+            self.series[lamp] = Series(lamp, self.lamps[lamp], COLORS[i % len(COLORS)], lows, highs)
+        self.rescale()
+        self.redraw()
+
+    def rescale(self):
+        """Fits the y axis to the data of all series. Returns True if the axis changed."""
+        low = min((v for s in self.series.values() for v in s.lows if v is not None), default=None)
+        high = max((v for s in self.series.values() for v in s.highs if v is not None), default=None)
+        if low is None:
+            low, high = 0.0, 1.0
+        if high - low < 1e-6:
+            low, high = low - 0.5, high + 0.5
+        changed = (low, high) != (self.y_low, self.y_high)
+        self.y_low = low
+        self.y_high = high
+        return changed
+
+    def y_pixel(self, value):
+        return MARGIN_TOP + self.height - (value - self.y_low) * self.height / (self.y_high - self.y_low)
+
+    def series_coords(self, series):
+        """Polyline through the min/max pair of every column that has data."""
+        coords = []
+        for column in range(self.width):
+            low = series.lows[column]
+            if low is None:
+                continue
+            x = MARGIN_LEFT + column
+            coords += (x, self.y_pixel(low), x, self.y_pixel(series.highs[column]))
+        return coords
+
+    def draw_series(self, series):
+        coords = self.series_coords(series)
+        if not coords:
+            return
+        if series.item is None:
+            series.item = self.canvas.create_line(*coords, fill=series.color, tags="series")
+        else:
+            self.canvas.coords(series.item, *coords)
+
+    def redraw(self):
+        """Draws axes, labels and all series from scratch."""
+        canvas = self.canvas
+        canvas.delete("all")
+        for series in self.series.values():
+            series.item = None
+        right = MARGIN_LEFT + self.width
+        bottom = MARGIN_TOP + self.height
+        canvas.create_rectangle(MARGIN_LEFT, MARGIN_TOP, right, bottom, outline="#cccccc")
+        unit = UNITS.get(self.metric_var.get(), "")
+        canvas.create_text(MARGIN_LEFT - 4, MARGIN_TOP, text=f"{self.y_high:.1f}", anchor="ne", tags="axis")
+        canvas.create_text(MARGIN_LEFT - 4, bottom, text=f"{self.y_low:.1f}", anchor="se", tags="axis")
+        canvas.create_text(MARGIN_LEFT - 4, MARGIN_TOP + self.height / 2, text=unit, anchor="e", tags="axis")
+        time_format = "%H:%M" if self.span() <= 86400 else "%m-%d %H:%M"
+        canvas.create_text(MARGIN_LEFT, bottom + 4, anchor="nw", tags="axis",
+                           text=datetime.fromtimestamp(self.start).strftime(time_format))
+        canvas.create_text(right, bottom + 4, anchor="ne", tags="axis",
+                           text=datetime.fromtimestamp(self.end).strftime(time_format))
+        x = MARGIN_LEFT + 80
+        for series in self.series.values():
+            canvas.create_text(x, bottom + 4, anchor="nw", text=series.name, fill=series.color, tags="axis")
+            x += 8 * len(series.name) + 10
+        for series in self.series.values():
+            self.draw_series(series)
+
+    def slide(self, now):
+        """Moves the chart left by whole columns so that `now` is inside it."""
+        column_time = (self.end - self.start) / self.width
+        if now < self.end:
+            return
+        shift = math.ceil((now - self.end) / column_time)
+        self.start += shift * column_time
+        self.end += shift * column_time
+        for series in self.series.values():
+            if shift >= self.width:
+                series.lows = [None] * self.width
+                series.highs = [None] * self.width
+            else:
+                series.lows = series.lows[shift:] + [None] * shift
+                series.highs = series.highs[shift:] + [None] * shift
+        self.rescale()
+        self.redraw()
+
+    def tick(self):
+        self.slide(time.time())
+        self.after(1000, self.tick)
+
+    def add_reading(self, lamp, ts, values):
+        """
+        Adds a new reading to the chart. Only the affected column and line
+        are updated unless the reading extends the y axis.
+
+        :param lamp: Lamp id
+        :param ts: Time of the reading
+        :param values: Dictionary of sensor values
+        """
+        series = self.series.get(lamp)
+        value = values.get(self.metric_var.get())
+        if series is None or value is None:
+            return
+        self.slide(ts)
+        column = int((ts - self.start) * self.width / (self.end - self.start))
+        if not 0 <= column < self.width:
+            return
+        if series.lows[column] is None or value < series.lows[column]:
+            series.lows[column] = value
+        if series.highs[column] is None or value > series.highs[column]:
+            series.highs[column] = value
+        if value < self.y_low or value > self.y_high:
+            self.rescale()
+            self.redraw()
+        else:
+            self.draw_series(series)
@@ -0,0 +1,247 @@
+import sqlite3
+import time
+
+# Sensor values stored for every SENS reading
+METRICS = ("temperature", "humidity", "tvoc", "lux")
+
+# Rollup tables with their bucket size in seconds
+ROLLUPS = (("rollup_minute", 60), ("rollup_hour", 3600))
+
+# Default retention in seconds per table, None keeps everything
+RETENTION = {
+    "samples": 14 * 86400,
+    "rollup_minute": 180 * 86400,
+    "rollup_hour": None,
+}
+
+
+class SensorStore:
+    """
+    Time-series store for lamp sensor readings on top of SQLite.
+
+    Raw samples are buffered in memory and written in batches. Every batch is
+    also folded into per-minute and per-hour rollups (min/max/sum/count per
+    metric), so range queries over long periods read the rollups instead of
+    the raw samples. Reads merge the buffer with the tables, so they never
+    force a write. A second reading of a lamp with the same time is ignored.
+    All tables are keyed by (lamp, time) and stored without rowid, so a range
+    query for one lamp is a single index range scan.
+    """
+
+    def __init__(self, path, batch_size=200, flush_interval=5.0, retention=None):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention = dict(RETENTION)
+        if retention:
+            self.retention.update(retention)
+        self.pending = []
+        self.last_flush = time.monotonic()
+        self.last_prune = 0.0
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.create_tables()
+
+    def create_tables(self):
+        columns = ", ".join(f"{m} REAL" for m in METRICS)
+        self.db.execute(
+            f"CREATE TABLE IF NOT EXISTS samples (lamp TEXT NOT NULL, ts REAL NOT NULL, {columns}, "
+            f"PRIMARY KEY (lamp, ts)) WITHOUT ROWID")
+        aggregates = ", ".join(f"{m}_min REAL, {m}_max REAL, {m}_sum REAL, {m}_n INTEGER" for m in METRICS)
+        for table, _ in ROLLUPS:
+            self.db.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} (lamp TEXT NOT NULL, bucket INTEGER NOT NULL, {aggregates}, "
+                f"PRIMARY KEY (lamp, bucket)) WITHOUT ROWID")
+        self.db.commit()
+
+    def add(self, lamp, values, ts=None):
+        """Buffer one reading. `values` maps metric names to numbers; missing metrics are stored as NULL."""
+        if ts is None:
+            ts = time.time()
+        self.pending.append((str(lamp), float(ts)) + tuple(values.get(m) for m in METRICS))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush_if_due(self):
+        """Flush the buffer if the flush interval has passed. Meant to be called periodically."""
+        if self.pending and time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write buffered readings and update the rollups in one transaction."""
+        self.last_flush = time.monotonic()
+        if not self.pending:
+            return
+        rows, self.pending = self.pending, []
+        placeholders = ", ".join("?" * (2 + len(METRICS)))
+        insert = f"INSERT OR IGNORE INTO samples VALUES ({placeholders})"
+        with self.db:
+            # Only rows that were new go into the rollups, or a duplicate would be counted twice
+            rows = [row for row in rows if self.db.execute(insert, row).rowcount == 1]
+            for table, size in ROLLUPS:
+                self.db.executemany(self.__upsert_sql(table), self.__aggregate(rows, size))
+        if time.monotonic() - self.last_prune > 3600:
+            self.prune()
+
+    @staticmethod
+    def __aggregate(rows, size):
+        """Fold raw rows into one aggregate row per (lamp, bucket)."""
+        buckets = {}
+        for row in rows:
+            key = (row[0], int(row[1] // size * size))
+            agg = buckets.get(key)
+            if agg is None:
+                agg = buckets[key] = [None, None, 0.0, 0] * len(METRICS)
+            for i, value in enumerate(row[2:]):
+                if value is None:
+                    continue
+                base = 4 * i
+                agg[base] = value if agg[base] is None else min(agg[base], value)
+                agg[base + 1] = value if agg[base + 1] is None else max(agg[base + 1], value)
+                agg[base + 2] += value
+                agg[base + 3] += 1
+        return [key + tuple(agg) for key, agg in buckets.items()]
+
+    @staticmethod
+    def __merge(agg, other):
+        """Add the (min, max, sum, n) of `other` to `agg`; either may have None for min and max."""
+        low = [v for v in (agg[0], other[0]) if v is not None]
+        high = [v for v in (agg[1], other[1]) if v is not None]
+        return (min(low) if low else None, max(high) if high else None,
+                (agg[2] or 0.0) + (other[2] or 0.0), (agg[3] or 0) + (other[3] or 0))
+
+    def __pending_rows(self, lamp, metric, start, end):
+        """Buffered (ts, value) of one metric of one lamp in [start, end), without readings flush() would ignore."""
+        column = 2 + METRICS.index(metric)
+        rows = [row for row in self.pending if row[0] == lamp and start <= row[1] < end]
+        if not rows:
+            return []
+        seen = {ts for ts, in self.db.execute("SELECT ts FROM samples WHERE lamp = ? AND ts >= ? AND ts <= ?",
+                                              (lamp, min(row[1] for row in rows), max(row[1] for row in rows)))}
+        result = []
+        for row in rows:
+            if row[1] not in seen:
+                seen.add(row[1])
+                if row[column] is not None:
+                    result.append((row[1], row[column]))
+        return result
+
+    def __pending_buckets(self, lamp, metric, size, start, end):
+        """{bucket: (min, max, sum, n)} of the buffered readings of one lamp, for buckets in [start, end)."""
+        buckets = {}
+        for ts, value in self.__pending_rows(lamp, metric, start - size, end):
+            bucket = int(ts // size * size)
+            if start <= bucket < end:
+                buckets[bucket] = self.__merge(buckets.get(bucket, (None, None, 0.0, 0)), (value, value, value, 1))
+        return buckets
+
+    @staticmethod
+    def __upsert_sql(table):
+        placeholders = ", ".join("?" * (2 + 4 * len(METRICS)))
+        updates = []
+        for m in METRICS:
+            updates.append(f"{m}_min = min(coalesce({m}_min, excluded.{m}_min), coalesce(excluded.{m}_min, {m}_min))")
+            updates.append(f"{m}_max = max(coalesce({m}_max, excluded.{m}_max), coalesce(excluded.{m}_max, {m}_max))")
+            updates.append(f"{m}_sum = {m}_sum + excluded.{m}_sum")
+            updates.append(f"{m}_n = {m}_n + excluded.{m}_n")
+        return (f"INSERT INTO {table} VALUES ({placeholders}) "
+                f"ON CONFLICT (lamp, bucket) DO UPDATE SET {', '.join(updates)}")
+
+    def prune(self, now=None):
+        """Delete data older than the retention of each table."""
+        if now is None:
+            now = time.time()
+        self.last_prune = time.monotonic()
+        with self.db:
+            for table, keep in self.retention.items():
+                if keep is None:
+                    continue
+                column = "ts" if table == "samples" else "bucket"
+                self.db.execute(f"DELETE FROM {table} WHERE {column} < ?", (now - keep,))
+
+    def lamps(self):
+        """Return all lamp ids that have data."""
+        stored = {row[0] for row in self.db.execute("SELECT DISTINCT lamp FROM rollup_hour")}
+        return sorted(stored | {row[0] for row in self.pending})
+
+    def latest(self, lamp):
+        """Return the newest reading of a lamp as a dict with 'ts' and the metrics, or None."""
+        lamp = str(lamp)
+        row = self.db.execute(
+            f"SELECT ts, {', '.join(METRICS)} FROM samples WHERE lamp = ? ORDER BY ts DESC LIMIT 1",
+            (lamp,)).fetchone()
+        for buffered in self.pending:
+            if buffered[0] == lamp and (row is None or buffered[1] > row[0]):
+                row = buffered[1:]
+        if row is None:
+            return None
+        return dict(zip(("ts",) + METRICS, row))
+
+    def resolution_for(self, start, end, max_points, now=None):
+        """
+        Pick the finest table whose number of points in [start, end) stays within
+        max_points and that still keeps data from `start` (see the retention).
+        """
+        if now is None:
+            now = time.time()
+        span = end - start
+        # Raw samples arrive at most about once per second
+        for table, size in (("samples", 1),) + ROLLUPS:
+            keep = self.retention.get(table)
+            if keep is not None and start < now - keep:
+                continue
+            if max_points is None or span / size <= max_points:
+                return table, 0 if table == "samples" else size
+        return ROLLUPS[-1]
+
+    def query(self, lamp, metric, start, end, max_points=None, resolution=None):
+        """
+        Return [(ts, min, max, avg), ...] of one metric of one lamp in [start, end).
+
+        The resolution is chosen automatically from `max_points` unless given
+        as "samples", "rollup_minute" or "rollup_hour". Rows come from the
+        rollups for long ranges, so the result size is bounded by the range and
+        not by the number of stored samples.
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric: {metric}")
+        lamp = str(lamp)
+        if resolution is None:
+            resolution, _ = self.resolution_for(start, end, max_points)
+        if resolution == "samples":
+            sql = (f"SELECT ts, {metric} FROM samples "
+                   f"WHERE lamp = ? AND ts >= ? AND ts < ? AND {metric} IS NOT NULL")
+            values = dict(self.db.execute(sql, (lamp, start, end)).fetchall())
+            for ts, value in self.__pending_rows(lamp, metric, start, end):
+                values.setdefault(ts, value)
+            return [(ts, value, value, value) for ts, value in sorted(values.items())]
+        size = dict(ROLLUPS).get(resolution)
+        if size is None:
+            raise ValueError(f"Unknown resolution: {resolution}")
+        sql = (f"SELECT bucket, {metric}_min, {metric}_max, {metric}_sum, {metric}_n FROM {resolution} "
+               f"WHERE lamp = ? AND bucket >= ? AND bucket < ? AND {metric}_n > 0")
+        buckets = {row[0]: row[1:] for row in self.db.execute(sql, (lamp, start, end))}
+        for bucket, agg in self.__pending_buckets(lamp, metric, size, start, end).items():
+            buckets[bucket] = self.__merge(buckets.get(bucket, (None, None, 0.0, 0)), agg)
+        return [(bucket, low, high, total / n) for bucket, (low, high, total, n) in sorted(buckets.items())]
+
+    def summary(self, lamps, metric, start, end):
+        """Return {lamp: (min, max, avg)} of a metric over [start, end) for several lamps, from the hourly rollup."""
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric: {metric}")
+        result = {}
+        for lamp in lamps:
+            agg = self.db.execute(
+                f"SELECT min({metric}_min), max({metric}_max), sum({metric}_sum), sum({metric}_n) "
+                f"FROM rollup_hour WHERE lamp = ? AND bucket >= ? AND bucket < ? AND {metric}_n > 0",
+                (str(lamp), start, end)).fetchone()
+            for pending in self.__pending_buckets(str(lamp), metric, 3600, start, end).values():
+                agg = self.__merge(agg, pending)
+            low, high, total, n = agg
+            result[lamp] = (low, high, total / n) if n else (None, None, None)
+        return result
+
+    def close(self):
+        self.flush()
+        self.db.close()
@@ -0,0 +1,237 @@
+"""
+Summaries of long PC link logs, computed with NumPy instead of frame by frame.
+
+Reads a capture file (capture.py) or a raw serial log (41-byte frames back to
+back, '#' to the master and '*' from it, without times). The file is
+memory-mapped and viewed as an array of fixed-width frames; checksums,
+commands and lamp indexes are decoded for all frames at once, and every
+command is paired with the frame that ends its answer by a sorted search.
+Captures with frames of other lengths (binary or radio frames) are split
+into records without a per-record loop as well (record_offsets).
+
+    python analytics.py FILE [--raw] [--json OUT]
+
+Prints per command and per lamp: count, NACKs, unanswered commands,
+error rate, latency (median, 95th percentile, maximum) and commands per
+minute, plus the share of damaged frames. Latency and throughput need the
+times of a capture. Binary frames and mirrored radio frames in a capture are
+skipped; only ASCII link traffic is summarised.
+"""
+import argparse
+import json
+import sys
+
+import numpy as np
+
+from capture import DIRECTIONS, FROM_MASTER, HEADER, MAGIC, RECORD, TO_MASTER, VERSION
+from pclink import FRAME_LEN
+
+# A capture of ASCII link traffic only is an array of these records
+RECORD_DTYPE = np.dtype([("t_us", "<u8"), ("direction", "u1"), ("length", "u1"), ("frame", "u1", (FRAME_LEN,))])
+
+# Commands whose first payload character is the lamp index
+LAMP_COMMANDS = (b"HRBT", b"COLR", b"SENS", b"TONE", b"HLTH", b"BOOT", b"CONF", b"SCNS", b"RULE")
+# Frames from the master that don't end an answer: records before the final OKAY, BUSY while a lamp
+# works, fragment acknowledgements and frames the master sends on its own
+NOT_FINAL = (b"STAT", b"LIVE", b"BTNA", b"BTNE", b"ALRM", b"BUSY", b"FACK", b"MACS") + tuple(b"MAC%d" % i for i in range(10))
+# Bytes of the file scanned at once for record headers
+SCAN_CHUNK = 1 << 24
+
+
+def record_offsets(data):
+    """
+    Offsets of the records of a capture file (uint8 memmap), up to a cut-off tail.
+
+    Every position that could start a record (top byte of the time 0, a known
+    direction, the frame inside the file) is found in one pass per chunk. Each
+    of them points to where the next record would start, and the chain from
+    the first record is followed by pointer doubling: log2(records) passes
+    over the candidates instead of one Python step per record.
+    """
+    size = len(data)
+    last = size - RECORD.size + 1  # the last position a whole record header fits
+    chunks = []
+    for start in range(HEADER.size, last, SCAN_CHUNK):
+        stop = min(start + SCAN_CHUNK, last)
+        possible = (data[start + 7:stop + 7] == 0) & (data[start + 8:stop + 8] < len(DIRECTIONS))
+        offsets = start + np.flatnonzero(possible)
+        chunks.append(offsets[offsets + RECORD.size + data[offsets + 9] <= size])
+    candidates = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int64)
+    if not len(candidates) or candidates[0] != HEADER.size:
+        return candidates[:0]
+    count = len(candidates)
+    following = candidates + RECORD.size + data[candidates + 9]
+    index = np.searchsorted(candidates, following)
+    found = index < count
+    found[found] = candidates[index[found]] == following[found]
+    # Index of the next record per candidate; `count` ends the chain and stays there
+    jump = np.append(np.where(found, index, count), count)
+    chain = np.zeros(1, dtype=np.int64)
+    while chain[-1] != count:
+        # chain holds the first 2^k records and jump skips 2^k records, so this doubles it
+        chain = np.concatenate((chain, jump[chain]))
+        jump = jump[jump]
+    return candidates[chain[chain < count]]
+
+
+def load_capture(path):
+    """Returns (t_us, direction, frames) of the ASCII frames of a capture file; frames is an (n, 41) uint8 array."""
+    with open(path, "rb") as f:
+        header = f.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise ValueError(f"{path} is not a capture file")
+    magic, version, _ = HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a capture file of version {VERSION}")
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    body = len(data) - HEADER.size
+    count = body // RECORD_DTYPE.itemsize
+    if count:
+        records = np.ndarray((count,), dtype=RECORD_DTYPE, buffer=data, offset=HEADER.size)
+        if body == count * RECORD_DTYPE.itemsize and np.all(records["length"] == FRAME_LEN):
+            # Only ASCII frames: the file is one array, nothing is copied
+            return records["t_us"], records["direction"], records["frame"]
+    # Mixed frame lengths or a cut-off tail: find the records first, then gather the ASCII frames at once
+    offsets = record_offsets(data)
+    direction = data[offsets + 8]
+    offsets = offsets[(data[offsets + 9] == FRAME_LEN) & ((direction == TO_MASTER) | (direction == FROM_MASTER))]
+    t_us = np.zeros(len(offsets), dtype=np.uint64)
+    for i in range(8):
+        t_us |= data[offsets + i].astype(np.uint64) << np.uint64(8 * i)
+    direction = data[offsets + 8]
+    frames = data[(offsets + RECORD.size)[:, None] + np.arange(FRAME_LEN)]
+    return t_us, direction, frames
+
+
+def load_raw(path):
+    """Returns (None, direction, frames) of a raw serial log of back-to-back 41-byte frames."""
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    frames = data[:len(data) // FRAME_LEN * FRAME_LEN].reshape(-1, FRAME_LEN)
+    direction = np.where(frames[:, 0] == ord("#"), TO_MASTER, FROM_MASTER).astype(np.uint8)
+    return None, direction, frames
+
+
+def validate(frames):
+    """Boolean array: start and end marker match and the 3-digit XOR checksum is right."""
+    start = frames[:, 0]
+    markers = ((start == ord("#")) | (start == ord("*"))) & (frames[:, -1] == start)
+    digits = frames[:, 37:40].astype(np.int16) - ord("0")
+    numeric = np.all((digits >= 0) & (digits <= 9), axis=1)
+    checksum = digits[:, 0] * 100 + digits[:, 1] * 10 + digits[:, 2]
+    return markers & numeric & (np.bitwise_xor.reduce(frames[:, 1:37], axis=1) == checksum)
+
+
+def commands(frames):
+    """The 4-byte commands of all frames as an array of bytes."""
+    return np.ascontiguousarray(frames[:, 1:5]).view("S4").ravel()
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if len(values) else None
+
+
+def latency_summary(latency_ms):
+    answered = latency_ms[~np.isnan(latency_ms)]
+    return {
+        "p50_ms": percentile(answered, 50),
+        "p95_ms": percentile(answered, 95),
+        "max_ms": float(answered.max()) if len(answered) else None,
+    }
+
+
+def summarise(t_us, direction, frames):
+    """Pair commands with their answers and summarise them per command and per lamp."""
+    valid = validate(frames)
+    names = commands(frames)
+    to_master = (direction == TO_MASTER) & valid
+    from_master = (direction == FROM_MASTER) & valid
+    final = from_master & ~np.isin(names, NOT_FINAL)
+
+    positions = np.arange(len(frames))
+    sent = positions[to_master]
+    answers = positions[final]
+    # The first final frame after each command answers it if it comes before the next command
+    first = np.searchsorted(answers, sent, side="right")
+    next_sent = np.append(sent[1:], len(frames))
+    answer_at = np.append(answers, len(frames))[first]
+    answered = answer_at < next_sent
+    answer_names = np.where(answered, names[np.minimum(answer_at, len(frames) - 1)], b"")
+    nack = answered & (answer_names == b"NACK")
+
+    sent_names = names[sent]
+    lamp = np.where(np.isin(sent_names, LAMP_COMMANDS), frames[sent, 5].astype(np.int16) - ord("0"), -1)
+    lamp[(lamp < 0) | (lamp > 9)] = -1
+
+    if t_us is not None:
+        t_ms = t_us.astype(np.float64) / 1000
+        latency = np.where(answered, t_ms[np.minimum(answer_at, len(frames) - 1)] - t_ms[sent], np.nan)
+        minutes = max((t_ms[-1] - t_ms[0]) / 60000, 1e-9) if len(t_ms) else 0.0
+    else:
+        latency = np.full(len(sent), np.nan)
+        minutes = None
+
+    def group(mask):
+        count = int(mask.sum())
+        errors = int((nack & mask).sum() + (~answered & mask).sum())
+        result = {
+            "count": count,
+            "nack": int((nack & mask).sum()),
+            "unanswered": int((~answered & mask).sum()),
+            "error_rate": errors / count if count else 0.0,
+            "per_min": count / minutes if minutes else None,
+        }
+        result.update(latency_summary(latency[mask]))
+        return result
+
+    summary = {
+        "frames": len(frames),
+        "damaged": int((~valid).sum()),
+        "busy": int((from_master & (names == b"BUSY")).sum()),
+        "minutes": minutes,
+        "commands": {},
+        "lamps": {},
+    }
+    for name in np.unique(sent_names):
+        summary["commands"][name.decode("ascii", errors="replace")] = group(sent_names == name)
+    for index in np.unique(lamp):
+        summary["lamps"]["master" if index < 0 else str(int(index))] = group(lamp == index)
+    return summary
+
+
+def fmt(value, width=0):
+    return f"{'-':>{width}}" if value is None else f"{value:{width}.1f}"
+
+
+def print_table(title, rows):
+    print(f"{title:<8} {'count':>8} {'nack':>6} {'lost':>6} {'err%':>6} {'/min':>8} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for name, row in rows.items():
+        print(f"{name:<8} {row['count']:>8} {row['nack']:>6} {row['unanswered']:>6} {row['error_rate'] * 100:>6.2f} "
+              f"{fmt(row['per_min'], 8)} {fmt(row['p50_ms'], 8)} {fmt(row['p95_ms'], 8)} {fmt(row['max_ms'], 8)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("file", help="capture file (capture.py), or a raw serial log with --raw")
+    parser.add_argument("--raw", action="store_true", help="the file is 41-byte frames without times")
+    parser.add_argument("--json", metavar="OUT", help="also write the summary as JSON")
+    args = parser.parse_args(argv)
+    try:
+        t_us, direction, frames = load_raw(args.file) if args.raw else load_capture(args.file)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    summary = summarise(t_us, direction, frames)
+    damaged = summary["damaged"] * 100 / summary["frames"] if summary["frames"] else 0.0
+    print(f"{summary['frames']} frames, {summary['damaged']} damaged ({damaged:.2f}%), {summary['busy']} BUSY, "
+          f"{fmt(summary['minutes'])} min")
+    print_table("command", summary["commands"])
+    print()
+    print_table("lamp", summary["lamps"])
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""
+Sends messages larger than one frame to a lamp through the master.
+
+The message is the lamp index digit, the lamp command and its data. It is
+sent to the master as FRAG frames (see fragment.py) and acknowledged with
+FACK frames. The master relays the complete message to the lamp the same
+way over the radio and answers OKAY (with the lamp's answer payload) or NACK.
+
+    python bulk.py PORT LAMP COMMAND FILE
+"""
+import argparse
+import sys
+
+import fragment
+from pclink import MasterLink
+
+# Fragments in flight on the UART: the master has a 1 kB receive buffer
+# (24 frames of 41 bytes) and reads up to 8 frames per 10 ms
+UART_WINDOW = 16
+
+
+class BulkError(Exception):
+    pass
+
+
+def send_bulk(link, lamp, command, data, window=UART_WINDOW, ack_timeout=0.5, reply_timeout=15.0):
+    """
+    Send `data` as the payload of `command` to lamp `lamp` (master index).
+
+    Returns (True, payload) if the lamp answered OKAY, (False, "") for NACK.
+    Raises BulkError if the master stops acknowledging fragments or nobody
+    answers.
+    """
+    if len(command) != 4:
+        raise ValueError("Command must be 4 characters long")
+    message = f"{lamp}{command}".encode("ascii") + bytes(data)
+    link.bulk_tid = (link.bulk_tid + 1) & 0xFF
+    sender = fragment.Sender(link.bulk_tid, message, window)
+    while not sender.done():
+        for payload in sender.pending():
+            link.send("FRAG", payload)
+        frame = link.wait_for(("FACK", "NACK", "BUSY"), ack_timeout)
+        if frame is not None and frame[0] == "FACK":
+            sender.on_ack(frame[1])
+        elif not sender.timeout():
+            # NACK (damaged frame) and BUSY (another command in flight) are retried like a timeout
+            raise BulkError("The master stopped acknowledging fragments")
+    reply = link.wait_for(("OKAY", "NACK"), reply_timeout)
+    if reply is None:
+        raise BulkError("No answer from the lamp")
+    return reply[0] == "OKAY", reply[1]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("port", help="serial port of the master, or socket://host:port for the simulator")
+    parser.add_argument("lamp", type=int, help="lamp index as returned by SRCH")
+    parser.add_argument("command", help="lamp command, e.g. SONG")
+    parser.add_argument("file", help="file with the data to send")
+    args = parser.parse_args(argv)
+
+    with open(args.file, "rb") as f:
+        data = f.read()
+    link = MasterLink(args.port)
+    try:
+        ok, payload = send_bulk(link, args.lamp, args.command, data)
+    except BulkError as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        link.close()
+    print(f"OKAY {payload}" if ok else "NACK")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+"""
+Capture and replay of the traffic between the PC and the master.
+
+A capture file holds every frame in both directions as it was on the wire
+(41-byte ASCII frames or binary frames) with the time it passed, and the
+radio frames (59 bytes, as built by CMDHandler.encode_message) if the
+master mirrored them (MIRR1, binary link only). MasterLink(port,
+capture=CaptureWriter(path)) records a program's traffic; gateway.py
+--capture records everything that goes through the gateway.
+
+File: header "HSCP", version (1 byte), start time (float64, Unix time), then
+one record per frame: time since the start in us (uint64), direction
+(1 byte, see DIRECTIONS), frame length (1 byte) and the frame.
+
+    python capture.py dump FILE
+    python capture.py replay FILE PORT [--speed 10] [--binary BAUD] [--threshold PCT]
+
+replay sends the commands of the capture to a master or master_sim.py,
+at the original pace divided by --speed but never before the previous
+answer is complete, and compares the answers and their latency with the
+capture. Payloads of commands that report measurements (SENS, TIME, ...)
+are not compared. Exits with 1 if an answer differs or the median latency
+of a command got more than --threshold percent (and MIN_SLOWER_MS) slower.
+"""
+import argparse
+import statistics
+import struct
+import sys
+import time
+
+import binframe
+from pclink import FRAME_LEN, MasterLink, decode_response
+
+MAGIC = b"HSCP"
+VERSION = 1
+HEADER = struct.Struct("<4sBd")
+RECORD = struct.Struct("<QBB")
+
+TO_MASTER = 0
+FROM_MASTER = 1
+RADIO_TX = 2
+RADIO_RX = 3
+DIRECTIONS = ("pc>master", "master>pc", "radio tx", "radio rx")
+
+# Frames the master sends on its own, not part of an answer
+EVENTS = ("LIVE", "BTNE", "ALRM", "RFTX", "RFRX")
+# Answers whose payload is a measurement and changes from run to run
+VOLATILE = ("SENS", "TIME", "STAT", "HLTH", "BOOT", "LIVE", "BUTS")
+FLUSH_S = 1.0
+MIN_SLOWER_MS = 5.0  # smaller latency increases are jitter, whatever the percentage
+
+
+class CaptureWriter:
+    """Appends frames to a capture file."""
+
+    def __init__(self, path):
+        self.file = open(path, "wb")
+        self.start = time.perf_counter()
+        self.file.write(HEADER.pack(MAGIC, VERSION, time.time()))
+        self.last_flush = self.start
+
+    def record(self, direction, frame, at=None):
+        """Record one frame (bytes) that passed at perf_counter time `at` (now if None)."""
+        if at is None:
+            at = time.perf_counter()
+        frame = bytes(frame)
+        self.file.write(RECORD.pack(max(int((at - self.start) * 1000000), 0), direction, len(frame)) + frame)
+        if at - self.last_flush >= FLUSH_S:
+            # Keep the capture of a program that is killed
+            self.file.flush()
+            self.last_flush = at
+
+    def frame_sent(self, frame, at):
+        self.record(TO_MASTER, frame, at)
+
+    def frame_received(self, raw, command, payload, at):
+        """Record a frame from the master; a mirrored radio frame is also recorded as the radio frame."""
+        self.record(FROM_MASTER, raw, at)
+        if command in ("RFTX", "RFRX"):
+            age_us, _, frame = payload.partition("$")
+            try:
+                at -= int(age_us) / 1000000
+            except ValueError:
+                return
+            self.record(RADIO_TX if command == "RFTX" else RADIO_RX, frame.encode("utf-8"), at)
+
+    def close(self):
+        self.file.close()
+
+
+def read_capture(path):
+    """Returns (start time, [(t_us, direction, frame bytes), ...]) of a capture file."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise ValueError(f"{path} is not a capture file")
+    magic, version, start = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a capture file of version {VERSION}")
+    records = []
+    offset = HEADER.size
+    while offset + RECORD.size <= len(data):
+        t_us, direction, length = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        if offset + length > len(data):
+            # Cut off by a program that was killed
+            break
+        records.append((t_us, direction, data[offset:offset + length]))
+        offset += length
+    return start, records
+
+
+def parse_frame(frame):
+    """Returns (command, payload) of a PC link frame in either format, (None, None) if it isn't one."""
+    if len(frame) == FRAME_LEN and frame[:1] in (b"#", b"*"):
+        text = frame.decode("utf-8", errors="replace")
+        command, payload, valid = decode_response("*" + text[1:-1] + "*")
+        return (command, payload) if valid else (None, None)
+    try:
+        command, payload = binframe.decode(frame.rstrip(b"\x00"))
+    except ValueError:
+        return None, None
+    return command, payload.decode("utf-8", errors="replace")
+
+
+def describe(direction, frame):
+    if direction in (RADIO_TX, RADIO_RX):
+        return frame.decode("utf-8", errors="replace")
+    command, payload = parse_frame(frame)
+    if command is None:
+        return f"? {frame!r}"
+    return f"{command} {payload}"
+
+
+def dump(path):
+    start, records = read_capture(path)
+    print(f"# {path}: {len(records)} frames from {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start))}")
+    for t_us, direction, frame in sorted(records, key=lambda record: record[0]):
+        print(f"{t_us / 1000:12.3f} {DIRECTIONS[direction]:<10} {describe(direction, frame)}")
+    return 0
+
+
+def exchanges(records):
+    """
+    Split a capture into the commands sent to the master and the frames that
+    answered each one: [(t_us, (command, payload), [(t_us, command, payload), ...]), ...].
+    """
+    result = []
+    for t_us, direction, frame in records:
+        if direction == TO_MASTER:
+            command, payload = parse_frame(frame)
+            if command is not None:
+                result.append((t_us, (command, payload), []))
+        elif direction == FROM_MASTER and result:
+            command, payload = parse_frame(frame)
+            if command is not None and command not in EVENTS:
+                result[-1][2].append((t_us, command, payload))
+    return result
+
+
+def comparable(frames):
+    """
+    Answer frames as compared by the replay: without the payload of measurements,
+    and a search only by the number of lamps found, so a capture from the field
+    can be replayed against the simulator.
+    """
+    result = []
+    for command, payload in frames:
+        if command.startswith("MAC") and command != "MACN":
+            command = "MAC"
+        result.append((command, "" if command in VOLATILE or command == "MAC" else payload))
+    return result
+
+
+def replay(path, port, speed=1.0, binary=None, threshold=20.0):
+    _, records = read_capture(path)
+    recorded = exchanges(records)
+    if not recorded:
+        print(f"{path} has no commands to replay")
+        return 1
+    link = MasterLink(port, binary=binary)
+    mismatches = 0
+    latencies = {}  # command -> ([recorded ms], [replayed ms])
+    first_t = recorded[0][0]
+    started = time.perf_counter()
+    try:
+        for t_us, (command, payload), expected in recorded:
+            if command in ("BINM", "ASCI", "MIRR"):
+                # The replay sets the link mode itself
+                continue
+            due = started + (t_us - first_t) / 1000000 / speed
+            wait = due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            sent_at = link.send(command, payload)
+            answer = []
+            first_at = None
+            # Wait for as many frames as were recorded, or briefly if none were
+            timeout = 15.0 if expected else 0.5
+            while len(answer) < max(len(expected), 1):
+                frame = link.read_frame(timeout)
+                if frame is None:
+                    break
+                if frame[0] in EVENTS:
+                    continue
+                if first_at is None:
+                    first_at = frame[2]
+                answer.append((frame[0], frame[1]))
+            want = [(c, p) for _, c, p in expected]
+            if comparable(answer) != comparable(want):
+                mismatches += 1
+                print(f"{command} {payload}: recorded {want}, replayed {answer}")
+            if expected and first_at is not None:
+                times = latencies.setdefault(command, ([], []))
+                times[0].append((expected[0][0] - t_us) / 1000)
+                times[1].append((first_at - sent_at) * 1000)
+    finally:
+        link.close()
+
+    slower = []
+    print(f"{'command':<8} {'n':>5} {'recorded ms':>12} {'replayed ms':>12} {'delta':>8}")
+    for command, (before, after) in sorted(latencies.items()):
+        old = statistics.median(before)
+        new = statistics.median(after)
+        delta = (new - old) * 100 / old if old else 0.0
+        flag = ""
+        if delta > threshold and new - old > MIN_SLOWER_MS:
+            flag = " SLOWER"
+            slower.append(command)
+        print(f"{command:<8} {len(before):>5} {old:>12.1f} {new:>12.1f} {delta:>7.1f}%{flag}")
+    print(f"{len(recorded)} commands, {mismatches} different answers")
+    return 1 if mismatches or slower else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    sub = parser.add_subparsers(dest="action", required=True)
+    dump_parser = sub.add_parser("dump", help="print the frames of a capture")
+    dump_parser.add_argument("file")
+    replay_parser = sub.add_parser("replay", help="send the commands of a capture again and compare the answers")
+    replay_parser.add_argument("file")
+    replay_parser.add_argument("port", help="serial port of the master, or socket://host:port for the simulator")
+    replay_parser.add_argument("--speed", type=float, default=1.0, help="pace of the capture divided by this")
+    replay_parser.add_argument("--binary", type=int, metavar="BAUD", help="use binary frames at this baud rate")
+    replay_parser.add_argument("--threshold", type=float, default=20.0,
+                               help="percent a median latency may grow before it counts as a regression")
+    args = parser.parse_args(argv)
+    try:
+        if args.action == "dump":
+            return dump(args.file)
+        return replay(args.file, args.port, args.speed, args.binary, args.threshold)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
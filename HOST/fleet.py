@@ -0,0 +1,286 @@
+"""
+Several masters driven in parallel from one host.
+
+One master has one serial port and one radio channel and runs one command
+at a time, which limits the whole installation. A fleet gives every master
+its own gateway (gateway.py) with its own I/O thread, searches on all
+masters at once and keeps a routing table from the lamps of the fleet to a
+master and the lamp's index on it. Commands for one lamp go to its master;
+fleet-wide operations run on all masters at the same time, so a round over
+every lamp takes as long as on the master with the most lamps. Adding a
+dongle (on its own channel) adds capacity.
+
+    fleet = Fleet([MasterLink("COM3"), MasterLink("COM4")], channels=[1, 6])
+    fleet.search()                    -> [mac, ...] in fleet order
+    fleet.command("me", "SENS", "4")  -> answer of lamp 4, from the master that has it
+    fleet.each("SENS")                -> {lamp: frames}, all masters in parallel
+    fleet.command("me", "SCNR", "03") -> recalled by every master
+
+gateway.py PORT PORT ... serves a fleet like one master, so the GUI and the
+demo tool see all its lamps. Lamps are numbered across the fleet. In PC
+protocol payloads and search answers (MAC<char>) the index is one character
+as on a master, gateway.LAMP_CHARS: chr(48 + lamp), so 0-9, then ':', ';'
+and so on, skipping '@', 'N' and 'S'. LIVE and ALRM events carry the fleet
+number of the lamp; buttons are numbered across the fleet too
+(master * 4 + button).
+
+A lamp answers a search on its channel only, and CONF<lamp>chan=<channel>
+moves it to another master's channel. Masters sharing a channel both find
+its lamps; such a lamp is routed to the first master that found it.
+
+    python fleet.py PORT PORT ... [--channels 1,6,11] [--binary BAUD] {search,sens,stat}
+"""
+import argparse
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from gateway import COMMAND_TIMEOUT, FORWARDED, LAMP_CHARS, EventHub, Gateway, lamp_char, lamp_index
+from pclink import MasterLink
+
+LAMP_COMMANDS = ("HRBT", "COLR", "SENS", "TONE") + FORWARDED  # payload starts with the lamp index
+BROADCASTS = ("SCNR",)  # sent by every master
+BUTTONS = 4  # per master
+MAX_FLEET_LAMPS = len(LAMP_CHARS)
+
+
+class Fleet(EventHub):
+    """Masters run in parallel behind the interface of one gateway."""
+
+    max_lamps = MAX_FLEET_LAMPS
+
+    def __init__(self, links, channels=None):
+        """
+        Args:
+            links (list): MasterLink per master.
+            channels (list): Radio channel per master, None to leave them as they are.
+        """
+        super().__init__()
+        self.masters = [Gateway(link) for link in links]
+        self.routes = []  # per fleet lamp: (master, index on the master)
+        self.lamps = []
+        self.duplicates = 0
+        self.pool = ThreadPoolExecutor(len(self.masters))
+        self.threads = []
+        for number, gateway in enumerate(self.masters):
+            thread = threading.Thread(target=gateway.serve, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+            threading.Thread(target=self.forward, args=(number, gateway.subscribe()), daemon=True).start()
+        if channels is not None:
+            for number, channel in enumerate(channels):
+                frames = self.masters[number].command("fleet", "CHAN", str(channel))
+                if frames[-1] != ("CHAN", str(channel)):
+                    raise ValueError(f"Master {number} didn't change to channel {channel}")
+
+    def fleet_lamp(self, master, index):
+        """Fleet number of lamp `index` of a master, None if it isn't routed to that master."""
+        try:
+            return self.routes.index((master, index))
+        except ValueError:
+            return None
+
+    def route(self, char):
+        """(master, index) of the lamp with this payload character; raises ValueError for an unknown lamp."""
+        lamp = lamp_index(char) if char else -1
+        if not 0 <= lamp < len(self.routes):
+            raise ValueError("No such lamp")
+        return self.routes[lamp]
+
+    def fan_out(self, run):
+        """Run `run(master number, gateway)` for every master at once; returns the results in master order."""
+        futures = [self.pool.submit(run, number, gateway) for number, gateway in enumerate(self.masters)]
+        return [future.result() for future in futures]
+
+    def search(self, client="fleet", timeout=COMMAND_TIMEOUT):
+        """Search on every master at once and route every lamp found. Returns the lamps in fleet order."""
+        def run(number, gateway):
+            try:
+                return gateway.command(client, "SRCH", "", timeout)
+            except TimeoutError:
+                # A master that doesn't answer has no lamps, the others still do
+                return []
+
+        results = self.fan_out(run)
+        routes = []
+        lamps = []
+        duplicates = 0
+        for number, frames in enumerate(results):
+            for reply, mac in frames:
+                if not reply.startswith("MAC") or reply == "MACN":
+                    continue
+                index = lamp_index(reply[3:])
+                if mac in lamps:
+                    duplicates += 1
+                elif 0 <= index < Gateway.max_lamps and len(lamps) < MAX_FLEET_LAMPS:
+                    routes.append((number, index))
+                    lamps.append(mac)
+        with self.lock:
+            self.routes = routes
+            self.lamps = lamps
+            self.duplicates = duplicates
+        return lamps
+
+    def command(self, client, command, payload="", timeout=COMMAND_TIMEOUT):
+        """Run a PC protocol command on the fleet and return its answer frames [(command, payload), ...]."""
+        if command in LAMP_COMMANDS:
+            master, index = self.route(payload[:1])
+            return self.masters[master].command(client, command, lamp_char(index) + payload[1:], timeout)
+        if command == "SRCH":
+            lamps = self.search(client, timeout)
+            if not lamps:
+                return [("MACN", "")]
+            return [("MAC" + lamp_char(lamp), mac) for lamp, mac in enumerate(lamps)] + [("OKAY", "")]
+        if command in BROADCASTS:
+            results = self.fan_out(lambda number, gateway: gateway.command(client, command, payload, timeout))
+            for frames in results:
+                if frames[-1][0] != "OKAY":
+                    return frames
+            return results[0]
+        if command == "STAT":
+            # The counters of every master, each after a record with its number
+            results = self.fan_out(lambda number, gateway: gateway.command(client, command, payload, timeout))
+            frames = []
+            for number, answer in enumerate(results):
+                frames.append(("STAT", f"MSTR${number}"))
+                frames.extend(answer[:-1])
+            return frames + [results[-1][-1]]
+        if command == "LIVE":
+            results = self.fan_out(lambda number, gateway: gateway.command(client, command, payload, timeout))
+            frames = []
+            for number, answer in enumerate(results):
+                for reply, data in answer[:-1]:
+                    data = self.renumber(number, reply, data)
+                    if data is not None:
+                        frames.append((reply, data))
+            return frames + [results[-1][-1]]
+        # Commands of the master itself (TIME, RBUT, BTNA, CHAN, ...) go to the first one
+        return self.masters[0].command(client, command, payload, timeout)
+
+    def each(self, command, payload="", lamps=None, client="fleet", timeout=COMMAND_TIMEOUT):
+        """
+        Send a lamp command to every lamp (or `lamps`): one lamp after the other on each master,
+        all masters at the same time. Returns {lamp: answer frames or the exception}.
+        """
+        lamps = range(len(self.routes)) if lamps is None else lamps
+        per_master = {}
+        for lamp in lamps:
+            per_master.setdefault(self.routes[lamp][0], []).append(lamp)
+
+        def run(number, gateway):
+            answers = {}
+            for lamp in per_master.get(number, ()):
+                try:
+                    answers[lamp] = self.command(client, command, lamp_char(lamp) + payload, timeout)
+                except (TimeoutError, ValueError) as e:
+                    answers[lamp] = e
+            return answers
+
+        answers = {}
+        for result in self.fan_out(run):
+            answers.update(result)
+        return answers
+
+    def bulk(self, client, lamp, command, data):
+        master, index = self.route(lamp_char(lamp))
+        return self.masters[master].bulk(client, index, command, data)
+
+    def renumber(self, master, command, payload):
+        """Payload of a master's frame with the fleet numbers of lamps and buttons, None for a lamp not routed to it."""
+        if command in ("LIVE", "ALRM", "BTNE"):
+            first, _, rest = payload.partition("$")
+            try:
+                number = int(first)
+            except ValueError:
+                return payload
+            if command == "BTNE":
+                number += master * BUTTONS
+            else:
+                number = self.fleet_lamp(master, number)
+                if number is None:
+                    return None
+            return f"{number}${rest}"
+        return payload
+
+    def forward(self, master, events):
+        """Pass the events and answers of one master on to the fleet's subscribers."""
+        while self.running:
+            event = events.get()
+            payload = self.renumber(master, event["command"], event["payload"])
+            if payload is None:
+                continue
+            request = event.get("request")
+            if request is not None and request[0] in LAMP_COMMANDS and request[1]:
+                lamp = self.fleet_lamp(master, lamp_index(request[1][0]))
+                request = (request[0], request[1] if lamp is None else lamp_char(lamp) + request[1][1:])
+            self.publish(event["command"], payload, request)
+
+    def serve(self):
+        """The masters are served by their own threads; wait until stop() is called."""
+        while self.running:
+            time.sleep(0.2)
+
+    def stop(self):
+        self.running = False
+        for gateway in self.masters:
+            gateway.stop()
+        # The links may be closed once no thread reads them
+        for thread in self.threads:
+            thread.join(1.0)
+        self.pool.shutdown(wait=False)
+
+    def status(self):
+        with self.lock:
+            return {
+                "masters": [gateway.status() for gateway in self.masters],
+                "lamps": len(self.lamps),
+                "duplicates": self.duplicates,
+                "counters": dict(self.counters),
+            }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("ports", nargs="+", metavar="port",
+                        help="serial port of a master, or socket://host:port for the simulator")
+    parser.add_argument("action", choices=("search", "sens", "stat"))
+    parser.add_argument("--channels", help="comma separated radio channel per master")
+    parser.add_argument("--binary", type=int, metavar="BAUD", help="use binary frames at this baud rate")
+    args = parser.parse_args(argv)
+    channels = [int(channel) for channel in args.channels.split(",")] if args.channels else None
+    if channels is not None and len(channels) != len(args.ports):
+        parser.error("--channels needs one channel per port")
+
+    links = [MasterLink(port, timeout=0.01, binary=args.binary) for port in args.ports]
+    fleet = None
+    try:
+        fleet = Fleet(links, channels)
+        started = time.perf_counter()
+        lamps = fleet.search()
+        print(f"{len(lamps)} lamps on {len(links)} masters in {time.perf_counter() - started:.2f} s"
+              f"{f', {fleet.duplicates} found twice' if fleet.duplicates else ''}")
+        if args.action == "search":
+            for lamp, mac in enumerate(lamps):
+                master, index = fleet.routes[lamp]
+                print(f"lamp {lamp}: {mac} master {master} index {index}")
+        elif args.action == "sens":
+            started = time.perf_counter()
+            answers = fleet.each("SENS")
+            elapsed = time.perf_counter() - started
+            for lamp, frames in sorted(answers.items()):
+                print(f"lamp {lamp}: {frames if isinstance(frames, Exception) else frames[-1][1]}")
+            print(f"{len(answers)} lamps in {elapsed:.2f} s, {len(answers) / elapsed:.1f} lamps/s")
+        else:
+            for reply, payload in fleet.command("fleet", "STAT"):
+                print(payload if reply == "STAT" else reply)
+    finally:
+        if fleet is not None:
+            fleet.stop()
+        for link in links:
+            link.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+"""
+Fragmentation and reassembly of messages larger than one frame.
+
+A message (up to MAX_MESSAGE bytes) is split into fragments of CHUNK bytes.
+Each fragment is sent as the payload of a FRAG frame:
+
+    "ttiicc" + base64(chunk)    tt transfer id, ii index, cc fragment count (hex)
+
+The receiver answers with FACK frames, a selective acknowledgement:
+
+    "ttbbmmmmmmmm"    tt transfer id, bb first missing fragment,
+                      mmmmmmmm bitmap of the ACK_SPAN fragments after it
+
+The sender keeps up to `window` fragments in flight. A fragment that is
+missing below one the receiver already has was lost and is sent again at
+once; everything else unacknowledged is sent again when the caller reports
+a timeout. Both classes are independent of the link, so the same code runs
+on the master (UART and radio side), on the lamps and on the PC.
+"""
+try:
+    import ubinascii
+except ImportError:
+    # CPython (HOST tools)
+    import binascii as ubinascii
+
+CHUNK = 18          # Message bytes per fragment: 6 header + 24 base64 characters fit in a payload
+HEADER = 6
+MAX_FRAGMENTS = 255
+MAX_MESSAGE = 2048  # Size of the reassembly buffer
+WINDOW = 8          # Default number of fragments in flight
+ACK_EVERY = 4       # The receiver acknowledges every ACK_EVERY-th fragment
+ACK_SPAN = 32       # Fragments covered by the bitmap of an acknowledgement
+MAX_TIMEOUTS = 5    # Timeouts in a row before the sender gives up
+
+# Send state of a fragment
+_NEW = 0
+_SENT = 1
+_LOST = 2
+
+
+def fragment_count(length):
+    """Number of fragments of a message of `length` bytes (an empty message is one fragment)."""
+    return max(1, (length + CHUNK - 1) // CHUNK)
+
+
+def encode_fragment(tid, index, count, chunk):
+    return "%02x%02x%02x" % (tid, index, count) + ubinascii.b2a_base64(chunk).decode().rstrip()
+
+
+def decode_ack(payload):
+    """Returns (transfer id, first missing fragment, bitmap) of a FACK payload."""
+    if len(payload) != 12:
+        raise ValueError("Bad acknowledgement")
+    return int(payload[0:2], 16), int(payload[2:4], 16), int(payload[4:12], 16)
+
+
+class Sender:
+    """Splits one message into fragments and tracks which ones the receiver has."""
+
+    def __init__(self, tid, data, window=WINDOW):
+        """
+        Args:
+            tid (int): Transfer id (0-255), must differ from the previous transfer to the same receiver.
+            data (bytes): Message, at most MAX_MESSAGE bytes.
+            window (int): Fragments in flight before waiting for an acknowledgement.
+        """
+        self.count = fragment_count(len(data))
+        if len(data) > MAX_MESSAGE or self.count > MAX_FRAGMENTS:
+            raise ValueError("Message too large")
+        self.tid = tid & 0xFF
+        self.data = data
+        self.window = min(window, ACK_SPAN)
+        self.state = bytearray(self.count)
+        self.acked = bytearray(self.count)
+        self.base = 0
+        self.timeouts = 0
+        self.retransmissions = 0
+
+    def done(self):
+        """True when the receiver has every fragment."""
+        return self.base >= self.count
+
+    def fragment(self, index):
+        """Returns the FRAG payload of one fragment."""
+        start = index * CHUNK
+        return encode_fragment(self.tid, index, self.count, self.data[start:start + CHUNK])
+
+    def pending(self):
+        """Returns the FRAG payloads to send now: new fragments within the window and lost ones."""
+        payloads = []
+        state = self.state
+        for index in range(self.base, min(self.base + self.window, self.count)):
+            if state[index] != _SENT and not self.acked[index]:
+                if state[index] == _LOST:
+                    self.retransmissions += 1
+                state[index] = _SENT
+                payloads.append(self.fragment(index))
+        return payloads
+
+    def on_ack(self, payload):
+        """
+        Applies a FACK payload. Returns True if it acknowledged new fragments.
+
+        Raises:
+            ValueError: If the payload is malformed.
+        """
+        tid, first_missing, bitmap = decode_ack(payload)
+        if tid != self.tid:
+            return False
+        acked = self.acked
+        first_missing = min(first_missing, self.count)
+        progress = False
+        for index in range(self.base, first_missing):
+            if not acked[index]:
+                acked[index] = 1
+                progress = True
+        highest = first_missing - 1
+        for bit in range(ACK_SPAN):
+            index = first_missing + 1 + bit
+            if index >= self.count:
+                break
+            if (bitmap >> bit) & 1:
+                if not acked[index]:
+                    acked[index] = 1
+                    progress = True
+                highest = index
+        # Sent before a fragment that arrived, but still missing: lost
+        for index in range(first_missing, highest):
+            if not acked[index] and self.state[index] == _SENT:
+                self.state[index] = _LOST
+        while self.base < self.count and acked[self.base]:
+            self.base += 1
+        if progress:
+            self.timeouts = 0
+        return progress
+
+    def timeout(self):
+        """
+        No acknowledgement arrived in time: every unacknowledged fragment in
+        the window is sent again by the next pending(). Returns False once
+        MAX_TIMEOUTS timeouts happened in a row.
+        """
+        self.timeouts += 1
+        for index in range(self.base, min(self.base + self.window, self.count)):
+            if not self.acked[index] and self.state[index] == _SENT:
+                self.state[index] = _LOST
+        return self.timeouts <= MAX_TIMEOUTS
+
+
+class Reassembler:
+    """
+    Collects the fragments of one transfer at a time in a buffer allocated once.
+
+    A fragment of another transfer id starts a new transfer. Fragments of a
+    completed transfer are only acknowledged again, so a sender that missed
+    the last acknowledgement can't make the message be used twice.
+    """
+
+    def __init__(self, size=MAX_MESSAGE):
+        self.buffer = bytearray(size)
+        self.received = bytearray(MAX_FRAGMENTS)
+        self.tid = -1
+        self.count = 0
+        self.have = 0
+        self.length = 0
+        self.complete = False
+        # Set when the message was completed, cleared by take()
+        self.ready = False
+
+    def __start(self, tid, count):
+        self.tid = tid
+        self.count = count
+        for index in range(count):
+            self.received[index] = 0
+        self.have = 0
+        self.length = 0
+        self.complete = False
+        self.ready = False
+
+    def on_fragment(self, payload):
+        """
+        Stores a FRAG payload.
+
+        Returns:
+            str: FACK payload to send back, or None if no acknowledgement is due.
+
+        Raises:
+            ValueError: If the fragment is malformed or the message doesn't fit the buffer.
+        """
+        if len(payload) < HEADER:
+            raise ValueError("Fragment too short")
+        tid = int(payload[0:2], 16)
+        index = int(payload[2:4], 16)
+        count = int(payload[4:6], 16)
+        if index >= count or count > fragment_count(len(self.buffer)):
+            raise ValueError("Bad fragment index")
+        if tid != self.tid or count != self.count:
+            self.__start(tid, count)
+        if self.received[index]:
+            # Sent again, so the sender is missing an acknowledgement
+            return self.ack()
+        chunk = ubinascii.a2b_base64(payload[HEADER:])
+        if len(chunk) > CHUNK or (index < count - 1 and len(chunk) != CHUNK):
+            raise ValueError("Bad fragment length")
+        start = index * CHUNK
+        end = start + len(chunk)
+        self.buffer[start:end] = chunk
+        self.received[index] = 1
+        self.have += 1
+        if index == count - 1:
+            self.length = end
+        if self.have == count:
+            self.complete = True
+            self.ready = True
+            return self.ack()
+        if index == count - 1 or (index + 1) % ACK_EVERY == 0:
+            return self.ack()
+        return None
+
+    def ack(self):
+        """Returns the FACK payload for the fragments received so far."""
+        received = self.received
+        first_missing = 0
+        while first_missing < self.count and received[first_missing]:
+            first_missing += 1
+        bitmap = 0
+        for bit in range(ACK_SPAN):
+            index = first_missing + 1 + bit
+            if index >= self.count:
+                break
+            if received[index]:
+                bitmap |= 1 << bit
+        return "%02x%02x%08x" % (self.tid, first_missing, bitmap)
+
+    def take(self):
+        """Returns the completed message as a memoryview of the buffer (valid until the next transfer)."""
+        self.ready = False
+        return memoryview(self.buffer)[:self.length]
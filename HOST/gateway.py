@@ -0,0 +1,502 @@
+"""
+Gateway that shares one master between several programs.
+
+Only one program can open the master's serial port. The gateway owns it and
+runs the commands of all its clients one at a time. Clients connect to
+
+  - the frame port, which speaks the PC protocol itself: the GUI, the demo
+    tool and the HOST scripts use socket://localhost:7008 instead of the
+    serial port
+  - a local HTTP API with JSON requests and a Server-Sent Events stream
+
+Every client has its own queue and the gateway takes the next command from
+the next client with one waiting, so a client sending many commands doesn't
+hold up the others. A command identical to one that is waiting or running
+(SENS0 from two dashboards) runs once and every caller gets its answer.
+Frames the master sends on its own (LIVE, BTNE, ALRM) go to all clients; the event
+stream also carries the answer to every command, which makes it a telemetry
+feed when the gateway polls the sensors itself (--poll-sens).
+
+    python gateway.py PORT [PORT ...] [--channels 1,6,11] [--binary BAUD] [--frame-port 7008]
+                      [--http-port 8008] [--poll-sens SECONDS] [--capture FILE [--radio]]
+
+--capture records all traffic with the master for capture.py; with --radio
+(needs --binary) the master also mirrors every radio frame into it. With
+several ports the gateway serves a fleet of masters as one (fleet.py), and
+--channels puts each master on its own radio channel.
+
+HTTP API, on 127.0.0.1 only. Send an X-Client header to be scheduled as one
+client across connections:
+
+    POST /command {"command": "SENS", "payload": "0"}  -> {"frames": [["SENS", "..."]], "ms": 12.3}
+    POST /search                                      -> {"lamps": [mac, ...]}
+    GET  /lamps                                       -> lamps of the last search
+    POST /bulk {"lamp": 0, "command": "SONG", "data": base64} -> {"ok": true, "payload": "..."}
+    GET  /status                                      -> queue and coalescing counters
+    GET  /events                                      -> text/event-stream, one JSON object per frame
+
+BINM, ASCI, MIRR and FRAG are refused: the gateway sets the link mode, and bulk
+transfers go through /bulk so their fragments can't interleave with other
+clients' commands.
+"""
+import argparse
+import base64
+import collections
+import json
+import queue
+import socketserver
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bulk import BulkError, send_bulk
+from capture import CaptureWriter
+from pclink import FRAME_LEN, MasterLink, calculate_checksum, format_command
+
+FORWARDED = ("HLTH", "BOOT", "CONF", "SCNS", "RULE")  # answered with the same command, see FWD_COMMANDS
+NOT_COALESCED = ("TONE", "SCNR")  # every request has to reach the lamps
+REFUSED = ("BINM", "ASCI", "FRAG", "MIRR")
+MIRRORED = ("RFTX", "RFRX")  # radio frames mirrored by the master, too long for ASCII frames
+COMMAND_TIMEOUT = 15.0
+EVENT_QUEUE = 256  # events kept for a slow subscriber before they are dropped
+
+
+def final_replies(command):
+    """Reply commands that end the master's answer to `command`."""
+    if command == "SRCH":
+        return ("OKAY", "MACN")
+    if command in ("STAT", "LIVE"):
+        return ("OKAY", "NACK")
+    if command == "RBUT":
+        return ("BUTS", "NACK")
+    if command in ("TIME", "SENS", "CHAN") or command in FORWARDED:
+        return (command, "NACK")
+    return ("OKAY", "NACK")
+
+
+def is_event(command, payload, request):
+    """True for a frame the master sent on its own, not as part of the answer to `request`."""
+    if command in ("BTNE", "ALRM") or command in MIRRORED:
+        return True
+    # LIVE records (index$online$age_s) answer a LIVE request, LIVE events carry a MAC address
+    return command == "LIVE" and (request != "LIVE" or ":" in payload)
+
+
+# Lamp index characters of PC protocol payloads and search answers (MAC<char>): chr(48 + index) up to '~',
+# without '@' (payload padding) and 'N' and 'S' (MACN and MACS mean something else). The same as chr(48 + index)
+# for the first 16 lamps, so the 10 lamps of one master are '0' to '9'.
+LAMP_CHARS = "".join(chr(code) for code in range(48, 127) if chr(code) not in "@NS")
+
+
+def lamp_char(index):
+    """Lamp index as the one character of PC protocol payloads: 0-9, then ':', ';' ... in a fleet."""
+    return LAMP_CHARS[index]
+
+
+def lamp_index(char):
+    """Lamp index of a payload character, -1 for a character that isn't one."""
+    return LAMP_CHARS.find(char) if len(char) == 1 else -1
+
+
+def reply_frame(command, payload):
+    """Format a frame as the master sends it ('*'-delimited)."""
+    return ("*" + format_command(command, payload)[1:-1] + "*").encode("utf-8")
+
+
+class Job:
+    """One command, possibly requested by several clients at once, and its answer."""
+
+    def __init__(self, key, run):
+        self.key = key
+        self.run = run
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class EventHub:
+    """Passes events and answers to the subscribers of a gateway (or a fleet of them)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = []  # (queue, wants answers)
+        self.counters = collections.Counter()
+        self.running = True
+
+    def subscribe(self, answers=True):
+        """Returns a queue that receives every event, and the answer to every command if `answers`."""
+        events = queue.Queue(EVENT_QUEUE)
+        with self.lock:
+            self.subscribers.append((events, answers))
+        return events
+
+    def unsubscribe(self, events):
+        with self.lock:
+            self.subscribers = [s for s in self.subscribers if s[0] is not events]
+
+    def publish(self, command, payload, request=None):
+        """Pass a frame to the subscribers; `request` is the command it answers, None for events."""
+        event = {"command": command, "payload": payload, "time": time.time()}
+        if request is not None:
+            event["request"] = list(request)
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for events, answers in subscribers:
+            if request is not None and not answers:
+                continue
+            try:
+                events.put_nowait(event)
+            except queue.Full:
+                self.counters["events_dropped"] += 1
+
+
+class Gateway(EventHub):
+    """Owns the link to the master and runs the queued commands of all clients."""
+
+    max_lamps = 10  # The master addresses lamps with a single digit index
+
+    def __init__(self, link):
+        super().__init__()
+        self.link = link
+        # Only send_bulk reads through wait_for, frames it skips are events
+        link.on_unsolicited = self.publish
+        self.queues = collections.OrderedDict()  # client -> deque of jobs, in turn order
+        self.pending = {}  # key -> job waiting or running, for coalescing
+        self.lamps = []
+
+    def submit(self, client, key, run):
+        """Queue `run()` for `client`. A job with the same key that hasn't finished is shared instead."""
+        with self.lock:
+            job = self.pending.get(key) if key is not None else None
+            if job is not None:
+                self.counters["coalesced"] += 1
+                return job
+            job = Job(key, run)
+            if key is not None:
+                self.pending[key] = job
+            self.queues.setdefault(client, collections.deque()).append(job)
+            self.counters["queued"] += 1
+        return job
+
+    def command(self, client, command, payload="", timeout=COMMAND_TIMEOUT):
+        """Run a PC protocol command for `client` and return its answer frames [(command, payload), ...]."""
+        if command in REFUSED:
+            raise ValueError(f"{command} is not available through the gateway")
+        key = None
+        if command not in NOT_COALESCED and not (command == "STAT" and payload):
+            key = (command, payload)
+        return self.submit(client, key, lambda: self.exchange(command, payload, timeout)).wait()
+
+    def bulk(self, client, lamp, command, data):
+        """Send a bulk message to a lamp (bulk.py) as one job. Returns (ok, payload)."""
+        return self.submit(client, None, lambda: send_bulk(self.link, lamp, command, data)).wait()
+
+    def _next_job(self):
+        """Take the oldest job of the next client in turn, None if nothing is queued."""
+        with self.lock:
+            for client, jobs in self.queues.items():
+                job = jobs.popleft()
+                if jobs:
+                    self.queues.move_to_end(client)
+                else:
+                    del self.queues[client]
+                return job
+        return None
+
+    def serve(self):
+        """Run jobs until stop() is called; between jobs, pass on the frames the master sends on its own."""
+        while self.running:
+            job = self._next_job()
+            if job is None:
+                frame = self.link.read_frame(0.01)
+                if frame is not None:
+                    self.publish(frame[0], frame[1])
+                continue
+            try:
+                job.result = job.run()
+                self.counters["done"] += 1
+            except Exception as e:
+                # Handed to the callers, the gateway keeps running
+                job.error = e
+                self.counters["failed"] += 1
+            with self.lock:
+                if self.pending.get(job.key) is job:
+                    del self.pending[job.key]
+            job.done.set()
+
+    def stop(self):
+        self.running = False
+
+    def exchange(self, command, payload, timeout):
+        """Send one command and collect the frames answering it, up to and including the final one."""
+        final = final_replies(command)
+        sent_at = self.link.send(command, payload)
+        deadline = sent_at + timeout
+        frames = []
+        while True:
+            frame = self.link.read_frame(max(deadline - time.perf_counter(), 0.0))
+            if frame is None:
+                raise TimeoutError(f"No answer to {command} from the master")
+            reply, data, _ = frame
+            if is_event(reply, data, command):
+                self.publish(reply, data)
+                continue
+            if reply == "MACS":
+                # Binary mode packs the search result, clients get the ASCII frames
+                count = len(frames)
+                frames.extend(("MAC" + lamp_char(count + i), mac) for i, mac in enumerate(data.split("\n")))
+            elif self.link.binary and reply not in final:
+                frames.extend((reply, record) for record in data.split("\n"))
+            else:
+                frames.append((reply, data))
+            if reply in final:
+                break
+        if command == "SRCH":
+            self.lamps = [mac for reply, mac in frames if reply.startswith("MAC") and reply != "MACN"]
+        self.publish(frames[-1][0], frames[-1][1], (command, payload))
+        return frames
+
+    def status(self):
+        with self.lock:
+            return {
+                "clients": {str(client): len(jobs) for client, jobs in self.queues.items()},
+                "subscribers": len(self.subscribers),
+                "counters": dict(self.counters),
+                "binary": self.link.binary,
+            }
+
+
+class FrameClient(socketserver.BaseRequestHandler):
+    """A client speaking the PC protocol on the frame port, like a program on the serial port."""
+
+    def handle(self):
+        gateway = self.server.gateway
+        client = "frame %s:%d" % self.client_address
+        self.write_lock = threading.Lock()
+        self.open = True
+        events = gateway.subscribe(answers=False)
+        threading.Thread(target=self.pump, args=(events,), daemon=True).start()
+        buffer = b""
+        try:
+            while True:
+                data = self.request.recv(1024)
+                if not data:
+                    break
+                buffer += data
+                while True:
+                    start = buffer.find(b"#")
+                    if start < 0:
+                        buffer = b""
+                        break
+                    if len(buffer) - start < FRAME_LEN:
+                        buffer = buffer[start:]
+                        break
+                    frame = buffer[start:start + FRAME_LEN].decode("utf-8", errors="replace")
+                    body = frame[1:37]
+                    if frame[-1] != "#" or frame[37:40] != calculate_checksum(body):
+                        # Not a frame boundary: resync on the next marker
+                        buffer = buffer[start + 1:]
+                        continue
+                    buffer = buffer[start + FRAME_LEN:]
+                    self.run(gateway, client, body[:4], body[4:].rstrip("@"))
+        except OSError:
+            pass
+        finally:
+            self.open = False
+            gateway.unsubscribe(events)
+
+    def run(self, gateway, client, command, payload):
+        try:
+            frames = gateway.command(client, command, payload)
+            data = b"".join(reply_frame(reply, data) for reply, data in frames)
+        except TimeoutError:
+            # The master didn't answer, neither does the gateway
+            return
+        except Exception as e:
+            # A refused or failed command, or an answer that can't be framed, must not end the connection
+            if not isinstance(e, ValueError):
+                print(f"{client} {command} {payload}: {e!r}", file=sys.stderr)
+            data = reply_frame("NACK", "")
+        self.write(data)
+
+    def write(self, data):
+        with self.write_lock:
+            self.request.sendall(data)
+
+    def pump(self, events):
+        while self.open:
+            try:
+                event = events.get(timeout=0.5)
+                if event["command"] not in MIRRORED:
+                    self.write(reply_frame(event["command"], event["payload"]))
+            except queue.Empty:
+                continue
+            except OSError:
+                return
+
+
+class HTTPClient(BaseHTTPRequestHandler):
+    """JSON API and event stream of the gateway."""
+
+    def client(self):
+        return self.headers.get("X-Client") or f"http {self.client_address[0]}"
+
+    def send_json(self, status, value):
+        body = json.dumps(value).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length))
+
+    def do_GET(self):
+        gateway = self.server.gateway
+        if self.path == "/lamps":
+            self.send_json(200, {"lamps": gateway.lamps})
+        elif self.path == "/status":
+            self.send_json(200, gateway.status())
+        elif self.path == "/events":
+            self.stream_events(gateway)
+        else:
+            self.send_json(404, {"error": "unknown path"})
+
+    def do_POST(self):
+        gateway = self.server.gateway
+        try:
+            request = self.read_json()
+            if self.path == "/command":
+                command = str(request["command"])
+                payload = str(request.get("payload", ""))
+                if len(command) != 4 or len(payload) > 32:
+                    raise ValueError("command needs 4 characters and at most 32 characters of payload")
+                started = time.perf_counter()
+                frames = gateway.command(self.client(), command, payload)
+                self.send_json(200, {"frames": frames, "ms": round((time.perf_counter() - started) * 1000, 1)})
+            elif self.path == "/search":
+                gateway.command(self.client(), "SRCH")
+                self.send_json(200, {"lamps": gateway.lamps})
+            elif self.path == "/bulk":
+                data = base64.b64decode(request["data"])
+                ok, payload = gateway.bulk(self.client(), int(request["lamp"]), str(request["command"]), data)
+                self.send_json(200, {"ok": ok, "payload": payload})
+            else:
+                self.send_json(404, {"error": "unknown path"})
+        except (KeyError, ValueError, TypeError) as e:
+            self.send_json(400, {"error": str(e)})
+        except (TimeoutError, BulkError) as e:
+            self.send_json(504, {"error": str(e)})
+
+    def stream_events(self, gateway):
+        events = gateway.subscribe()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        try:
+            while gateway.running:
+                try:
+                    event = events.get(timeout=15)
+                    self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                except queue.Empty:
+                    self.wfile.write(b": keepalive\n\n")
+                self.wfile.flush()
+        except OSError:
+            pass
+        finally:
+            gateway.unsubscribe(events)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def poll_sensors(gateway, period):
+    """Ask every lamp of the last search for its sensor data once per period; the answers go to the event stream."""
+    while gateway.running:
+        for index in range(min(len(gateway.lamps), gateway.max_lamps)):
+            try:
+                gateway.command("poll", "SENS", lamp_char(index))
+            except TimeoutError:
+                pass
+        time.sleep(period)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("ports", nargs="+", metavar="port",
+                        help="serial port of the master, or socket://host:port for the simulator; several for a fleet")
+    parser.add_argument("--channels", help="comma separated radio channel per master")
+    parser.add_argument("--binary", type=int, metavar="BAUD", help="use binary frames at this baud rate")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--frame-port", type=int, default=7008, help="TCP port for PC protocol clients, 0 to disable")
+    parser.add_argument("--http-port", type=int, default=8008, help="TCP port for the HTTP API, 0 to disable")
+    parser.add_argument("--poll-sens", type=float, metavar="SECONDS", help="poll the sensors of all lamps")
+    parser.add_argument("--no-search", action="store_true", help="don't search for lamps at start")
+    parser.add_argument("--capture", metavar="FILE", help="record all traffic with the master (capture.py)")
+    parser.add_argument("--radio", action="store_true", help="also record the radio frames, needs --binary")
+    args = parser.parse_args(argv)
+    if args.radio and not (args.capture and args.binary):
+        parser.error("--radio needs --capture and --binary")
+    if args.capture and len(args.ports) > 1:
+        parser.error("--capture records one master")
+    channels = [int(channel) for channel in args.channels.split(",")] if args.channels else None
+    if channels is not None and len(channels) != len(args.ports):
+        parser.error("--channels needs one channel per port")
+
+    capture = CaptureWriter(args.capture) if args.capture else None
+    links = [MasterLink(port, timeout=0.01, binary=args.binary, capture=capture) for port in args.ports]
+    link = links[0]
+    if args.radio and link.request("MIRR", "1", replies=("OKAY", "NACK"), timeout=1.0) is None:
+        print("The master doesn't mirror radio frames", file=sys.stderr)
+    if len(links) > 1 or channels:
+        from fleet import Fleet
+        gateway = Fleet(links, channels)
+    else:
+        gateway = Gateway(link)
+    servers = []
+    if args.frame_port:
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        servers.append(socketserver.ThreadingTCPServer((args.host, args.frame_port), FrameClient))
+        print(f"Frame port on socket://{args.host}:{args.frame_port}")
+    if args.http_port:
+        servers.append(ThreadingHTTPServer((args.host, args.http_port), HTTPClient))
+        print(f"HTTP API on http://{args.host}:{args.http_port}")
+    for server in servers:
+        server.gateway = gateway
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    if not args.no_search:
+        threading.Thread(target=gateway.command, args=("gateway", "SRCH"), daemon=True).start()
+    if args.poll_sens:
+        threading.Thread(target=poll_sensors, args=(gateway, args.poll_sens), daemon=True).start()
+    try:
+        gateway.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        gateway.stop()
+        for server in servers:
+            server.shutdown()
+        if args.radio:
+            link.request("MIRR", "0", replies=("OKAY", "NACK"), timeout=1.0)
+        for link in links:
+            link.close()
+        if capture is not None:
+            capture.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
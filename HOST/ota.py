@@ -0,0 +1,149 @@
+"""
+Over-the-air firmware update of lamps through the master.
+
+Sends files (normally SLAVE/*.py) to one lamp, several lamps or every lamp
+the master finds, then installs them and restarts the lamps:
+
+    python ota.py PORT FILE... [--lamps 0,2,3 | --all] [--force] [--no-commit]
+
+Each file is sent in chunks of CHUNK bytes as bulk messages (bulk.py):
+
+    OTAB  "name$size$crc32[$R]"   begin, the lamp answers "offset$staged_crc$installed_crc"
+    OTAD  offset, chunk CRC-32, chunk   (4 + 4 bytes big endian, then the data)
+    OTAE  verify the file and mark it for installation
+    OTAC  install all marked files at once and restart
+
+The lamp stages a file next to the old one and keeps what it received, so
+an interrupted update continues where it stopped when run again. Files
+whose installed CRC already matches are skipped unless --force is given.
+"""
+import argparse
+import binascii
+import os
+import sys
+import time
+
+from bulk import BulkError, send_bulk
+from pclink import MasterLink
+
+CHUNK = 2000  # Chunk bytes per OTAD message, the message must fit fragment.MAX_MESSAGE
+
+
+class UpdateError(Exception):
+    pass
+
+
+def crc32(data):
+    return binascii.crc32(data) & 0xFFFFFFFF
+
+
+def request(link, lamp, command, data):
+    """Send one bulk message and return the answer payload; raises UpdateError on NACK."""
+    ok, payload = send_bulk(link, lamp, command, data)
+    if not ok:
+        raise UpdateError(f"lamp {lamp} refused {command}")
+    return payload
+
+
+class Progress:
+    """Prints bytes sent, throughput and time left for one lamp."""
+
+    def __init__(self, lamp, total):
+        self.lamp = lamp
+        self.total = total
+        self.sent = 0
+        self.start = time.perf_counter()
+
+    def add(self, count, name):
+        self.sent += count
+        elapsed = time.perf_counter() - self.start
+        rate = self.sent / elapsed if elapsed > 0 else 0.0
+        left = (self.total - self.sent) / rate if rate > 0 else 0.0
+        print(f"\rlamp {self.lamp}: {self.sent}/{self.total} bytes  {rate / 1024:.1f} kB/s  "
+              f"{left:.0f} s left  {name:<24}", end="", flush=True)
+
+    def finish(self):
+        elapsed = time.perf_counter() - self.start
+        print(f"\rlamp {self.lamp}: {self.sent} bytes in {elapsed:.1f} s" + " " * 40)
+
+
+def send_file(link, lamp, name, data, progress, force=False):
+    """Send one file to a lamp, resuming a partial upload. Returns False if it was skipped."""
+    crc = crc32(data)
+    answer = request(link, lamp, "OTAB", f"{name}${len(data)}${crc:08x}".encode("ascii"))
+    offset, staged_crc, installed_crc = answer.split("$")
+    offset = int(offset)
+    if int(installed_crc, 16) == crc and not force:
+        progress.add(len(data), name)
+        return False
+    if offset > len(data) or int(staged_crc, 16) != crc32(data[:offset]):
+        # The lamp staged a different version of the file
+        answer = request(link, lamp, "OTAB", f"{name}${len(data)}${crc:08x}$R".encode("ascii"))
+        offset = int(answer.split("$")[0])
+    progress.add(offset, name)
+    while offset < len(data):
+        chunk = data[offset:offset + CHUNK]
+        header = offset.to_bytes(4, "big") + crc32(chunk).to_bytes(4, "big")
+        request(link, lamp, "OTAD", header + chunk)
+        offset += len(chunk)
+        progress.add(len(chunk), name)
+    request(link, lamp, "OTAE", b"")
+    return True
+
+
+def update_lamp(link, lamp, files, force=False, commit=True):
+    """Send all files to one lamp and install them. Returns the number of files sent."""
+    progress = Progress(lamp, sum(len(data) for _, data in files))
+    changed = 0
+    for name, data in files:
+        if send_file(link, lamp, name, data, progress, force):
+            changed += 1
+    progress.finish()
+    if changed and commit:
+        installed = request(link, lamp, "OTAC", b"")
+        print(f"lamp {lamp}: {installed} files installed, restarting")
+    return changed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("port", help="serial port of the master, or socket://host:port for the simulator")
+    parser.add_argument("files", nargs="+", help="files to install on the lamps (stored under their base name)")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--lamps", help="comma separated lamp indexes")
+    group.add_argument("--all", action="store_true", help="search and update every lamp")
+    parser.add_argument("--force", action="store_true", help="send files even if the lamp has them already")
+    parser.add_argument("--no-commit", action="store_true", help="only stage the files, don't install them")
+    parser.add_argument("--binary", type=int, metavar="BAUD", help="use binary frames at this baud rate")
+    args = parser.parse_args(argv)
+
+    files = []
+    for path in args.files:
+        with open(path, "rb") as f:
+            files.append((os.path.basename(path), f.read()))
+
+    link = MasterLink(args.port, binary=args.binary)
+    failed = []
+    try:
+        if args.all:
+            lamps = list(range(len(link.search())))
+        else:
+            lamps = [int(lamp) for lamp in args.lamps.split(",")]
+        start = time.perf_counter()
+        for lamp in lamps:
+            try:
+                update_lamp(link, lamp, files, args.force, not args.no_commit)
+            except (BulkError, UpdateError) as e:
+                print(f"\nlamp {lamp}: {e}", file=sys.stderr)
+                failed.append(lamp)
+        print(f"{len(lamps) - len(failed)}/{len(lamps)} lamps updated in {time.perf_counter() - start:.1f} s")
+    finally:
+        link.close()
+    if failed:
+        print("Failed:", ",".join(str(lamp) for lamp in failed), "(run again to resume)", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,244 @@
+"""
+PC side of the PC<->MASTER serial protocol.
+
+Frames are 41 characters: '#' + command(4) + payload(32, '@'-padded) +
+3-digit XOR checksum + '#' towards the master, '*'-delimited from it.
+`port` can be anything pyserial's serial_for_url understands, e.g. "COM5",
+"/dev/ttyACM0" or "socket://localhost:7007" for the master simulator.
+
+MasterLink(port, binary=921600) switches the master to binary frames
+(binframe.py) at a higher baud rate: variable length, CRC-16, and replies
+with several records (STAT, the MAC list after SRCH) packed in one frame.
+
+MasterLink(port, capture=capture.CaptureWriter(path)) records every frame
+in both directions for capture.py.
+"""
+import random
+import time
+
+import serial
+
+import binframe
+
+FRAME_LEN = 41
+PAYLOAD_LEN = 32
+
+
+def calculate_checksum(data):
+    """Calculate the 3-digit XOR checksum for the given data."""
+    checksum = 0
+    for char in data:
+        checksum ^= ord(char)
+    return f"{checksum:03}"
+
+
+def format_command(command, payload=""):
+    """Format a command with payload and checksum as a frame for the master."""
+    if len(command) != 4:
+        raise ValueError("Command must be 4 characters long.")
+    if len(payload) > PAYLOAD_LEN:
+        raise ValueError("Payload must be 32 characters or less.")
+    data = command + payload + "@" * (PAYLOAD_LEN - len(payload))
+    return f"#{data}{calculate_checksum(data)}#"
+
+
+def decode_response(frame):
+    """Decode a frame from the master. Returns (command, payload, valid)."""
+    if len(frame) != FRAME_LEN or frame[0] != "*" or frame[-1] != "*":
+        return None, None, False
+    command = frame[1:5]
+    payload = frame[5:37]
+    valid = frame[37:40] == calculate_checksum(command + payload)
+    return command, payload.rstrip("@"), valid
+
+
+class MasterLink:
+    """Serial connection to one master with frame resynchronisation."""
+
+    def __init__(self, port, baudrate=115200, timeout=0.05, binary=None, capture=None):
+        """
+        `binary` is the baud rate for binary frames, None keeps ASCII frames.
+        `capture` is a capture.CaptureWriter that records the traffic.
+        """
+        self.port = port
+        self.baudrate = baudrate
+        self.serial = serial.serial_for_url(port, baudrate=baudrate, timeout=timeout)
+        self._buffer = b""
+        self.binary = False
+        self.capture = capture
+        # Called with (command, payload) for frames nobody was waiting for
+        self.on_unsolicited = None
+        # Transfer id of the last bulk transfer (bulk.py). The master only starts a new transfer when the id
+        # changes, so it counts up; the random start keeps it apart from the last one before a restart.
+        self.bulk_tid = random.getrandbits(8)
+        if binary:
+            self.enable_binary(binary)
+
+    def close(self):
+        if self.binary:
+            # Leave the master in ASCII mode for the next program
+            self.request("ASCI", replies=("OKAY",), timeout=1.0)
+        self.serial.close()
+
+    def enable_binary(self, baudrate=921600):
+        """
+        Switch the master to binary frames at `baudrate`. A master still in
+        binary mode from an earlier connection is found at the new baud rate.
+        Raises ConnectionError if the master doesn't switch.
+        """
+        reply = self.request("BINM", str(baudrate), replies=("OKAY", "NACK"), timeout=1.0)
+        if reply is None:
+            self.binary = True
+            self.serial.baudrate = baudrate
+            self._buffer = b""
+            # End whatever the master made of the ASCII frame and skip its answers to it
+            self.serial.write(b"\x00")
+            while self.read_frame(0.2) is not None:
+                pass
+            reply = self.request("BINM", str(baudrate), replies=("OKAY", "NACK"), timeout=1.0)
+        if reply is None or reply[0] != "OKAY":
+            self.binary = False
+            self.serial.baudrate = self.baudrate
+            raise ConnectionError(f"Master did not switch to binary frames at {baudrate} baud")
+        if not self.binary:
+            # The master changes the baud rate after its reply is sent
+            self.serial.flush()
+            time.sleep(0.01)
+            self.serial.baudrate = baudrate
+            self.binary = True
+            self._buffer = b""
+
+    def send(self, command, payload=""):
+        """Write one command frame. Returns the host time of the write."""
+        if self.binary:
+            frame = bytes(binframe.encode(command, payload))
+        else:
+            frame = format_command(command, payload).encode("utf-8")
+        sent_at = time.perf_counter()
+        self.serial.write(frame)
+        if self.capture is not None:
+            self.capture.frame_sent(frame, sent_at)
+        return sent_at
+
+    def read_frame(self, timeout=1.0):
+        """
+        Read the next valid frame. Returns (command, payload, receive_time)
+        or None on timeout. Bytes before a '*' start marker are skipped and
+        frames with a bad checksum are dropped.
+        """
+        deadline = time.perf_counter() + timeout
+        while True:
+            if self.binary:
+                frame = self._next_binary()
+                if frame is not None:
+                    return frame
+                if time.perf_counter() >= deadline:
+                    return None
+                self._read_some()
+                continue
+            start = self._buffer.find(b"*")
+            if start < 0:
+                self._buffer = b""
+            elif len(self._buffer) - start >= FRAME_LEN:
+                raw = self._buffer[start:start + FRAME_LEN]
+                command, payload, valid = decode_response(raw.decode("utf-8", errors="replace"))
+                if valid:
+                    self._buffer = self._buffer[start + FRAME_LEN:]
+                    received_at = time.perf_counter()
+                    if self.capture is not None:
+                        self.capture.frame_received(raw, command, payload, received_at)
+                    return command, payload, received_at
+                # Not a frame boundary: resync on the next marker
+                self._buffer = self._buffer[start + 1:]
+                continue
+            elif start > 0:
+                self._buffer = self._buffer[start:]
+            if time.perf_counter() >= deadline:
+                return None
+            self._read_some()
+
+    def _read_some(self):
+        chunk = self.serial.read(max(1, self.serial.in_waiting))
+        if chunk:
+            self._buffer += chunk
+
+    def _next_binary(self):
+        """Take the next valid binary frame from the buffer, dropping damaged ones. None if none is complete."""
+        while True:
+            end = self._buffer.find(b"\x00")
+            if end < 0:
+                return None
+            raw = self._buffer[:end]
+            self._buffer = self._buffer[end + 1:]
+            if not raw:
+                continue
+            try:
+                command, payload = binframe.decode(raw)
+            except ValueError:
+                continue
+            payload = payload.decode("utf-8", errors="replace")
+            received_at = time.perf_counter()
+            if self.capture is not None:
+                self.capture.frame_received(raw + b"\x00", command, payload, received_at)
+            return command, payload, received_at
+
+    def records(self, command, payload="", record=None, timeout=15.0):
+        """
+        Send a command answered by a list of `record` frames and a final OKAY
+        (STAT). Returns the list of records, in binary mode unpacked from the
+        frames that carry several, or None on timeout or NACK.
+        """
+        record = record or command
+        self.send(command, payload)
+        result = []
+        while True:
+            frame = self.wait_for((record, "OKAY", "NACK"), timeout)
+            if frame is None or frame[0] == "NACK":
+                return None
+            if frame[0] == "OKAY":
+                return result
+            result.extend(frame[1].split("\n") if self.binary else [frame[1]])
+
+    def wait_for(self, replies, timeout=15.0):
+        """Wait for one of the given reply commands; other frames go to on_unsolicited."""
+        deadline = time.perf_counter() + timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return None
+            frame = self.read_frame(remaining)
+            if frame is None:
+                return None
+            if frame[0] in replies:
+                return frame
+            if self.on_unsolicited is not None:
+                self.on_unsolicited(frame[0], frame[1])
+
+    def request(self, command, payload="", replies=("OKAY", "NACK", "BUSY"), timeout=15.0):
+        """Send a command and wait for its reply. Returns (command, payload, latency_s) or None."""
+        sent_at = self.send(command, payload)
+        frame = self.wait_for(replies, timeout)
+        if frame is None:
+            return None
+        return frame[0], frame[1], frame[2] - sent_at
+
+    def search(self, timeout=5.0):
+        """Run SRCH and return the list of lamp MAC addresses in master index order."""
+        self.send("SRCH")
+        macs = []
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            frame = self.read_frame(deadline - time.perf_counter())
+            if frame is None:
+                break
+            command, payload, _ = frame
+            if command == "MACN" or command == "OKAY":
+                break
+            if command == "MACS":
+                # Binary mode: several addresses per frame, in index order
+                macs.extend(payload.split("\n"))
+            elif command.startswith("MAC"):
+                macs.append(payload)
+            elif self.on_unsolicited is not None:
+                self.on_unsolicited(command, payload)
+        return macs
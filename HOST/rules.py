@@ -0,0 +1,126 @@
+"""
+Program the alarm rules of the lamps through the master.
+
+A rule compares one sensor value with a threshold on the lamp itself, with
+every sensor sample (every 2 s while the lamp has rules). When it fires the
+lamp recalls a scene, plays a song and pushes an ALRM frame, without the PC
+or even the master; once the value is back past the threshold by the
+hysteresis the rule clears and the LEDs return to their previous levels.
+Rules are numbered 0-7 per lamp:
+
+    python rules.py PORT set N "t>28.5/0.5" [--scene S] [--song ALARM] [--quiet] (--lamps 0,2 | --all)
+    python rules.py PORT get N (--lamps 0,2 | --all)
+    python rules.py PORT delete N (--lamps 0,2 | --all)
+    python rules.py PORT active (--lamps 0,2 | --all)
+    python rules.py PORT watch                          print ALRM events until Ctrl+C
+
+Sensors: t temperature (degC), h humidity (%), v TVOC (ppb), l light (lux).
+"""
+import argparse
+import sys
+
+from pclink import MasterLink
+
+MAX_RULES = 8
+MAX_SCENES = 16
+SENSORS = "thvl"
+
+
+def rule_value(condition, scene=None, song=None, event=True):
+    """RULE text of a rule: "<sensor><comparator><threshold>[/<hysteresis>]$scene$song$event"."""
+    if len(condition) < 3 or condition[0] not in SENSORS or condition[1] not in "<>":
+        raise ValueError("condition must be like t>28.5/0.5 (sensor t, h, v or l, then > or <)")
+    threshold, _, hysteresis = condition[2:].partition("/")
+    float(threshold)
+    if hysteresis and float(hysteresis) < 0:
+        raise ValueError("hysteresis must not be negative")
+    if scene is not None and not 0 <= scene < MAX_SCENES:
+        raise ValueError("scene must be 0-15")
+    if song is not None and not 0 < len(song) <= 6:
+        raise ValueError("song names have 1-6 characters")
+    value = f"{condition}${'-' if scene is None else f'{scene:02X}'}${song or '-'}${int(event)}"
+    if len(value) > 29:
+        raise ValueError("rule too long, shorten the threshold")
+    return value
+
+
+def program(link, lamp, number, value):
+    """Store (value) or read (None) rule `number` on one lamp. Returns the lamp's answer or None on NACK/timeout."""
+    reply = link.request("RULE", f"{lamp}{number:02x}{value or ''}", replies=("RULE", "NACK"), timeout=5.0)
+    if reply is None or reply[0] != "RULE":
+        return None
+    return reply[1]
+
+
+def active(link, lamp):
+    """Numbers of the rules of a lamp that have fired and not cleared, None on NACK/timeout."""
+    reply = link.request("RULE", f"{lamp}?", replies=("RULE", "NACK"), timeout=5.0)
+    if reply is None or reply[0] != "RULE":
+        return None
+    mask = int(reply[1], 16)
+    return [number for number in range(MAX_RULES) if mask >> number & 1]
+
+
+def watch(link):
+    """Print ALRM events "index$rule$active$value" as the lamps push them."""
+    try:
+        while True:
+            frame = link.read_frame(1.0)
+            if frame is None or frame[0] != "ALRM":
+                continue
+            lamp, number, state, value = frame[1].split("$")
+            print(f"lamp {lamp} rule {int(number, 16)}: {'FIRED' if state == '1' else 'cleared'} at {value}")
+    except KeyboardInterrupt:
+        return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("port", help="serial port of the master, or socket://host:port for the simulator")
+    parser.add_argument("action", choices=("set", "get", "delete", "active", "watch"))
+    parser.add_argument("rule", nargs="?", type=int, help="rule number 0-7")
+    parser.add_argument("condition", nargs="?", help="e.g. t>28.5/0.5: sensor, comparator, threshold/hysteresis")
+    parser.add_argument("--scene", type=int, help="scene recalled while the rule is active")
+    parser.add_argument("--song", help="song played when the rule fires, e.g. ALARM")
+    parser.add_argument("--quiet", action="store_true", help="don't push ALRM events for this rule")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--lamps", help="comma separated lamp indexes")
+    group.add_argument("--all", action="store_true", help="search and program every lamp")
+    parser.add_argument("--binary", type=int, metavar="BAUD", help="use binary frames at this baud rate")
+    args = parser.parse_args(argv)
+
+    if args.action in ("set", "get", "delete") and not (args.rule is not None and 0 <= args.rule < MAX_RULES):
+        parser.error("a rule number 0-7 is required")
+    if args.action != "watch" and not (args.lamps or args.all):
+        parser.error("--lamps or --all is required")
+    if args.action == "set":
+        try:
+            value = rule_value(args.condition or "", args.scene, args.song, not args.quiet)
+        except ValueError as e:
+            parser.error(str(e))
+
+    link = MasterLink(args.port, binary=args.binary)
+    try:
+        if args.action == "watch":
+            return watch(link)
+        lamps = list(range(len(link.search()))) if args.all else [int(lamp) for lamp in args.lamps.split(",")]
+        failed = 0
+        for lamp in lamps:
+            if args.action == "active":
+                numbers = active(link, lamp)
+                if numbers is None:
+                    failed += 1
+                print(f"lamp {lamp} active rules: {'NACK' if numbers is None else numbers}")
+                continue
+            job = {"set": value if args.action == "set" else None, "delete": "-"}.get(args.action)
+            answer = program(link, lamp, args.rule, job)
+            if answer is None:
+                failed += 1
+            print(f"lamp {lamp} rule {args.rule}: {'NACK' if answer is None else answer or 'OKAY'}")
+    finally:
+        link.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
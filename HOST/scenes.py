@@ -0,0 +1,114 @@
+"""
+Program and recall lamp scenes through the master.
+
+A scene is six channel levels (R G B W A UV), a fade time and an effect,
+stored under a number (0-15) on every lamp. Programming goes lamp by lamp;
+a recall is a single broadcast frame for all lamps, or the lamps in a group
+(CONF groups), however many there are:
+
+    python scenes.py PORT set N RRGGBBWWAAUU [--fade MS] [--effect breathe] (--lamps 0,2 | --all)
+    python scenes.py PORT get N (--lamps 0,2 | --all)
+    python scenes.py PORT delete N (--lamps 0,2 | --all)
+    python scenes.py PORT presets (--lamps 0,2 | --all)     program PRESETS as scenes 0-7
+    python scenes.py PORT recall N [--group G]
+"""
+import argparse
+import sys
+
+from pclink import MasterLink
+
+MAX_SCENES = 16
+EFFECTS = ("none", "breathe", "flicker")
+
+# The preset colours of the demo tool, as scenes with a one second fade
+PRESETS = (
+    ("RED", "FF0000000000"),
+    ("ORANGE", "FFA500000000"),
+    ("YELLOW", "FFFF00000000"),
+    ("GREEN", "00FF00000000"),
+    ("BLUE", "0000FF000000"),
+    ("PURPLE", "800080000000"),
+    ("WHITE", "000000FF0000"),
+    ("UV", "0000000000FF"),
+)
+
+
+def scene_value(levels, fade_ms=0, effect="none"):
+    """SCNS text of a scene: "RRGGBBWWAAUU$fade_ms$effect"."""
+    if len(levels) != 12:
+        raise ValueError("levels must be 12 hex digits (R G B W A UV)")
+    int(levels, 16)
+    if not 0 <= fade_ms <= 0xFFFF:
+        raise ValueError("fade must be 0-65535 ms")
+    return f"{levels.upper()}${fade_ms}${EFFECTS.index(effect)}"
+
+
+def program(link, lamp, number, value):
+    """Store (value) or read (None) scene `number` on one lamp. Returns the lamp's answer or None on NACK/timeout."""
+    reply = link.request("SCNS", f"{lamp}{number:02x}{value or ''}", replies=("SCNS", "NACK"), timeout=5.0)
+    if reply is None or reply[0] != "SCNS":
+        return None
+    return reply[1]
+
+
+def recall(link, number, group=None):
+    """Recall a scene on all lamps (or one group) with one broadcast. Returns True once the master sent it."""
+    payload = f"{number:02x}" if group is None else f"{number:02x}{group:02x}"
+    reply = link.request("SCNR", payload, replies=("OKAY", "NACK", "BUSY"), timeout=2.0)
+    return reply is not None and reply[0] == "OKAY"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("port", help="serial port of the master, or socket://host:port for the simulator")
+    parser.add_argument("action", choices=("set", "get", "delete", "presets", "recall"))
+    parser.add_argument("scene", nargs="?", type=int, help="scene number 0-15")
+    parser.add_argument("levels", nargs="?", help="RRGGBBWWAAUU in hex for set")
+    parser.add_argument("--fade", type=int, default=0, help="fade time in ms")
+    parser.add_argument("--effect", choices=EFFECTS, default="none", help="effect after the fade")
+    parser.add_argument("--group", type=int, help="recall only on the lamps in this group")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--lamps", help="comma separated lamp indexes")
+    group.add_argument("--all", action="store_true", help="search and program every lamp")
+    parser.add_argument("--binary", type=int, metavar="BAUD", help="use binary frames at this baud rate")
+    args = parser.parse_args(argv)
+
+    if args.action != "presets" and not (args.scene is not None and 0 <= args.scene < MAX_SCENES):
+        parser.error("a scene number 0-15 is required")
+    if args.action != "recall" and not (args.lamps or args.all):
+        parser.error("--lamps or --all is required")
+    if args.action == "set":
+        try:
+            value = scene_value(args.levels or "", args.fade, args.effect)
+        except ValueError as e:
+            parser.error(str(e))
+
+    link = MasterLink(args.port, binary=args.binary)
+    try:
+        if args.action == "recall":
+            ok = recall(link, args.scene, args.group)
+            print("OKAY" if ok else "NACK")
+            return 0 if ok else 1
+        lamps = list(range(len(link.search()))) if args.all else [int(lamp) for lamp in args.lamps.split(",")]
+        if args.action == "presets":
+            jobs = [(number, scene_value(levels, 1000)) for number, (_, levels) in enumerate(PRESETS)]
+        elif args.action == "set":
+            jobs = [(args.scene, value)]
+        elif args.action == "delete":
+            jobs = [(args.scene, "-")]
+        else:
+            jobs = [(args.scene, None)]
+        failed = 0
+        for lamp in lamps:
+            for number, job in jobs:
+                answer = program(link, lamp, number, job)
+                if answer is None:
+                    failed += 1
+                print(f"lamp {lamp} scene {number}: {'NACK' if answer is None else answer or 'OKAY'}")
+    finally:
+        link.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
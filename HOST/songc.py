@@ -0,0 +1,206 @@
+"""
+Song compiler for the lamp buzzer.
+
+Reads songs in a text notation and writes SLAVE/sounds.py, where every song
+is a bytes object of 3-byte records (note index, duration in ms big endian)
+as played by soundControl.Buzzer. Bytes objects stay in flash when sounds.py
+is frozen into the firmware. One song per line, '#' starts a comment:
+
+    startup_sound: C4/200 E4/200 G4/200 C5/400    note/ms, P is a pause
+    gong = Gong:d=2,o=5,b=80:c,e,g                RTTTL (the title is ignored)
+
+Notes are C1 to B7 with '#' or 'b' accidentals (C#4, Db4).
+
+    python songc.py [songs.txt] [-o ../SLAVE/sounds.py] [--list]
+    python songc.py [songs.txt] --upload PORT --lamp N
+
+--upload sends the songs to a running lamp through the master (bulk.py)
+instead of writing sounds.py; TONE plays them by the name in the source.
+"""
+import argparse
+import os
+import re
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SOURCE = os.path.join(HERE, 'songs.txt')
+DEFAULT_OUTPUT = os.path.join(HERE, '..', 'SLAVE', 'sounds.py')
+
+SEMITONES = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11, 'H': 11}
+NOTE_NAMES = ('C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B')
+MAX_MS = 0xFFFF
+NAME_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+class SongError(ValueError):
+    pass
+
+
+def note_index(letter, accidental, octave):
+    """Note index used by soundControl.NOTE_FREQS: 0 pause, 1 + 12 * (octave - 1) + semitone."""
+    letter = letter.upper()
+    if letter == 'P':
+        return 0
+    if letter not in SEMITONES:
+        raise SongError(f"Unknown note {letter!r}")
+    semitone = SEMITONES[letter] + {'': 0, '#': 1, 'b': -1}[accidental]
+    index = 1 + 12 * (octave - 1) + semitone
+    if not 1 <= index <= 84:
+        raise SongError(f"Note {letter}{accidental}{octave} is outside C1..B7")
+    return index
+
+
+def parse_simple(text):
+    """Parse "note/ms note/ms ..." into [(index, ms), ...]."""
+    notes = []
+    for token in text.split():
+        match = re.fullmatch(r'([A-Ha-hPp])([#b]?)(\d?)/(\d+)', token)
+        if not match:
+            raise SongError(f"Bad note {token!r}, expected e.g. C4/200 or P/100")
+        letter, accidental, octave, ms = match.groups()
+        if letter.upper() != 'P' and not octave:
+            raise SongError(f"Note {token!r} needs an octave")
+        notes.append((note_index(letter, accidental, int(octave or 0)), int(ms)))
+    return notes
+
+
+def parse_rtttl(text):
+    """Parse an RTTTL string "title:d=4,o=5,b=120:8c6,p,..." into [(index, ms), ...]."""
+    try:
+        _, defaults, body = text.split(':', 2)
+    except ValueError:
+        raise SongError("RTTTL needs three ':'-separated sections")
+    settings = {'d': 4, 'o': 6, 'b': 63}
+    for item in defaults.split(','):
+        if item.strip():
+            key, _, value = item.partition('=')
+            settings[key.strip().lower()] = int(value)
+    whole_ms = 60000 * 4 / settings['b']
+    notes = []
+    for token in body.split(','):
+        token = token.strip().lower()
+        if not token:
+            continue
+        match = re.fullmatch(r'(\d*)([a-hp])(#?)(\.?)(\d?)(\.?)', token)
+        if not match:
+            raise SongError(f"Bad RTTTL note {token!r}")
+        duration, letter, sharp, dot1, octave, dot2 = match.groups()
+        ms = whole_ms / int(duration or settings['d'])
+        if dot1 or dot2:
+            ms *= 1.5
+        notes.append((note_index(letter, sharp, int(octave or settings['o'])), round(ms)))
+    return notes
+
+
+def parse(source):
+    """Parse a song source file into an ordered list of (name, notes)."""
+    songs = []
+    for number, line in enumerate(source.splitlines(), 1):
+        # '#' starts a comment unless it is part of a note (C#4)
+        line = re.split(r'(?:^|\s)#', line, 1)[0].strip()
+        if not line:
+            continue
+        try:
+            if '=' in line.split(':', 1)[0]:
+                name, text = line.split('=', 1)
+                notes = parse_rtttl(text.strip())
+            else:
+                name, _, text = line.partition(':')
+                notes = parse_simple(text)
+            name = name.strip()
+            if not NAME_RE.match(name):
+                raise SongError(f"Bad song name {name!r}")
+            if not notes:
+                raise SongError("Song has no notes")
+            for _, ms in notes:
+                if not 0 < ms <= MAX_MS:
+                    raise SongError(f"Duration {ms} ms out of range 1..{MAX_MS}")
+        except SongError as e:
+            raise SongError(f"line {number}: {e}")
+        songs.append((name, notes))
+    return songs
+
+
+def encode(notes):
+    """Encode notes as the 3-byte records played by soundControl.Buzzer."""
+    record = bytearray()
+    for index, ms in notes:
+        record += bytes((index, ms >> 8, ms & 0xFF))
+    return bytes(record)
+
+
+def generate(songs, source_name):
+    """Return the text of sounds.py for the given songs."""
+    lines = [
+        f"# Generated by HOST/songc.py from {source_name}, edit the source and run the compiler again.",
+        "# Each song is a sequence of 3-byte records: note index (soundControl.NOTE_FREQS), duration in ms.",
+    ]
+    for name, notes in songs:
+        total = sum(ms for _, ms in notes)
+        lines.append(f"{name} = {encode(notes)!r}  # {len(notes)} notes, {total} ms")
+    return "\r\n".join(lines) + "\r\n"
+
+
+def describe(notes):
+    names = []
+    for index, ms in notes:
+        if index == 0:
+            names.append(f"P/{ms}")
+        else:
+            octave, semitone = divmod(index - 1, 12)
+            names.append(f"{NOTE_NAMES[semitone]}{octave + 1}/{ms}")
+    return ' '.join(names)
+
+
+def upload(songs, port, lamp):
+    """Send every song to a lamp as a SONG bulk message: name, zero byte, records."""
+    from bulk import BulkError, send_bulk
+    from pclink import MasterLink
+
+    link = MasterLink(port)
+    try:
+        for name, notes in songs:
+            ok, _ = send_bulk(link, lamp, 'SONG', name.encode('ascii') + b'\0' + encode(notes))
+            print(f"{name}: {'OKAY' if ok else 'NACK'}")
+            if not ok:
+                return 1
+    except BulkError as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        link.close()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('source', nargs='?', default=DEFAULT_SOURCE)
+    parser.add_argument('-o', '--output', default=DEFAULT_OUTPUT)
+    parser.add_argument('--list', action='store_true', help='print the parsed songs instead of writing them')
+    parser.add_argument('--upload', metavar='PORT', help='send the songs to a lamp through the master on PORT')
+    parser.add_argument('--lamp', type=int, default=0, help='lamp index for --upload')
+    args = parser.parse_args(argv)
+
+    with open(args.source, 'r', encoding='utf-8') as f:
+        try:
+            songs = parse(f.read())
+        except SongError as e:
+            print(f"{args.source}: {e}", file=sys.stderr)
+            return 1
+
+    if args.list:
+        for name, notes in songs:
+            print(f"{name}: {describe(notes)}")
+        return 0
+
+    if args.upload:
+        return upload(songs, args.upload, args.lamp)
+
+    with open(args.output, 'w', encoding='utf-8', newline='') as f:
+        f.write(generate(songs, 'HOST/' + os.path.basename(args.source)))
+    print(f"{len(songs)} songs written to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
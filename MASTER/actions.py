@@ -0,0 +1,152 @@
+import struct
+import record
+
+PATH = "actions.bin"
+BUTTONS = 4
+KINDS = "PRL"                # Event kinds of button.py: press, release, long press
+SLOTS = BUTTONS * len(KINDS)
+TYPES = "STA"                # Recall a scene, toggle between two scenes, start/stop the alarm
+SCENE = 0
+TOGGLE = 1
+ALARM = 2
+ALL_LAMPS = 0xFF             # Group of an action for every lamp
+DEFAULT_SONG = "ALARM"
+
+# Record (record.py) items, per slot (button * 3 + kind): used, type, scene, second scene, group, song
+_ACTION = "<BBBBB6s"
+_ACTION_SIZE = struct.calcsize(_ACTION)
+
+
+class ActionTable(record.FlashRecord):
+    """
+    What the master does on its own when a button event happens: recall a
+    scene on all lamps or a group, toggle between two scenes, or start and
+    stop the alarm (a scene and a song on the lamps, then a second scene).
+    Every action is a scene recall broadcast (SCNR), sent by the master
+    without the PC and outside the PC's command lockout. The PC programs
+    the actions with BTNA; they are kept in a binary record on flash and
+    written by service() (record.py), which is called every tick.
+    """
+
+    MAGIC = b"BA"
+    ITEM_SIZE = _ACTION_SIZE
+    NAME = "actions"
+
+    def __init__(self, path=PATH):
+        """
+        Args:
+            path (str): File of the record, None keeps the actions in RAM only.
+        """
+        # Per slot: toggle actions that recalled their first scene last
+        self.toggled = bytearray(SLOTS)
+        self.alarm = False
+        super().__init__(path)
+
+    def defaults(self):
+        # Per slot: None or (type, scene, second scene, group, song)
+        self.actions = [None] * SLOTS
+
+    def encode(self):
+        items = bytearray()
+        for action in self.actions:
+            if action is None:
+                items += struct.pack(_ACTION, 0, 0, 0, 0, ALL_LAMPS, b"")
+            else:
+                items += struct.pack(_ACTION, 1, action[0], action[1], action[2], action[3], action[4].encode())
+        return self.frame(SLOTS, bytes(items))
+
+    def decode(self, data):
+        """Applies a record; raises ValueError if it is damaged."""
+        _, count = self.check(data)
+        self.defaults()
+        for slot in range(min(count, SLOTS)):
+            used, action_type, scene, second, group, song = struct.unpack_from(
+                _ACTION, data, record.HEADER_SIZE + slot * _ACTION_SIZE)
+            if used:
+                self.actions[slot] = (action_type, scene, second, group, song.rstrip(b"\x00").decode())
+
+    def __slot(self, button, kind):
+        slot = KINDS.find(kind)
+        if not 0 <= button < BUTTONS or slot < 0:
+            raise ValueError("Bad button event")
+        return button * len(KINDS) + slot
+
+    def get(self, slot):
+        """Returns the action of a slot as BTNA text: "S03", "T0304[gg]", "A0500[gg]$SONG"."""
+        action = self.actions[slot]
+        text = "%s%02X" % (TYPES[action[0]], action[1])
+        if action[0] != SCENE:
+            text += "%02X" % action[2]
+        if action[3] != ALL_LAMPS:
+            text += "%02X" % action[3]
+        if action[0] == ALARM:
+            text += "$" + action[4]
+        return text
+
+    def set(self, button, kind, value):
+        """
+        Stores the action of a button event from BTNA text, "-" deletes it; raises ValueError for a bad value.
+
+        Args:
+            button (int): Button index.
+            kind (str): "P", "R" or "L".
+            value (str): "Snn[gg]" scene nn, "Tnnmm[gg]" toggle between nn and mm,
+                "Annmm[gg][$SONG]" alarm: nn and the song (ALARM) on start, mm on stop;
+                on all lamps or only on group gg (hex). Or "-".
+        """
+        slot = self.__slot(button, kind)
+        if value == "-":
+            self.actions[slot] = None
+        else:
+            value, _, song = value.partition("$")
+            action_type = TYPES.index(value[0])
+            digits = value[1:]
+            scenes = 1 if action_type == SCENE else 2
+            if len(digits) not in (2 * scenes, 2 * scenes + 2) or (song and action_type != ALARM) or len(song) > 6:
+                raise ValueError("Bad action")
+            scene = int(digits[0:2], 16)
+            second = int(digits[2:4], 16) if action_type != SCENE else 0
+            group = int(digits[2 * scenes:], 16) if len(digits) > 2 * scenes else ALL_LAMPS
+            if group != ALL_LAMPS and group > 15:
+                raise ValueError("Bad group")
+            self.actions[slot] = (action_type, scene, second, group, song or (DEFAULT_SONG if action_type == ALARM else ""))
+        self.toggled[slot] = 0
+        self.changed()
+
+    def records(self):
+        """Returns "button$kind$action" for every button event with an action."""
+        result = []
+        for slot in range(SLOTS):
+            if self.actions[slot] is not None:
+                result.append("%d$%s$%s" % (slot // len(KINDS), KINDS[slot % len(KINDS)], self.get(slot)))
+        return result
+
+    def run(self, button, kind):
+        """
+        Returns the SCNR payload for a button event, "nn" or "nngg" (group "--" for all
+        lamps when a song follows) with the song name appended; None if it has no action.
+        """
+        try:
+            slot = self.__slot(button, kind)
+        except ValueError:
+            return None
+        action = self.actions[slot]
+        if action is None:
+            return None
+        scene = action[1]
+        song = ""
+        if action[0] == TOGGLE:
+            self.toggled[slot] ^= 1
+            if not self.toggled[slot]:
+                scene = action[2]
+        elif action[0] == ALARM:
+            # One alarm per master, any alarm button starts or stops it
+            self.alarm = not self.alarm
+            if self.alarm:
+                song = action[4]
+            else:
+                scene = action[2]
+        group = "" if action[3] == ALL_LAMPS else "%02x" % action[3]
+        if song and not group:
+            group = "--"
+        return "%02x%s%s" % (scene, group, song)
@@ -0,0 +1,115 @@
+"""
+Binary frames of the PC<->MASTER link, used after a BINM command.
+
+A frame carries a command and a payload of variable length:
+
+    command(4) + payload(0..MAX_PAYLOAD bytes) + CRC-16 (big endian)
+
+COBS-encoded and ended by a zero byte. COBS removes every zero byte from
+the frame, so the receiver finds the frames by the zero bytes alone and a
+damaged frame only costs that frame. The CRC is CRC-16/CCITT-FALSE over
+command and payload. The same module runs on the master and on the PC.
+"""
+from array import array
+
+MAX_PAYLOAD = 240
+MAX_FRAME = 4 + MAX_PAYLOAD + 2 + 2  # Encoded frame without the zero byte, COBS adds one byte per 254
+
+
+def _crc_table():
+    table = array('H', [0] * 256)
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021 if crc & 0x8000 else crc << 1) & 0xFFFF
+        table[i] = crc
+    return table
+
+
+_TABLE = _crc_table()
+
+
+def crc16(data, crc=0xFFFF):
+    """CRC-16/CCITT-FALSE of `data`."""
+    table = _TABLE
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ table[(crc >> 8) ^ byte]
+    return crc
+
+
+def cobs_encode(data):
+    """COBS-encode `data`; the result contains no zero byte."""
+    out = bytearray(len(data) + len(data) // 254 + 1)
+    code_at = 0
+    code = 1
+    o = 1
+    for byte in data:
+        if byte:
+            out[o] = byte
+            o += 1
+            code += 1
+            if code == 0xFF:
+                out[code_at] = code
+                code_at = o
+                o += 1
+                code = 1
+        else:
+            out[code_at] = code
+            code_at = o
+            o += 1
+            code = 1
+    out[code_at] = code
+    return out[:o]
+
+
+def cobs_decode(data):
+    """Decode a COBS-encoded block (without the zero byte). Raises ValueError if it is malformed."""
+    out = bytearray()
+    i = 0
+    n = len(data)
+    while i < n:
+        code = data[i]
+        end = i + code
+        if code == 0 or end > n:
+            raise ValueError("Bad COBS block")
+        out += data[i + 1:end]
+        i = end
+        if code < 0xFF and i < n:
+            out.append(0)
+    return out
+
+
+def encode(command, payload=b""):
+    """Return the frame for a command (4 characters) and payload (str or bytes), zero byte included."""
+    if isinstance(payload, str):
+        payload = payload.encode()
+    if len(command) != 4:
+        raise ValueError("Command must be 4 characters long.")
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError("Payload too long")
+    body = bytearray(command.encode())
+    body += payload
+    crc = crc16(body)
+    body.append(crc >> 8)
+    body.append(crc & 0xFF)
+    frame = cobs_encode(body)
+    frame.append(0)
+    return frame
+
+
+def decode(frame):
+    """
+    Decode a frame without its zero byte.
+
+    Returns:
+        tuple: Command string and payload bytes.
+
+    Raises:
+        ValueError: If the frame is malformed or the CRC does not match.
+    """
+    body = cobs_decode(frame)
+    if len(body) < 6:
+        raise ValueError("Frame too short")
+    if crc16(memoryview(body)[:len(body) - 2]) != (body[-2] << 8 | body[-1]):
+        raise ValueError("CRC does not match")
+    return bytes(body[:4]).decode(), bytes(body[4:-2])
@@ -0,0 +1,95 @@
+import random
+import time
+import variabels
+import stats
+import rtt
+import fragment
+
+
+class BulkSender:
+    """
+    Sends a message that was reassembled from the PC to one lamp as FRAG frames.
+
+    All frames of a transfer carry the same sequence number, so the lamp's
+    FACK answers and its final answer belong to the command in flight. FACK
+    payloads arrive through variabels.BULK_ACK (command_handler). The wait
+    for an acknowledgement is the lamp's retransmission timeout from rtt.py.
+    After the last fragment was acknowledged the last fragment is repeated
+    on every timeout until the lamp's final answer arrives, because the lamp
+    repeats that answer for fragments of a completed transfer.
+    When the fragment layer gives up, variabels.RETRY_EXHAUSTED is set.
+    """
+
+    def __init__(self, espcom, com_handler, master_stats):
+        self.com = espcom
+        self.handler = com_handler
+        self.stats = master_stats
+        # Random start so a lamp doesn't take a new transfer for one it completed before a reboot
+        self.tid = random.getrandbits(8)
+        self.sender = None
+        self.mac = ""
+        self.lamp = None
+        self.seq = 0
+        self.due = 0
+
+    def start(self, mac, lamp, data):
+        """
+        Starts sending a message to a lamp.
+
+        Args:
+            mac (str): MAC address of the lamp.
+            lamp (int): Index of the lamp in variabels.mac_list.
+            data (memoryview): Message, starting with the lamp command.
+        """
+        self.tid = (self.tid + 1) & 0xFF
+        self.sender = fragment.Sender(self.tid, data)
+        self.mac = mac
+        self.lamp = lamp
+        self.seq = self.handler.next_seq()
+        variabels.BULK_ACK = ""
+        variabels.COMMAND_ACK = 0
+        variabels.RETRY_EXHAUSTED = 0
+        self.__send(self.sender.pending())
+
+    def __send(self, payloads):
+        for payload in payloads:
+            self.com.send_message(self.handler.encode_message(self.mac, "FRAG", payload, self.seq))
+            self.stats.count(stats.RADIO_OUT)
+        timeout = rtt.rto("FRAG", self.lamp)
+        self.due = time.ticks_add(time.ticks_ms(), timeout + random.randint(0, timeout // 2))
+
+    def poll(self):
+        """Handles acknowledgements and timeouts of the transfer. Called periodically."""
+        sender = self.sender
+        if sender is None:
+            return
+        if variabels.BULK_SEND == 0:
+            # Answered or given up by pcCOM
+            self.sender = None
+            return
+        if variabels.BULK_ACK:
+            ack = variabels.BULK_ACK
+            variabels.BULK_ACK = ""
+            try:
+                sender.on_ack(ack)
+            except ValueError:
+                pass
+            retransmissions = sender.retransmissions
+            self.__send(sender.pending())
+            self.stats.retransmits += sender.retransmissions - retransmissions
+            return
+        if time.ticks_diff(time.ticks_ms(), self.due) < 0:
+            return
+        if not sender.timeout():
+            self.sender = None
+            variabels.RETRY_EXHAUSTED = 1
+            self.stats.retries_exhausted += 1
+            return
+        if sender.done():
+            # Waiting for the lamp's answer to the complete message
+            self.stats.retransmits += 1
+            self.__send([sender.fragment(sender.count - 1)])
+            return
+        retransmissions = sender.retransmissions
+        self.__send(sender.pending())
+        self.stats.retransmits += sender.retransmissions - retransmissions
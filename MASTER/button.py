@@ -1,13 +1,29 @@
 from machine import Pin
+from array import array
+import time
+
+DEBOUNCE_MS = 20      # A level must be stable this long after the last edge to count
+LONG_PRESS_MS = 800   # Held this long, a press is also reported as a long press
+RING_SIZE = 16        # Events buffered until the next call of handle_pc_logic
+
+# Event kinds as sent to the PC
+PRESS = "P"
+RELEASE = "R"
+LONG_PRESS = "L"
 
 class ButtonHandler:
     """
     A class to handle multiple button inputs using GPIO pins configured with pull-down resistors.
 
+    Edges are captured by pin interrupts, debounced in poll() and buffered as
+    press/release/long-press events in a preallocated ring until they are sent.
+
     Attributes:
     ----------
     buttons : list
         A list of Pin objects corresponding to the GPIO pins connected to the buttons.
+    dropped : int
+        Number of events lost because the ring was full.
     """
     
     def __init__(self, pin_numbers):
@@ -21,10 +37,96 @@ class ButtonHandler:
         """
         # Initialize the list to hold the Pin objects
         self.buttons = []
+        count = len(pin_numbers)
+        # Per button: edge seen but not debounced yet, time of the first and the last edge
+        self.__dirty = bytearray(count)
+        self.__first_edge = array('L', [0] * count)
+        self.__last_edge = array('L', [0] * count)
+        # Per button: debounced level, time it was pressed, long press reported
+        self.__pressed = bytearray(count)
+        self.__press_time = array('L', [0] * count)
+        self.__long_sent = bytearray(count)
+        # Ring of events: button, kind, time (ticks_ms), held time for releases and long presses
+        self.__ring_button = bytearray(RING_SIZE)
+        self.__ring_kind = bytearray(RING_SIZE)
+        self.__ring_time = array('L', [0] * RING_SIZE)
+        self.__ring_held = array('L', [0] * RING_SIZE)
+        self.__head = 0
+        self.__count = 0
+        self.dropped = 0
         # Configure each pin as input with a pull-down resistor
         for pin_number in pin_numbers:
             pin = Pin(pin_number, Pin.IN, Pin.PULL_DOWN)
             self.buttons.append(pin)
+            self.__pressed[len(self.buttons) - 1] = pin.value()
+            pin.irq(handler=self.__edge, trigger=Pin.IRQ_RISING | Pin.IRQ_FALLING)
+    
+    def __edge(self, pin):
+        """Pin interrupt: only records when the button bounced, without allocating."""
+        now = time.ticks_ms()
+        for i in range(len(self.buttons)):
+            if self.buttons[i] is pin:
+                if not self.__dirty[i]:
+                    self.__first_edge[i] = now
+                    self.__dirty[i] = 1
+                self.__last_edge[i] = now
+                return
+    
+    def __push(self, button, kind, when, held):
+        if self.__count == RING_SIZE:
+            self.dropped += 1
+            return
+        slot = (self.__head + self.__count) % RING_SIZE
+        self.__ring_button[slot] = button
+        self.__ring_kind[slot] = ord(kind)
+        self.__ring_time[slot] = when
+        self.__ring_held[slot] = held
+        self.__count += 1
+    
+    def poll(self):
+        """
+        Turns the edges of buttons that have settled into press/release events
+        and reports buttons held longer than LONG_PRESS_MS. Called every tick.
+        """
+        now = time.ticks_ms()
+        for i in range(len(self.buttons)):
+            if self.__dirty[i] and time.ticks_diff(now, self.__last_edge[i]) >= DEBOUNCE_MS:
+                self.__dirty[i] = 0
+                level = self.buttons[i].value()
+                if level and not self.__pressed[i]:
+                    self.__pressed[i] = 1
+                    self.__long_sent[i] = 0
+                    self.__press_time[i] = self.__first_edge[i]
+                    self.__push(i, PRESS, self.__first_edge[i], 0)
+                elif not level and self.__pressed[i]:
+                    self.__pressed[i] = 0
+                    held = time.ticks_diff(self.__first_edge[i], self.__press_time[i])
+                    self.__push(i, RELEASE, self.__first_edge[i], held)
+            if self.__pressed[i] and not self.__long_sent[i]:
+                held = time.ticks_diff(now, self.__press_time[i])
+                if held >= LONG_PRESS_MS:
+                    self.__long_sent[i] = 1
+                    self.__push(i, LONG_PRESS, now, held)
+    
+    def pending(self):
+        """Returns the number of buffered events."""
+        return self.__count
+    
+    def next_event(self):
+        """
+        Removes the oldest event from the ring.
+
+        Returns:
+        -------
+        str
+            "button$kind$age_ms$held_ms": button index, P/R/L, ms since the
+            event happened and how long the button was held (0 for a press).
+        """
+        slot = self.__head
+        self.__head = (slot + 1) % RING_SIZE
+        self.__count -= 1
+        age = time.ticks_diff(time.ticks_ms(), self.__ring_time[slot])
+        return f"{self.__ring_button[slot]}${chr(self.__ring_kind[slot])}${age}${self.__ring_held[slot]}"
     
     def check_button_states(self):
         """
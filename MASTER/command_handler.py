@@ -1,10 +1,18 @@
 import random
 import time
 import variabels
+import timestamps
+import liveness
 
 class CMDHandler:
-    def __init__(self, espcom):
+    def __init__(self, espcom, master_stats):
         self.com = espcom
+        self.stats = master_stats
+        # Sequence number of the command in flight, lamps echo it in their answers.
+        # Random start so lamps don't take the first commands after a reboot for retries.
+        self.seq = random.getrandbits(8)
+        # Sequence number of the last event frame per lamp address, lamps send every event twice
+        self.event_seq = {}
     
     def xor_checksum(self,data):
         checksum = 0
@@ -17,35 +25,41 @@ class CMDHandler:
             return s
         return s + (fillchar * (width - len(s)))
 
+    def next_seq(self):
+        """Starts a new command and returns its sequence number (retransmissions keep the number)."""
+        self.seq = (self.seq + 1) & 0xFF
+        return self.seq
+
     def decode_message(self,message):
         if message[0] != '#' or message[-1] != '#':
             raise ValueError("Message should start and end with '#'")
 
         source = message[1:18]
         command = message[18:22]
-        payload = message[22:54].rstrip('@')
-        received_checksum = int(message[54:56], 16)
+        seq = int(message[22:24], 16)
+        payload = message[24:56].rstrip('@')
+        received_checksum = int(message[56:58], 16)
         
-        data_to_check = message[1:54]
+        data_to_check = message[1:56]
         calculated_checksum = self.xor_checksum(data_to_check.encode('utf-8'))
         
         if received_checksum != calculated_checksum:
             raise ValueError("Checksum does not match")
 
-        return source, command, payload
+        return source, command, seq, payload
 
-    def encode_message(self,source, command, payload):
+    def encode_message(self,source, command, payload, seq):
         if len(source) != 17 or len(command) != 4:
             raise ValueError("Source must be 17 characters and command must be 4 characters")
         if len(payload) > 32:
             raise ValueError("Payload must not exceed 32 characters")
 
         padded_payload = self.custom_ljust(payload, 32, '@')
-        data_to_check = source + command + padded_payload
+        data_to_check = f"{source}{command}{seq:02x}{padded_payload}"
         checksum = self.xor_checksum(data_to_check.encode('utf-8'))
         
         checksum_hex = '{:02x}'.format(checksum)
-        message = f"*{source}{command}{padded_payload}{checksum_hex}*"
+        message = f"*{data_to_check}{checksum_hex}*"
         
         return message
     
@@ -76,25 +90,59 @@ class CMDHandler:
         hex_string = "0x" + "".join(f"{value:02X}" for value in values)
         return hex_string
     
-    def handle_command(self, source, command, payload):
+    def handle_command(self, source, command, payload, seq):
+        if command:
+            # Any frame shows the lamp is up; search answers carry the lamp's address in the payload
+            liveness.seen(payload if command == "RESP" else source)
+            if command == "ALRM":
+                # An alarm rule of the lamp fired or cleared; the lamp numbers its events itself
+                if self.event_seq.get(source) != seq and source in variabels.mac_list:
+                    self.event_seq[source] = seq
+                    variabels.ALRM_EVENTS.append("%d$%s" % (variabels.mac_list.index(source), payload))
+                return
+            if liveness.answer(seq):
+                # Answer to a background heartbeat, no command waits for it
+                return
+        if command and seq != self.seq:
+            # Late answer to an earlier command (e.g. to a retransmission)
+            self.stats.stale_replies += 1
+            return
         if command:
+            if command in ("RESP", "HRBT", "OKAY", "NACK", "BUSY", "SENS") or command == variabels.FWD_COMMAND:
+                timestamps.mark_once(timestamps.ACK)
+                # The lamp got the frame, stop retransmitting (search answers come from many lamps)
+                if command != "RESP":
+                    variabels.RETRY_ACTIVE = 0
+            if command == variabels.FWD_COMMAND and variabels.FWD_SEND == 1:
+                variabels.FWD_REPLY = payload
+                variabels.COMMAND_ACK = 1
             if command == "RESP":
                 print("RESPOSNE FROM SEARCH")
                 print(payload)
                 if payload not in variabels.mac_list:
                     variabels.mac_list.append(payload)
+                    # seen() above skipped the address, it wasn't in the list yet
+                    liveness.seen(payload)
             if command == "HRBT":
                 print ("HEARTBEAT RECIVIED")
                 variabels.COMMAND_ACK = 1
             if command == "OKAY":
                 print ("COMMAND ACK")
+                variabels.BULK_REPLY = payload
                 variabels.COMMAND_ACK = 1
             if command == "NACK":
                 print ("COMMAND NACK")
                 variabels.COMMAND_ACK = 0
+                self.stats.lamp_nack()
+                if variabels.BULK_SEND == 1:
+                    # The lamp rejected the whole message, there is nothing left to retry
+                    variabels.RETRY_EXHAUSTED = 1
             if command == "BUSY":
                 print ("LAMP BUSY")
                 variabels.EXTEND_TIMER = 1
+            if command == "FACK" and variabels.BULK_SEND == 1:
+                # Progress of a bulk transfer, bulk.py sends the next fragments
+                variabels.BULK_ACK = payload
             if command == "SENS":
                 print("SENS COMMAND")
                 try:
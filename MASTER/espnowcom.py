@@ -2,12 +2,16 @@ import time
 import network
 import espnow
 import ubinascii
+import mirror
+
+CHANNEL_PATH = "channel.txt"  # Radio channel set by CHAN, kept over a reboot
+CHANNELS = range(1, 14)
 
 class ESP_COM:
     
     __bcast_mac = b'\xff\xff\xff\xff\xff\xff'
     
-    def __init__(self):
+    def __init__(self, channel_path=CHANNEL_PATH):
         # Initialize WLAN module
         self.wireless = network.WLAN(network.STA_IF)
         self.wireless.active(True)
@@ -17,6 +21,28 @@ class ESP_COM:
         self.e.active(True)
         self.e.config(timeout_ms=10)
         self.add_bcast()
+        self.channel_path = channel_path
+        try:
+            with open(channel_path) as f:
+                self.set_channel(int(f.read()), save=False)
+        except (OSError, ValueError):
+            pass
+    
+    def channel(self):
+        return self.wireless.config('channel')
+
+    def set_channel(self, channel, save=True):
+        """
+        Moves the master to another radio channel, so several masters in one
+        building don't share the air time. Only lamps on the same channel
+        (CONF chan) hear it.
+        """
+        if channel not in CHANNELS:
+            raise ValueError("Bad channel")
+        self.wireless.config(channel=channel)
+        if save and self.channel_path is not None:
+            with open(self.channel_path, 'w') as f:
+                f.write(str(channel))
     
     def get_mac(self):
         mac = ubinascii.hexlify(self.wireless.config('mac'), ':').decode('utf-8')
@@ -29,6 +55,7 @@ class ESP_COM:
         mac,message = self.e.recv()
         if message:
             output = message.decode('utf-8')
+            mirror.add(mirror.RX, output)
         else:
             output = ""
         return output
@@ -37,6 +64,7 @@ class ESP_COM:
         return self.e.any()
     
     def send_message(self,payload):
+        mirror.add(mirror.TX, payload)
         try:
             self.e.send(self.__bcast_mac, payload)
             return True
@@ -0,0 +1,144 @@
+import random
+import time
+from array import array
+import variabels
+import rtt
+
+QUIET_MS = 10000        # A lamp not heard from for this long gets a heartbeat
+JITTER_MS = 2500        # Random extra wait, so lamps found at the same time are not all due together
+PROBE_TIMEOUT_MS = 300  # Wait for the answer to a heartbeat
+RETRY_MS = 1000         # Next heartbeat after one that wasn't answered
+MISSES = 3              # Unanswered heartbeats in a row before a lamp is reported offline
+OFFLINE_MS = 30000      # Heartbeat period of a lamp that is offline
+MIN_GAP_MS = 100        # Shortest time between two heartbeats of the master
+
+# Per lamp (index in variabels.mac_list). Any frame of a lamp counts, so a lamp
+# that answers commands or sends events is never sent a heartbeat.
+_macs = [None] * rtt.MAX_LAMPS             # address the entries below belong to
+_last_seen = array('L', [0] * rtt.MAX_LAMPS)
+_due = array('L', [0] * rtt.MAX_LAMPS)     # time of the next heartbeat
+_missed = bytearray(rtt.MAX_LAMPS)
+_online = bytearray(rtt.MAX_LAMPS)
+
+# Heartbeat in flight
+_probe_lamp = -1
+_probe_seq = -1
+_probe_deadline = 0
+_last_probe = 0
+
+# Online/offline changes not yet sent to the PC, as LIVE payloads
+_events = []
+
+heartbeats = 0
+
+
+def _event(lamp):
+    _events.append("%d$%d$%s" % (lamp, _online[lamp], _macs[lamp]))
+
+
+def seen(mac):
+    """A valid frame of the lamp with this address was received."""
+    try:
+        lamp = variabels.mac_list.index(mac)
+    except ValueError:
+        return
+    if lamp >= rtt.MAX_LAMPS:
+        return
+    if _macs[lamp] != mac:
+        # A new search put another lamp at this index
+        _macs[lamp] = mac
+        _online[lamp] = 0
+    now = time.ticks_ms()
+    _last_seen[lamp] = now
+    _due[lamp] = time.ticks_add(now, QUIET_MS + random.randint(0, JITTER_MS))
+    _missed[lamp] = 0
+    if not _online[lamp]:
+        _online[lamp] = 1
+        _event(lamp)
+
+
+def _idle():
+    """True if no command is in flight, heartbeats never delay one."""
+    v = variabels
+    return (v.RETRY_ACTIVE == 0 and v.SEARCH_SEND == 0 and v.HRBT_SEND == 0 and v.COLR_SEND == 0 and
+            v.SENS_SEND == 0 and v.TONE_SEND == 0 and v.FWD_SEND == 0 and v.BULK_SEND == 0 and v.SCNR_SEND == 0)
+
+
+def _missed_probe(lamp, now):
+    if _missed[lamp] < 255:
+        _missed[lamp] += 1
+    if _missed[lamp] >= MISSES:
+        if _online[lamp]:
+            _online[lamp] = 0
+            _event(lamp)
+        _due[lamp] = time.ticks_add(now, OFFLINE_MS)
+    else:
+        _due[lamp] = time.ticks_add(now, RETRY_MS)
+
+
+def due_probe():
+    """
+    Returns the index of the lamp to send a heartbeat to now, None if none is due.
+    Only one heartbeat is in flight at a time and only while the master is idle.
+    """
+    global _probe_lamp, _probe_seq
+    now = time.ticks_ms()
+    if _probe_lamp >= 0:
+        if time.ticks_diff(now, _probe_deadline) < 0:
+            return None
+        _missed_probe(_probe_lamp, now)
+        _probe_lamp = -1
+        _probe_seq = -1
+    if time.ticks_diff(now, _last_probe) < MIN_GAP_MS or not _idle():
+        return None
+    best = None
+    best_late = -1
+    for lamp in range(min(len(variabels.mac_list), rtt.MAX_LAMPS)):
+        if _macs[lamp] != variabels.mac_list[lamp]:
+            continue
+        late = time.ticks_diff(now, _due[lamp])
+        if late > best_late:
+            best = lamp
+            best_late = late
+    return best
+
+
+def probe_sent(lamp, seq):
+    """A heartbeat with sequence number seq was sent to the lamp."""
+    global _probe_lamp, _probe_seq, _probe_deadline, _last_probe, heartbeats
+    now = time.ticks_ms()
+    _probe_lamp = lamp
+    _probe_seq = seq
+    _probe_deadline = time.ticks_add(now, PROBE_TIMEOUT_MS)
+    _last_probe = now
+    heartbeats += 1
+
+
+def answer(seq):
+    """True if a lamp frame with this sequence number answers the heartbeat in flight (seen() was called for it)."""
+    global _probe_lamp, _probe_seq
+    if _probe_seq < 0 or seq != _probe_seq:
+        return False
+    _probe_lamp = -1
+    _probe_seq = -1
+    return True
+
+
+def take_events():
+    """Returns and forgets the LIVE payloads "index$online$mac" of the changes since the last call."""
+    global _events
+    events = _events
+    _events = []
+    return events
+
+
+def records():
+    """Returns "index$online$age_s" per lamp of the last search, age -1 if it was never heard."""
+    now = time.ticks_ms()
+    result = []
+    for lamp in range(min(len(variabels.mac_list), rtt.MAX_LAMPS)):
+        if _macs[lamp] != variabels.mac_list[lamp]:
+            result.append("%d$0$-1" % lamp)
+        else:
+            result.append("%d$%d$%d" % (lamp, _online[lamp], time.ticks_diff(now, _last_seen[lamp]) // 1000))
+    return result
@@ -1,14 +1,28 @@
 import time
+import random
 from machine import UART, Timer
 import espnowcom
 import command_handler
 import pcCOM
 import variabels
+import stats
+import retransmit
+import rtt
+import bulk
+import timestamps
+import liveness
+import actions
 
 buttons = [4,5,6,7]
+master_stats = stats.MasterStats()
 com = espnowcom.ESP_COM()
-com_handler = command_handler.CMDHandler(com)
-pc_handler = pcCOM.UARTtoPC(1,115200,43,44,buttons)
+com_handler = command_handler.CMDHandler(com, master_stats)
+retransmitter = retransmit.Retransmitter(com, master_stats)
+bulk_sender = bulk.BulkSender(com, com_handler, master_stats)
+button_actions = actions.ActionTable()
+# Random start so lamps don't take the first action after a reboot for a copy of one sent before it
+variabels.ACTION_SEQ = random.getrandbits(8)
+pc_handler = pcCOM.UARTtoPC(1,115200,43,44,buttons,master_stats,button_actions,com)
 espcom_timer = Timer(0)
 send_timer = Timer(1)
 button_timer = Timer(2)
@@ -20,11 +34,17 @@ button_timer = Timer(2)
 def communicate_with_esp_pc(t):
     if com.check_received():
         received_message = com.received_message()
-        source, command, payload = com_handler.decode_message(received_message)
-        com_handler.handle_command(source, command, payload)
+        master_stats.count(stats.RADIO_IN)
+        try:
+            source, command, seq, payload = com_handler.decode_message(received_message)
+            com_handler.handle_command(source, command, payload, seq)
+        except ValueError:
+            master_stats.count(stats.RADIO_ERR)
     
-    # Check for incoming data
-    if pc_handler.data_available():
+    # Check for incoming data, several frames per tick so bulk transfers aren't limited to one frame per 10 ms
+    frames = 0
+    while pc_handler.data_available() and frames < 8:
+        frames += 1
         try:
             command, payload = pc_handler.receive_command()
             pc_handler.handle_pc_command(command,payload)
@@ -35,45 +55,95 @@ def communicate_with_esp_pc(t):
     pc_handler.handle_pc_logic()
         
 def send_commands(t):
+    retransmitter.poll()
+    bulk_sender.poll()
+    
+    if variabels.ACTION_SEND > 0:
+        # Button action: a scene recall broadcast like SCNR, but not held up by the command in flight.
+        # Its own sequence numbers keep the lamps from taking a toggle back for a repeat of the last one
+        if variabels.ACTION_FRAME == "":
+            variabels.ACTION_FRAME = com_handler.encode_message("ff:ff:ff:ff:ff:ff", "SCNR", variabels.ACTION_PAYLOAD,
+                                                                variabels.ACTION_SEQ)
+        com.send_message(variabels.ACTION_FRAME)
+        master_stats.count(stats.RADIO_OUT)
+        variabels.ACTION_SEND -= 1
+    
     if variabels.SEARCH_SEND == 1 and variabels.SEND_ONCE == 0:
         variabels.SEND_ONCE = 1
         mac = com.get_mac()
         command = "SRCH"
         payload = ""
-        buffer = com_handler.encode_message(mac,command,payload)
-        com.send_message(buffer)
+        buffer = com_handler.encode_message(mac,command,payload,com_handler.next_seq())
+        retransmitter.send(command, buffer, None)
         
     if variabels.HRBT_SEND == 1 and variabels.SEND_ONCE == 0:
         variabels.SEND_ONCE = 1
         mac = variabels.mac_list[int(variabels.NEEDED_MAC_INDEX)]
         command = "HRBT"
         payload = ""
-        buffer = com_handler.encode_message(mac,command,payload)
-        com.send_message(buffer)
+        buffer = com_handler.encode_message(mac,command,payload,com_handler.next_seq())
+        retransmitter.send(command, buffer, rtt.lamp_index(variabels.NEEDED_MAC_INDEX))
         
     if variabels.COLR_SEND == 1 and variabels.SEND_ONCE == 0:
         variabels.SEND_ONCE = 1
         mac = variabels.mac_list[int(variabels.NEEDED_MAC_INDEX)]
         command = "COLR"
         payload = com_handler.encode_to_hex_string(variabels.COLOR_PAYLOAD)
-        buffer = com_handler.encode_message(mac,command,payload)
-        com.send_message(buffer)
+        buffer = com_handler.encode_message(mac,command,payload,com_handler.next_seq())
+        retransmitter.send(command, buffer, rtt.lamp_index(variabels.NEEDED_MAC_INDEX))
         
     if variabels.SENS_SEND == 1 and variabels.SEND_ONCE == 0:
         variabels.SEND_ONCE = 1
         mac = variabels.mac_list[int(variabels.NEEDED_MAC_INDEX)]
         command = "SENS"
         payload = ""
-        buffer = com_handler.encode_message(mac,command,payload)
-        com.send_message(buffer)
+        buffer = com_handler.encode_message(mac,command,payload,com_handler.next_seq())
+        retransmitter.send(command, buffer, rtt.lamp_index(variabels.NEEDED_MAC_INDEX))
         
     if variabels.TONE_SEND == 1 and variabels.SEND_ONCE == 0:
         variabels.SEND_ONCE = 1
         mac = variabels.mac_list[int(variabels.NEEDED_MAC_INDEX)]
         command = "TONE"
         payload = variabels.TONE_PAYLOAD
-        buffer = com_handler.encode_message(mac,command,payload)
+        buffer = com_handler.encode_message(mac,command,payload,com_handler.next_seq())
+        retransmitter.send(command, buffer, rtt.lamp_index(variabels.NEEDED_MAC_INDEX))
+        
+    if variabels.FWD_SEND == 1 and variabels.SEND_ONCE == 0:
+        variabels.SEND_ONCE = 1
+        mac = variabels.mac_list[int(variabels.NEEDED_MAC_INDEX)]
+        command = variabels.FWD_COMMAND
+        payload = variabels.FWD_PAYLOAD
+        buffer = com_handler.encode_message(mac,command,payload,com_handler.next_seq())
+        retransmitter.send(command, buffer, rtt.lamp_index(variabels.NEEDED_MAC_INDEX))
+        
+    if variabels.SCNR_SEND > 0:
+        # Broadcast, no lamp answers it: one copy per tick instead of retransmissions
+        if variabels.SEND_ONCE == 0:
+            variabels.SEND_ONCE = 1
+            variabels.SCNR_FRAME = com_handler.encode_message("ff:ff:ff:ff:ff:ff", "SCNR", variabels.SCNR_PAYLOAD,
+                                                              com_handler.next_seq())
+            timestamps.mark(timestamps.TX)
+        com.send_message(variabels.SCNR_FRAME)
+        master_stats.count(stats.RADIO_OUT)
+        variabels.SCNR_SEND -= 1
+        if variabels.SCNR_SEND == 0:
+            variabels.SCNR_DONE = 1
+        
+    if variabels.BULK_SEND == 1 and variabels.SEND_ONCE == 0:
+        variabels.SEND_ONCE = 1
+        mac = variabels.mac_list[int(variabels.NEEDED_MAC_INDEX)]
+        bulk_sender.start(mac, rtt.lamp_index(variabels.NEEDED_MAC_INDEX), variabels.BULK_DATA)
+        
+    # Heartbeat to a lamp that has gone quiet, only while no command is in flight. Its sequence
+    # number differs from the one of the last command, so a late answer never completes a command.
+    lamp = liveness.due_probe()
+    if lamp is not None:
+        seq = com_handler.seq ^ 0x80
+        buffer = com_handler.encode_message(variabels.mac_list[lamp], "HRBT", "", seq)
         com.send_message(buffer)
+        master_stats.count(stats.RADIO_OUT)
+        liveness.probe_sent(lamp, seq)
 
-espcom_timer.init(period=100, callback=communicate_with_esp_pc)
-send_timer.init(period=100, callback=send_commands)
+# Short periods so that answers are seen and lost frames are retransmitted within tens of ms
+espcom_timer.init(period=10, callback=communicate_with_esp_pc)
+send_timer.init(period=10, callback=send_commands)
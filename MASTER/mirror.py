@@ -0,0 +1,49 @@
+import time
+
+MAX_FRAMES = 32  # Frames kept until handle_pc_logic sends them, more are dropped
+
+# Commands the frames are sent to the PC with
+TX = "RFTX"
+RX = "RFRX"
+
+active = 0
+dropped = 0
+_frames = []
+
+
+def start():
+    """Start copying every radio frame for the PC (MIRR1, binary link only)."""
+    global active, dropped
+    active = 1
+    dropped = 0
+    _frames.clear()
+
+
+def stop():
+    global active
+    active = 0
+    _frames.clear()
+
+
+def add(command, frame):
+    """Keep a radio frame that was sent (TX) or received (RX) and the time it passed the radio."""
+    global dropped
+    if not active:
+        return
+    if len(_frames) >= MAX_FRAMES:
+        dropped += 1
+        return
+    if not isinstance(frame, str):
+        # Senders reuse their buffers
+        frame = bytes(frame).decode('utf-8')
+    _frames.append((command, time.ticks_us(), frame))
+
+
+def take():
+    """Returns and forgets the kept frames as (command, "age_us$frame") pairs."""
+    now = time.ticks_us()
+    result = []
+    while _frames:
+        command, ticks, frame = _frames.pop(0)
+        result.append((command, f"{time.ticks_diff(now, ticks)}${frame}"))
+    return result
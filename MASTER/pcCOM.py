@@ -2,12 +2,27 @@ from machine import UART, Timer
 import time
 import variabels
 import button
+import timestamps
+import stats
+import rtt
+import retransmit
+import fragment
+import binframe
+import liveness
+import mirror
+
+# Baud rates a PC can ask for with BINM
+BAUD_RATES = (115200, 230400, 460800, 921600, 1500000, 2000000)
+
+# Copies of a scene recall broadcast, lamps don't answer it
+SCENE_REPEATS = 3
 
 class UARTtoPC:
     
     __lockout_command = 0
+    __binary = False
     
-    def __init__(self, uart_num, baudrate, tx_pin, rx_pin, buttons):
+    def __init__(self, uart_num, baudrate, tx_pin, rx_pin, buttons, master_stats, actions=None, radio=None):
         """
         Initializes the UARTtoPC class with UART settings and a timer.
         
@@ -16,10 +31,24 @@ class UARTtoPC:
             baudrate (int): Baudrate for UART communication.
             tx_pin (int): Transmit pin number.
             rx_pin (int): Receive pin number.
+            buttons (list): GPIO pin numbers of the buttons.
+            master_stats (MasterStats): Runtime counters of the master.
+            actions (ActionTable): What the master does itself on button events, None for nothing.
+            radio (ESP_COM): Radio of the master, for CHAN; None if the channel can't be changed.
         """
-        self.uart = UART(uart_num, baudrate=baudrate, tx=tx_pin, rx=rx_pin)
+        # Room for the fragments of a bulk transfer in flight (HOST/bulk.py)
+        self.uart = UART(uart_num, baudrate=baudrate, tx=tx_pin, rx=rx_pin, rxbuf=1024)
+        self.baudrate = baudrate
+        self.ascii_baudrate = baudrate
+        # Bytes of binary frames received but not handled yet
+        self.__rx = b""
         self.command_timer = Timer(3)
         self.button_handler = button.ButtonHandler(buttons)
+        self.actions = actions
+        self.radio = radio
+        self.stats = master_stats
+        # Messages from the PC larger than one frame (FRAG), relayed to a lamp by bulk.py
+        self.bulk_in = fragment.Reassembler()
     
     def calculate_checksum(self, command):
         """
@@ -66,22 +95,52 @@ class UARTtoPC:
         """
         if len(command) != 4:
             raise ValueError("Command must be 4 characters long.")
+        if self.__binary:
+            self.uart.write(binframe.encode(command, payload))
+            self.stats.count(stats.UART_OUT)
+            return
         padded_payload = self.pad_payload(payload)
         message = f"*{command}{padded_payload}"
         checksum = self.calculate_checksum(command + padded_payload)
         message_with_checksum = f"{message}{checksum}*"
         self.uart.write(message_with_checksum)
+        self.stats.count(stats.UART_OUT)
+    
+    def send_records(self, command, records):
+        """
+        Sends a list of records as replies with the same command. In ASCII mode
+        every record is a frame of its own; in binary mode as many records as
+        fit go in one frame, separated by newlines.
+        
+        Args:
+            command (str): Command string (4 characters).
+            records (list): Record strings (up to 32 characters each).
+        """
+        if not self.__binary:
+            for record in records:
+                self.send_command(command, record)
+            return
+        packed = ""
+        for record in records:
+            if packed and len(packed) + 1 + len(record) > binframe.MAX_PAYLOAD:
+                self.send_command(command, packed)
+                packed = ""
+            packed = packed + "\n" + record if packed else record
+        if packed:
+            self.send_command(command, packed)
     
     def receive_command(self):
         """
         Receives and validates a command from UART.
         
         Returns:
-            tuple: Command string and payload string.
+            tuple: Command string and payload string, (None, None) if no complete frame is waiting.
         
         Raises:
             ValueError: If the message format is invalid or checksum does not match.
         """
+        if self.__binary:
+            return self.__receive_binary()
         if self.uart.any():
             message = self.uart.read(41).decode('utf-8')
             if message[0] == '#' and message[-1] == '#':
@@ -90,13 +149,67 @@ class UARTtoPC:
                 received_checksum = message[37:40]
                 calculated_checksum = self.calculate_checksum(command + payload)
                 if received_checksum == calculated_checksum:
+                    self.stats.count(stats.UART_IN)
                     return command, payload.rstrip('@')
                 else:
+                    self.stats.count(stats.UART_ERR)
                     raise ValueError("Checksum does not match.")
             else:
+                self.stats.count(stats.UART_ERR)
                 raise ValueError("Invalid message format.")
         return None, None
     
+    def __receive_binary(self):
+        """
+        Receives one binary frame (binframe), the bytes after it stay buffered
+        for the next call.
+        
+        Returns:
+            tuple: Command string and payload string, (None, None) if no complete frame is waiting.
+        
+        Raises:
+            ValueError: If the frame is malformed or its CRC does not match.
+        """
+        if self.uart.any():
+            self.__rx += self.uart.read()
+        end = self.__rx.find(b"\x00")
+        if end < 0:
+            if len(self.__rx) > binframe.MAX_FRAME:
+                # No delimiter where one must have been, drop the bytes and wait for the next one
+                self.__rx = b""
+                self.stats.count(stats.UART_ERR)
+                raise ValueError("Frame too long.")
+            return None, None
+        frame = self.__rx[:end]
+        self.__rx = self.__rx[end + 1:]
+        if not frame:
+            # A zero byte on its own, sent by the PC to end any partial frame
+            return None, None
+        try:
+            command, payload = binframe.decode(frame)
+            payload = payload.decode()
+        except ValueError:
+            self.stats.count(stats.UART_ERR)
+            raise
+        self.stats.count(stats.UART_IN)
+        return command, payload
+    
+    def __set_mode(self, binary, baudrate):
+        """
+        Switches between ASCII and binary frames and sets the baud rate once
+        the reply in the old format has been sent.
+        
+        Args:
+            binary (bool): True for binary frames.
+            baudrate (int): New baud rate.
+        """
+        self.uart.flush()
+        if baudrate != self.baudrate:
+            self.uart.init(baudrate=baudrate)
+            self.baudrate = baudrate
+        self.__binary = binary
+        self.__rx = b""
+    
     def data_available(self):
         """
         Checks if data is available to read from UART.
@@ -104,6 +217,8 @@ class UARTtoPC:
         Returns:
             bool: True if data is available, False otherwise.
         """
+        if self.__binary and self.__rx.find(b"\x00") >= 0:
+            return True
         return self.uart.any()
     
     def decode_string_led(self, input_string):
@@ -184,15 +299,20 @@ class UARTtoPC:
             variabels.SEARCH_SEND = 0
             if not variabels.mac_list == []:
                 print(variabels.mac_list)
-                counter = 0
-                for i in variabels.mac_list:
-                    command = "MAC" + str(counter)
-                    payload = i
-                    self.send_command(command, payload)
-                    counter = counter + 1
+                if self.__binary:
+                    # All addresses in index order, several per frame
+                    self.send_records("MACS", variabels.mac_list)
+                else:
+                    counter = 0
+                    for i in variabels.mac_list:
+                        command = "MAC" + str(counter)
+                        payload = i
+                        self.send_command(command, payload)
+                        counter = counter + 1
                 command = "OKAY"
                 payload = ""
                 self.send_command(command, payload) 
+                self.stats.finish(stats.OK)
             else:
                 command = "MACN"
                 payload = ""
@@ -221,10 +341,58 @@ class UARTtoPC:
             payload = ""
             self.send_command(command, payload)
             print("TONE WAS NOT ACK")
+        if variabels.FWD_SEND == 1:
+            variabels.FWD_SEND = 0
+            command = "NACK"
+            payload = ""
+            self.send_command(command, payload)
+            print(variabels.FWD_COMMAND, "WAS NOT ACK")
+        if variabels.BULK_SEND == 1:
+            variabels.BULK_SEND = 0
+            command = "NACK"
+            payload = ""
+            self.send_command(command, payload)
+            print("BULK WAS NOT ACK")
             
+        timestamps.mark(timestamps.REPLY)
+        self.stats.finish(stats.TIMEOUT)
+        variabels.RETRY_ACTIVE = 0
         self.__lockout_command = 0            
         print("TIMER RANOUT LOCKOUT LIFTED")
     
+    def __start_command_timer(self, command, lamp):
+        """
+        Starts the command timer with the deadline of the command for the lamp.
+        
+        Args:
+            command (str): Command sent to the lamp.
+            lamp (str): Lamp index from the payload, None for a search.
+        """
+        period = rtt.deadline(command, rtt.lamp_index(lamp), retransmit.MAX_RETRIES)
+        self.command_timer.init(period=period, mode=Timer.ONE_SHOT, callback=self.__timer_callback)
+    
+    def __start_bulk(self, message):
+        """
+        Starts relaying a message reassembled from FRAG frames.
+        
+        Args:
+            message (memoryview): Lamp index digit, lamp command (4 characters) and its data.
+        """
+        lamp = rtt.lamp_index(chr(message[0])) if len(message) >= 5 else None
+        if lamp is None or lamp >= len(variabels.mac_list):
+            self.send_command("NACK", "")
+            return
+        timestamps.start("BULK")
+        self.stats.begin("BULK")
+        self.__start_command_timer("BULK", lamp)
+        self.__lockout_command = 1
+        variabels.NEEDED_MAC_INDEX = lamp
+        variabels.BULK_DATA = message[1:]
+        # Repeated answers to the previous message must not complete this one
+        variabels.COMMAND_ACK = 0
+        variabels.BULK_SEND = 1
+        variabels.SEND_ONCE = 0
+    
     def handle_pc_command(self, command, payload):
         """
         Handles incoming commands from the PC.
@@ -235,21 +403,29 @@ class UARTtoPC:
         """
         if command and self.__lockout_command == 0:
             if command == "SRCH" and payload == "":
-                self.command_timer.init(period=2500, mode=Timer.ONE_SHOT, callback=self.__timer_callback)
+                timestamps.start(command)
+                self.stats.begin(command)
+                self.__start_command_timer(command, None)
                 variabels.mac_list.clear()
+                # Lamp indexes change with a new search
+                rtt.reset()
                 self.__lockout_command = 1
                 variabels.SEARCH_SEND = 1
                 variabels.SEND_ONCE = 0
                 return
             if command == "HRBT":
-                self.command_timer.init(period=2500, mode=Timer.ONE_SHOT, callback=self.__timer_callback)
+                timestamps.start(command)
+                self.stats.begin(command)
+                self.__start_command_timer(command, payload)
                 self.__lockout_command = 1
                 variabels.NEEDED_MAC_INDEX = payload
                 variabels.HRBT_SEND = 1
                 variabels.SEND_ONCE = 0
                 return
             if command == "COLR":
-                self.command_timer.init(period=2500, mode=Timer.ONE_SHOT, callback=self.__timer_callback)
+                timestamps.start(command)
+                self.stats.begin(command)
+                self.__start_command_timer(command, payload[:1])
                 try:
                     mac_index, led_values = self.decode_string_led(payload)
                     variabels.NEEDED_MAC_INDEX = mac_index
@@ -266,14 +442,18 @@ class UARTtoPC:
                     self.__lockout_command = 0
                 return
             if command == "SENS":
-                self.command_timer.init(period=2500, mode=Timer.ONE_SHOT, callback=self.__timer_callback)
+                timestamps.start(command)
+                self.stats.begin(command)
+                self.__start_command_timer(command, payload)
                 self.__lockout_command = 1
                 variabels.NEEDED_MAC_INDEX = payload
                 variabels.SENS_SEND = 1
                 variabels.SEND_ONCE = 0
                 return
             if command == "TONE":
-                self.command_timer.init(period=2500, mode=Timer.ONE_SHOT, callback=self.__timer_callback)
+                timestamps.start(command)
+                self.stats.begin(command)
+                self.__start_command_timer(command, payload[:1])
                 try:
                     mac_index, tone_to_play = self.decode_tone_string(payload)
                     variabels.NEEDED_MAC_INDEX = mac_index
@@ -288,29 +468,179 @@ class UARTtoPC:
                     variabels.SEND_ONCE = 0
                     self.__lockout_command = 0
                 return
+            if command in variabels.FWD_COMMANDS and len(payload) >= 1:
+                timestamps.start(command)
+                self.stats.begin("FWRD")
+                self.__start_command_timer(command, payload[:1])
+                self.__lockout_command = 1
+                variabels.NEEDED_MAC_INDEX = payload[0]
+                variabels.FWD_COMMAND = command
+                variabels.FWD_PAYLOAD = payload[1:]
+                variabels.FWD_SEND = 1
+                variabels.SEND_ONCE = 0
+                return
+            if command == "SCNR":
+                # Scene "nn" on every lamp, "nngg" only on the lamps in group gg: one broadcast frame
+                try:
+                    int(payload, 16)
+                except ValueError:
+                    payload = ""
+                if len(payload) not in (2, 4):
+                    self.send_command("NACK", "")
+                    return
+                timestamps.start(command)
+                self.stats.begin(command)
+                self.__lockout_command = 1
+                variabels.SCNR_PAYLOAD = payload
+                variabels.SCNR_DONE = 0
+                variabels.SCNR_SEND = SCENE_REPEATS
+                variabels.SEND_ONCE = 0
+                return
+            if command == "FRAG":
+                try:
+                    ack = self.bulk_in.on_fragment(payload)
+                except ValueError:
+                    self.send_command("NACK", "")
+                    return
+                if ack is not None:
+                    self.send_command("FACK", ack)
+                if self.bulk_in.ready:
+                    self.__start_bulk(self.bulk_in.take())
+                return
             if command == "RBUT" and payload == "":
                 self.__lockout_command = 1
                 command = "BUTS"
                 payload = self.button_handler.check_button_states()
                 self.send_command(command,payload)
                 self.__lockout_command = 0
+                return
+            if command == "BTNA" and self.actions is not None:
+                # Button actions: "" lists them, "<button><kind><action>" stores one, "<button><kind>-" deletes it
+                if payload == "":
+                    self.send_records("BTNA", self.actions.records())
+                    self.send_command("OKAY", "")
+                    return
+                try:
+                    self.actions.set(int(payload[0]), payload[1], payload[2:])
+                except (ValueError, IndexError):
+                    self.send_command("NACK", "")
+                    return
+                self.send_command("OKAY", "")
+                return
+            if command == "CHAN" and self.radio is not None:
+                # Radio channel: "" reads it, "1" to "13" changes it (between commands, so nothing is in flight)
+                try:
+                    if payload:
+                        self.radio.set_channel(int(payload))
+                except ValueError:
+                    self.send_command("NACK", "")
+                    return
+                self.send_command("CHAN", str(self.radio.channel()))
+                return
+            if command == "TIME" and payload == "":
+                self.send_command("TIME", timestamps.encode())
+                return
+            if command == "STAT" and (payload == "" or payload == "R"):
+                self.send_records("STAT", self.stats.records() + rtt.records())
+                if payload == "R":
+                    self.stats.reset()
+                self.send_command("OKAY", "")
+                return
+            if command == "LIVE" and payload == "":
+                self.send_records("LIVE", liveness.records())
+                self.send_command("OKAY", "")
+                return
+            if command == "BINM":
+                # Binary frames from now on, at the baud rate in the payload (the current one if empty)
+                try:
+                    baudrate = int(payload) if payload else self.baudrate
+                except ValueError:
+                    baudrate = 0
+                if baudrate not in BAUD_RATES:
+                    self.send_command("NACK", "")
+                    return
+                self.send_command("OKAY", str(baudrate))
+                self.__set_mode(True, baudrate)
+                return
+            if command == "MIRR" and (payload == "0" or payload == "1"):
+                if payload == "1" and not self.__binary:
+                    # Radio frames don't fit into ASCII frames
+                    self.send_command("NACK", "")
+                    return
+                if payload == "1":
+                    mirror.start()
+                else:
+                    mirror.stop()
+                self.send_command("OKAY", "")
+                return
+            if command == "ASCI" and payload == "":
+                # Back to ASCII frames at the baud rate the master started with
+                mirror.stop()
+                self.send_command("OKAY", "")
+                self.__set_mode(False, self.ascii_baudrate)
+                return
                 
         if command and self.__lockout_command == 1:
+            self.stats.lockout_busy += 1
             self.send_command("BUSY", "")
 
+    def __button_action(self, event):
+        """Starts the scene recall broadcast of the action of a button event "button$kind$...", if it has one."""
+        payload = self.actions.run(int(event[0]), event[2])
+        if payload is None:
+            return
+        # Sent by send_commands on the next tick, whatever command the PC has in flight
+        variabels.ACTION_SEQ = (variabels.ACTION_SEQ + 1) & 0xFF
+        variabels.ACTION_PAYLOAD = payload
+        variabels.ACTION_FRAME = ""
+        variabels.ACTION_SEND = SCENE_REPEATS
+
     def handle_pc_logic(self):
         """
         Handles the PC logic for various send commands and acknowledgments.
         """
+        for event in liveness.take_events():
+            # Lamp went online or offline, the PC doesn't ask for it
+            self.send_command("LIVE", event)
+        while variabels.ALRM_EVENTS:
+            # Alarm rules run on the lamps, their events are pushed as well
+            self.send_command("ALRM", variabels.ALRM_EVENTS.pop(0))
+        if mirror.active:
+            for command, payload in mirror.take():
+                self.send_command(command, payload)
+        self.button_handler.poll()
+        while self.button_handler.pending():
+            # Button events are pushed as well, the PC doesn't have to poll RBUT
+            event = self.button_handler.next_event()
+            if self.actions is not None:
+                self.__button_action(event)
+            self.send_command("BTNE", event)
+        if self.actions is not None:
+            self.actions.service()
         
+        if variabels.RETRY_EXHAUSTED == 1:
+            variabels.RETRY_EXHAUSTED = 0
+            # The lamp didn't answer any retransmission, report the failure now
+            if self.__lockout_command == 1:
+                self.command_timer.deinit()
+                self.__timer_callback(self.command_timer)
+                print("RETRIES EXHAUSTED")
         if variabels.EXTEND_TIMER == 1:
             variabels.EXTEND_TIMER = 0
             self.command_timer.deinit()
-            self.command_timer.init(period=10000, mode=Timer.ONE_SHOT, callback=self.__timer_callback)
+            self.command_timer.init(period=rtt.BUSY_TIMEOUT_MS, mode=Timer.ONE_SHOT, callback=self.__timer_callback)
             print("TIME EXTENDED")
+            self.stats.timer_extensions += 1
+            self.stats.lamp_busy()
             command = "BUSY"
             payload = ""
             self.send_command(command, payload)
+        if variabels.SCNR_DONE == 1:
+            variabels.SCNR_DONE = 0
+            self.__lockout_command = 0
+            timestamps.mark(timestamps.REPLY)
+            self.stats.finish(stats.OK)
+            self.send_command("OKAY", "")
         if variabels.COMMAND_ACK == 1:
             if variabels.HRBT_SEND == 1:
                 variabels.COMMAND_ACK = 0
@@ -320,6 +650,8 @@ class UARTtoPC:
                 self.__lockout_command = 0
                 command = "OKAY"
                 payload = ""
+                timestamps.mark(timestamps.REPLY)
+                self.stats.finish(stats.OK)
                 self.send_command(command, payload)
                 print("HRBT WAS ACK LOCKOUT LIFTED")
             if variabels.COLR_SEND == 1:
@@ -330,6 +662,8 @@ class UARTtoPC:
                 self.__lockout_command = 0
                 command = "OKAY"
                 payload = ""
+                timestamps.mark(timestamps.REPLY)
+                self.stats.finish(stats.OK)
                 self.send_command(command, payload)
                 print("COLOR WAS ACK LOCKOUT LIFTED")
             if variabels.SENS_SEND == 1:
@@ -340,6 +674,8 @@ class UARTtoPC:
                 self.__lockout_command = 0
                 command = "SENS"
                 payload = self.encode_sensor_data(variabels.SENS_PAYLOAD)
+                timestamps.mark(timestamps.REPLY)
+                self.stats.finish(stats.OK)
                 self.send_command(command, payload)
                 print("SENS WAS ACK LOCKOUT LIFTED")
             if variabels.TONE_SEND == 1:
@@ -350,6 +686,32 @@ class UARTtoPC:
                 self.__lockout_command = 0
                 command = "OKAY"
                 payload = ""
+                timestamps.mark(timestamps.REPLY)
+                self.stats.finish(stats.OK)
                 self.send_command(command, payload)
                 print("TONE WAS ACK LOCKOUT LIFTED")
+            if variabels.FWD_SEND == 1:
+                variabels.COMMAND_ACK = 0
+                variabels.FWD_SEND = 0
+                variabels.SEND_ONCE = 0
+                self.command_timer.deinit()
+                self.__lockout_command = 0
+                command = variabels.FWD_COMMAND
+                payload = variabels.FWD_REPLY
+                timestamps.mark(timestamps.REPLY)
+                self.stats.finish(stats.OK)
+                self.send_command(command, payload)
+                print(command, "WAS ACK LOCKOUT LIFTED")
+            if variabels.BULK_SEND == 1:
+                variabels.COMMAND_ACK = 0
+                variabels.BULK_SEND = 0
+                variabels.SEND_ONCE = 0
+                self.command_timer.deinit()
+                self.__lockout_command = 0
+                command = "OKAY"
+                payload = variabels.BULK_REPLY
+                timestamps.mark(timestamps.REPLY)
+                self.stats.finish(stats.OK)
+                self.send_command(command, payload)
+                print("BULK WAS ACK LOCKOUT LIFTED")
         
@@ -0,0 +1,93 @@
+import random
+import time
+import variabels
+import timestamps
+import stats
+import rtt
+
+MAX_RETRIES = 4        # Retransmissions before a command is reported as failed
+
+# Commands answered by any number of lamps: repeated a fixed number of times, never reported as failed
+REPEAT_ONLY = {"SRCH": 2}
+
+
+class Retransmitter:
+    """
+    Sends command frames to the lamps and retransmits them until a lamp answers.
+
+    The first wait is the lamp's retransmission timeout from rtt.py. It
+    doubles on every retransmission up to rtt.MAX_RTO_MS and is stretched by
+    a random amount of up to half its length, so lamps and masters that lost
+    frames at the same time don't retry in lockstep. The round-trip time of
+    an answer is fed back to rtt.py unless the frame was retransmitted, as
+    the answer could then belong to either transmission (Karn's algorithm).
+    Any answer of the lamp (see command_handler) clears variabels.RETRY_ACTIVE.
+    When all retries are used up variabels.RETRY_EXHAUSTED is set and pcCOM
+    reports the failure to the PC without waiting for the command timer.
+    """
+
+    def __init__(self, espcom, master_stats):
+        self.com = espcom
+        self.stats = master_stats
+        self.buffer = ""
+        self.command = ""
+        self.lamp = None
+        self.waiting = 0
+        self.retransmitted = 0
+        self.retries_left = 0
+        self.timeout_ms = 0
+        self.due = 0
+
+    def send(self, command, buffer, lamp):
+        """
+        Sends the first transmission of a command and arms the retransmission.
+
+        Args:
+            command (str): Command in the frame.
+            buffer (str): Encoded frame.
+            lamp (int): Index of the lamp in variabels.mac_list, None for a search.
+        """
+        self.buffer = buffer
+        self.command = command
+        self.lamp = lamp
+        self.waiting = 1
+        self.retransmitted = 0
+        self.retries_left = REPEAT_ONLY.get(command, MAX_RETRIES)
+        self.timeout_ms = rtt.rto(command, lamp)
+        # Answers to an earlier command must not complete this one
+        variabels.COMMAND_ACK = 0
+        variabels.RETRY_EXHAUSTED = 0
+        variabels.RETRY_ACTIVE = 1
+        self.com.send_message(buffer)
+        timestamps.mark(timestamps.TX)
+        self.stats.count(stats.RADIO_OUT)
+        self.__arm()
+
+    def __arm(self):
+        jitter = random.randint(0, self.timeout_ms // 2)
+        self.due = time.ticks_add(time.ticks_ms(), self.timeout_ms + jitter)
+
+    def poll(self):
+        """Retransmits the pending frame when its wait is over. Called periodically."""
+        if variabels.RETRY_ACTIVE == 0:
+            if self.waiting == 1:
+                self.waiting = 0
+                if self.retransmitted == 0:
+                    rtt.sample(self.lamp, self.command, timestamps.delta(timestamps.TX, timestamps.ACK) // 1000)
+            return
+        if time.ticks_diff(time.ticks_ms(), self.due) < 0:
+            return
+        if self.retries_left == 0:
+            variabels.RETRY_ACTIVE = 0
+            self.waiting = 0
+            if self.command not in REPEAT_ONLY:
+                variabels.RETRY_EXHAUSTED = 1
+                self.stats.retries_exhausted += 1
+            return
+        self.retries_left -= 1
+        self.retransmitted = 1
+        self.com.send_message(self.buffer)
+        self.stats.count(stats.RADIO_OUT)
+        self.stats.retransmits += 1
+        self.timeout_ms = min(self.timeout_ms * 2, rtt.MAX_RTO_MS)
+        self.__arm()
@@ -0,0 +1,96 @@
+from array import array
+
+MAX_LAMPS = 10          # The PC addresses lamps with a single digit
+GRANULARITY_MS = 10     # Poll period of the radio timer
+INITIAL_RTO_MS = 100    # Timeout for a lamp without RTT samples yet
+MAX_RTO_MS = 800        # Upper bound of a timeout, also caps the retransmission backoff
+SEARCH_WINDOW_MS = 2500 # SRCH collects answers for a fixed time
+BUSY_TIMEOUT_MS = 10000 # Deadline after a lamp answered BUSY (song playing)
+BULK_TIMEOUT_MS = 10000 # Deadline of a whole bulk transfer, bulk.py retries fragments on its own
+
+# Lowest timeout per command. SENS is answered after the sensor read, TONE
+# after the song was looked up, so their answers take longer than a HRBT.
+FLOOR_MS = {"HRBT": 20, "COLR": 20, "TONE": 50, "SENS": 600, "SRCH": 600}
+DEFAULT_FLOOR_MS = 30
+
+# Answers that include work on the lamp; they are not used as RTT samples
+NOT_SAMPLED = ("SENS", "SRCH")
+
+# Per lamp (index in variabels.mac_list), fixed point as in RFC 6298 implementations
+_srtt = array('l', [0] * MAX_LAMPS)     # smoothed RTT, ms * 8
+_rttvar = array('l', [0] * MAX_LAMPS)   # RTT variance, ms * 4
+_samples = array('L', [0] * MAX_LAMPS)
+
+
+def lamp_index(value):
+    """Returns the lamp index of a payload digit or variabels.NEEDED_MAC_INDEX, None if invalid."""
+    try:
+        index = int(value)
+    except (TypeError, ValueError):
+        return None
+    if 0 <= index < MAX_LAMPS:
+        return index
+    return None
+
+
+def reset():
+    """Forget all measurements, e.g. after a new search."""
+    for i in range(MAX_LAMPS):
+        _srtt[i] = 0
+        _rttvar[i] = 0
+        _samples[i] = 0
+
+
+def sample(lamp, command, rtt_ms):
+    """
+    Adds a round-trip measurement of a frame that was not retransmitted.
+
+    First sample: SRTT = R, RTTVAR = R/2. After that:
+    RTTVAR = 3/4 RTTVAR + 1/4 |SRTT - R| and SRTT = 7/8 SRTT + 1/8 R.
+    """
+    if lamp is None or command in NOT_SAMPLED or rtt_ms < 0:
+        return
+    if _samples[lamp] == 0:
+        _srtt[lamp] = rtt_ms << 3
+        _rttvar[lamp] = rtt_ms << 1
+    else:
+        delta = (rtt_ms << 3) - _srtt[lamp]
+        _srtt[lamp] += delta >> 3
+        _rttvar[lamp] += ((abs(delta) >> 1) - _rttvar[lamp]) >> 2
+    _samples[lamp] += 1
+
+
+def rto(command, lamp):
+    """Timeout for the first transmission of a command: SRTT + max(G, 4 * RTTVAR), within the command's floor and MAX_RTO_MS."""
+    if lamp is None or _samples[lamp] == 0:
+        timeout = INITIAL_RTO_MS
+    else:
+        timeout = (_srtt[lamp] >> 3) + max(GRANULARITY_MS, _rttvar[lamp])
+    return min(max(timeout, FLOOR_MS.get(command, DEFAULT_FLOOR_MS)), MAX_RTO_MS)
+
+
+def deadline(command, lamp, retries):
+    """
+    Time after which the command is given up: the first timeout doubled on
+    every retransmission, including the largest random extra, plus one poll
+    period. The command timer uses it as a backstop for the retransmission.
+    """
+    if command == "SRCH":
+        return SEARCH_WINDOW_MS
+    if command == "BULK":
+        return BULK_TIMEOUT_MS
+    timeout = rto(command, lamp)
+    total = 0
+    for _ in range(retries + 1):
+        total += timeout + timeout // 2
+        timeout = min(timeout * 2, MAX_RTO_MS)
+    return total + GRANULARITY_MS
+
+
+def records():
+    """Returns "RTT<index>$srtt_ms$rttvar_ms$rto_ms$samples" for every lamp with samples."""
+    result = []
+    for lamp in range(MAX_LAMPS):
+        if _samples[lamp]:
+            result.append(f"RTT{lamp}${_srtt[lamp] >> 3}${_rttvar[lamp] >> 2}${rto('HRBT', lamp)}${min(_samples[lamp], 99999)}")
+    return result
@@ -0,0 +1,126 @@
+import time
+from array import array
+
+# Commands the master forwards to lamps, in the order used by the counters.
+# FWRD counts all generic forwarded commands (variabels.FWD_COMMANDS),
+# BULK the messages relayed from FRAG frames, SCNR the scene recalls.
+COMMANDS = ("SRCH", "HRBT", "COLR", "SENS", "TONE", "FWRD", "BULK", "SCNR")
+
+# Link counters
+UART_IN = 0
+UART_OUT = 1
+UART_ERR = 2
+RADIO_IN = 3
+RADIO_OUT = 4
+RADIO_ERR = 5
+
+# Outcomes of a command
+OK = 0
+NACK = 1
+TIMEOUT = 2
+
+MAX_VALUE = 99999  # Largest value reported, keeps every record within 32 characters
+NO_COMMAND = 255
+
+
+class MasterStats:
+    """
+    Runtime counters of the master, kept in fixed-size preallocated arrays.
+
+    Counters cover the current window, which starts at boot and whenever
+    the window is reset through "STAT" with payload "R".
+    """
+
+    def __init__(self):
+        count = len(COMMANDS)
+        self.links = array('L', [0] * 6)
+        self.ok = array('L', [0] * count)
+        self.nack = array('L', [0] * count)
+        self.timeout = array('L', [0] * count)
+        self.busy = array('L', [0] * count)
+        self.rtt_min = array('L', [0] * count)
+        self.rtt_max = array('L', [0] * count)
+        self.rtt_sum = array('L', [0] * count)
+        self.__current = NO_COMMAND
+        self.__current_start = 0
+        self.__current_nack = 0
+        self.reset()
+
+    def reset(self):
+        """Clear all counters and start a new window."""
+        for counters in (self.links, self.ok, self.nack, self.timeout, self.busy, self.rtt_max, self.rtt_sum):
+            for i in range(len(counters)):
+                counters[i] = 0
+        for i in range(len(self.rtt_min)):
+            self.rtt_min[i] = 0xFFFFFFFF
+        self.lockout_busy = 0
+        self.timer_extensions = 0
+        self.retransmits = 0
+        self.retries_exhausted = 0
+        self.stale_replies = 0
+        self.window_start = time.ticks_ms()
+
+    def count(self, link_counter):
+        """Increment one of the link counters (UART_IN, RADIO_ERR, ...)."""
+        self.links[link_counter] += 1
+
+    def begin(self, command):
+        """A command was accepted from the PC and is now in flight."""
+        if command in COMMANDS:
+            self.__current = COMMANDS.index(command)
+            self.__current_start = time.ticks_ms()
+            self.__current_nack = 0
+
+    def lamp_busy(self):
+        """The lamp answered BUSY for the command in flight."""
+        if self.__current != NO_COMMAND:
+            self.busy[self.__current] += 1
+
+    def lamp_nack(self):
+        """The lamp answered NACK; the command is reported as NACK when it ends."""
+        self.__current_nack = 1
+
+    def finish(self, outcome):
+        """The command in flight ended with OK or TIMEOUT."""
+        index = self.__current
+        if index == NO_COMMAND:
+            return
+        self.__current = NO_COMMAND
+        if outcome == OK:
+            self.ok[index] += 1
+            rtt = time.ticks_diff(time.ticks_ms(), self.__current_start)
+            self.rtt_sum[index] += rtt
+            if rtt < self.rtt_min[index]:
+                self.rtt_min[index] = rtt
+            if rtt > self.rtt_max[index]:
+                self.rtt_max[index] = rtt
+        elif self.__current_nack:
+            self.nack[index] += 1
+        else:
+            self.timeout[index] += 1
+
+    def records(self):
+        """
+        Returns the counters as a list of payloads, each at most 32 characters:
+        "UART$in$out$err", "RDIO$in$out$err", "MISC$busy$extensions$window_s",
+        "RTRY$retransmits$exhausted$stale_replies",
+        "<CMD>$ok$nack$timeout$busy" and "T_<CMD>$min_ms$avg_ms$max_ms" per command.
+        """
+        def fmt(key, *values):
+            return key + "".join("$" + str(min(v, MAX_VALUE)) for v in values)
+
+        links = self.links
+        window_s = time.ticks_diff(time.ticks_ms(), self.window_start) // 1000
+        records = [
+            fmt("UART", links[UART_IN], links[UART_OUT], links[UART_ERR]),
+            fmt("RDIO", links[RADIO_IN], links[RADIO_OUT], links[RADIO_ERR]),
+            fmt("MISC", self.lockout_busy, self.timer_extensions, window_s),
+            fmt("RTRY", self.retransmits, self.retries_exhausted, self.stale_replies),
+        ]
+        for i, command in enumerate(COMMANDS):
+            records.append(fmt(command, self.ok[i], self.nack[i], self.timeout[i], self.busy[i]))
+            if self.ok[i]:
+                records.append(fmt("T_" + command, self.rtt_min[i], self.rtt_sum[i] // self.ok[i], self.rtt_max[i]))
+            else:
+                records.append(fmt("T_" + command, 0, 0, 0))
+        return records
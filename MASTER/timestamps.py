@@ -0,0 +1,47 @@
+import time
+from array import array
+
+# Stages of a PC command as seen by the master
+RX = 0      # command accepted from the PC
+TX = 1      # radio frame sent to the lamp
+ACK = 2     # first radio reply from the lamp handled
+REPLY = 3   # final reply written to the PC
+
+_ticks = array('l', [0, 0, 0, 0])
+_valid = bytearray(4)
+_command = ["----"]
+
+
+def start(command):
+    """Start timing a new command; clears the stages of the previous one."""
+    for stage in range(4):
+        _valid[stage] = 0
+    _command[0] = command
+    mark(RX)
+
+
+def mark(stage):
+    """Record the current time for a stage."""
+    _ticks[stage] = time.ticks_us()
+    _valid[stage] = 1
+
+
+def mark_once(stage):
+    """Record a stage only if it has not been recorded for this command yet."""
+    if not _valid[stage]:
+        mark(stage)
+
+
+def delta(first, second):
+    """Returns the time from one stage to another in microseconds, -1 if a stage was not reached."""
+    if _valid[first] and _valid[second]:
+        return time.ticks_diff(_ticks[second], _ticks[first])
+    return -1
+
+
+def encode():
+    """
+    Encodes the stage durations of the last command as "CMD$rx_tx$tx_ack$ack_reply".
+    All values are microseconds, -1 if a stage was not reached.
+    """
+    return f"{_command[0]}${delta(RX, TX)}${delta(TX, ACK)}${delta(ACK, REPLY)}"
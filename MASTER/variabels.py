@@ -3,6 +3,8 @@ HRBT_SEND = 0
 COLR_SEND = 0
 SENS_SEND = 0
 TONE_SEND = 0
+FWD_SEND = 0
+BULK_SEND = 0
 
 SEND_ONCE = 0
 EXTEND_TIMER = 0
@@ -11,7 +13,40 @@ COLOR_PAYLOAD = []
 SENS_PAYLOAD = []
 TONE_PAYLOAD = ""
 
+# Lamp commands the master forwards as they are: the PC sends "<index><payload>",
+# the lamp answers with the same command and its payload goes back to the PC
+FWD_COMMANDS = ("HLTH", "BOOT", "CONF", "SCNS", "RULE")
+FWD_COMMAND = ""
+FWD_PAYLOAD = ""
+FWD_REPLY = ""
+
 mac_list = []
+
+# Alarm rule events pushed by lamps, "index$nn$active$value", not yet sent to the PC
+ALRM_EVENTS = []
 NEEDED_MAC_INDEX = 0
 
-COMMAND_ACK = 0
\ No newline at end of file
+COMMAND_ACK = 0
+
+# Message reassembled from the PC's FRAG frames, relayed to a lamp by bulk.py;
+# the lamp command is the first 4 bytes of BULK_DATA
+BULK_DATA = b""
+BULK_ACK = ""
+BULK_REPLY = ""
+
+# Scene recall broadcast to all lamps: copies still to send, payload "nn[gg]", set when all are sent
+SCNR_SEND = 0
+SCNR_PAYLOAD = ""
+SCNR_FRAME = ""
+SCNR_DONE = 0
+
+# Scene recall of a master button action (actions.py): copies still to send, payload, frame once
+# encoded. Sent next to the PC's commands, with sequence numbers of its own (seeded at boot by main.py)
+ACTION_SEND = 0
+ACTION_PAYLOAD = ""
+ACTION_FRAME = ""
+ACTION_SEQ = 0
+
+# Retransmission of the command frame in flight (retransmit.py)
+RETRY_ACTIVE = 0
+RETRY_EXHAUSTED = 0
\ No newline at end of file
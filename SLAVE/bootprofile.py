@@ -0,0 +1,38 @@
+import gc
+import time
+from array import array
+
+MAX_STAGES = 16
+STAGES_PER_PAGE = 2  # "name=ms/kb" is at most 15 characters, two fit into a 32 character payload
+MAX_MS = 99999
+MAX_KB = 999
+
+# Time of each boot stage in ms since reset and free heap after it, in the order reached
+_ms = array('l', [0] * MAX_STAGES)
+_heap_kb = array('l', [0] * MAX_STAGES)
+_names = [""] * MAX_STAGES
+_count = [0]
+
+
+def stage(name):
+    """Record that a boot stage (at most 5 characters) was reached. Stages after MAX_STAGES are dropped."""
+    index = _count[0]
+    if index >= MAX_STAGES:
+        return
+    _ms[index] = time.ticks_ms()
+    _heap_kb[index] = gc.mem_free() // 1024
+    _names[index] = name
+    _count[0] = index + 1
+
+
+def page(number):
+    """
+    Returns one page of the boot profile, two stages per page:
+    "name=ms/kb;..." with ms since reset and free heap in kB after the stage.
+    Sensors appear when their lazy initialisation finished, with "!" if it failed.
+    """
+    first = number * STAGES_PER_PAGE
+    if number < 0 or first >= _count[0]:
+        raise ValueError("No such boot page")
+    last = min(first + STAGES_PER_PAGE, _count[0])
+    return ";".join(f"{_names[i]}={min(_ms[i], MAX_MS)}/{min(_heap_kb[i], MAX_KB)}" for i in range(first, last))
@@ -1,15 +1,53 @@
 import random
 import time
+import machine
+import dedup
+import bootprofile
+import fragment
+import ota
+
+FRAME_LEN = 59  # Radio frame: *mac(17) cmd(4) seq(2) payload(32) checksum(2)*
+EVENT_COPIES = 2  # Copies of a frame the lamp sends on its own, nothing acknowledges it
+_HEX = b"0123456789abcdef"
+
+
+def _hex_value(digit):
+    """Value of one lowercase or uppercase hex digit given as a byte."""
+    if 48 <= digit <= 57:
+        return digit - 48
+    digit |= 32
+    if 97 <= digit <= 102:
+        return digit - 87
+    raise ValueError("Bad hex digit")
+
 
 class CMDHandler:
     
     __added_source = ""
+    __last_reply = None
+    __bulk_reply = None
+    __reboot = False
+    __own_mac = None  # Own MAC address as bytes, compared with the destination of every frame
+    __template = None  # Reply frame, filled in place for every reply
     
-    def __init__(self, espcom, ledhandler, sensorcontrol, buzz):
+    def __init__(self, espcom, ledhandler, sensorcontrol, buzz, telemetry, config=None, scenes=None, rules=None):
         self.com = espcom
         self.led = ledhandler
         self.sensor = sensorcontrol
         self.buzzer = buzz
+        self.telemetry = telemetry
+        self.config = config
+        self.scenes = scenes
+        self.rules = rules
+        # Sequence number of the last frame sent on the lamp's own account. Random start so the master,
+        # which keeps the last one per lamp, doesn't drop the first event after a reboot as a copy.
+        self.__event_seq = random.getrandbits(8)
+        if config is not None and config.paired():
+            # Found by a master before the reboot: answer right away, without a new search
+            self.__added_source = espcom.get_mac()
+        self.dedup = dedup.DuplicateFilter()
+        self.bulk = fragment.Reassembler()
+        self.updater = ota.Updater()
     
     def xor_checksum(self, data):
         """Calculate XOR checksum for a given data string."""
@@ -24,37 +62,67 @@ class CMDHandler:
             return s
         return s + (fillchar * (width - len(s)))
 
+    def __mac_bytes(self):
+        if self.__own_mac is None:
+            self.__own_mac = self.com.get_mac().encode()
+        return self.__own_mac
+
+    def accepts(self, frame):
+        """
+        Quick check of a received frame before it is decoded: True for a master
+        frame addressed to this lamp, a search or a scene recall. Replies of
+        other lamps and commands for other lamps are dropped here without
+        allocating anything.
+        """
+        if len(frame) != FRAME_LEN or frame[0] != 42:  # '*'
+            return False
+        if frame[18] == 83 and frame[19] == 82 and frame[20] == 67 and frame[21] == 72:  # SRCH
+            return True
+        if frame[18] == 83 and frame[19] == 67 and frame[20] == 78 and frame[21] == 82:  # SCNR
+            return True
+        own = self.__mac_bytes()
+        for i in range(17):
+            if frame[i + 1] != own[i]:
+                return False
+        return True
+
     def decode_message(self, message):
-        """Decode an incoming message and verify its checksum."""
-        if message[0] != '*' or message[-1] != '*':
+        """Decode an incoming message (bytes, bytearray or str) and verify its checksum."""
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        if len(message) != FRAME_LEN or message[0] != 42 or message[58] != 42:
             raise ValueError("Message should start and end with '*'")
 
-        source = message[1:18]
-        command = message[18:22]
-        payload = message[22:54].rstrip('@')
-        received_checksum = int(message[54:56], 16)
-        
-        data_to_check = message[1:54]
-        calculated_checksum = self.xor_checksum(data_to_check.encode('utf-8'))
-        
+        calculated_checksum = 0
+        for i in range(1, 56):
+            calculated_checksum ^= message[i]
+        received_checksum = _hex_value(message[56]) << 4 | _hex_value(message[57])
         if received_checksum != calculated_checksum:
             raise ValueError("Checksum does not match")
 
-        return source, command, payload
+        seq = _hex_value(message[22]) << 4 | _hex_value(message[23])
+        end = 56
+        while end > 24 and message[end - 1] == 64:  # '@' padding
+            end -= 1
+        view = memoryview(message)
+        source = str(view[1:18], 'utf-8')
+        command = str(view[18:22], 'utf-8')
+        payload = str(view[24:end], 'utf-8')
+        return source, command, seq, payload
 
-    def encode_message(self, destination, command, payload):
-        """Encode a message with a checksum for sending."""
+    def encode_message(self, destination, command, payload, seq):
+        """Encode a message with a checksum for sending; seq is the sequence number of the command answered."""
         if len(destination) != 17 or len(command) != 4:
             raise ValueError("Source must be 17 characters and command must be 4 characters")
         if len(payload) > 32:
             raise ValueError("Payload must not exceed 32 characters")
 
         padded_payload = self.custom_ljust(payload, 32, '@')
-        data_to_check = destination + command + padded_payload
+        data_to_check = f"{destination}{command}{seq:02x}{padded_payload}"
         checksum = self.xor_checksum(data_to_check.encode('utf-8'))
         
         checksum_hex = '{:02x}'.format(checksum)
-        message = f"#{destination}{command}{padded_payload}{checksum_hex}#"
+        message = f"#{data_to_check}{checksum_hex}#"
         
         return message
     
@@ -84,50 +152,271 @@ class CMDHandler:
         hex_string = "0x" + "".join(f"{value:02X}" for value in values)
         return hex_string
     
-    def handle_command(self, source, command, payload):
-        """Handle incoming commands and execute corresponding actions."""
+    def __reply(self, command, payload, seq, destination=None):
+        """
+        Send a reply. The frame is a template allocated once, only its fields
+        are written for every reply; it is kept as the last reply of the
+        command being handled until the next reply overwrites it.
+
+        Args:
+            command (bytes): Four-letter reply command.
+            payload (str or bytes): Up to 32 characters.
+            seq (int): Sequence number of the command answered.
+            destination (str): MAC address in the frame, the own MAC address if None.
+        """
+        frame = self.__template
+        if frame is None:
+            frame = self.__template = bytearray(b"#" * FRAME_LEN)
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        if len(payload) > 32:
+            raise ValueError("Payload must not exceed 32 characters")
+        mac = self.__mac_bytes() if destination is None else destination.encode()
+        for i in range(17):
+            frame[1 + i] = mac[i]
+        for i in range(4):
+            frame[18 + i] = command[i]
+        frame[22] = _HEX[seq >> 4 & 15]
+        frame[23] = _HEX[seq & 15]
+        length = len(payload)
+        for i in range(32):
+            frame[24 + i] = payload[i] if i < length else 64  # '@'
+        checksum = 0
+        for i in range(1, 56):
+            checksum ^= frame[i]
+        frame[56] = _HEX[checksum >> 4]
+        frame[57] = _HEX[checksum & 15]
+        self.__last_reply = frame
+        self.com.send_message(frame)
+
+    def push_event(self, command, payload):
+        """
+        Send a frame the master didn't ask for (ALRM), once the lamp was found by a
+        master. Each event gets its own sequence number; the master drops the
+        extra copies by it.
+        """
+        if not self.__added_source:
+            return
+        self.__event_seq = (self.__event_seq + 1) & 0xFF
+        frame = self.encode_message(self.__added_source, command, payload, self.__event_seq)
+        for _ in range(EVENT_COPIES):
+            self.com.send_message(frame)
+
+    def handle_command(self, source, command, payload, seq, frame=None):
+        """
+        Handle a command unless it is a retransmission of one handled before.
+
+        Retransmissions (same sender, sequence number and content) are not
+        executed again; the last reply sent for them is repeated instead.
+        `frame` is the received frame, encoded again from the fields if None.
+        """
+        if not command:
+            return
+        if command == "FRAG":
+            # Fragments are numbered by the fragment layer, it handles repeats itself
+            self.__fragment(source, payload, seq)
+            return
+        if frame is None:
+            frame = self.encode_message(source, command, payload, seq).encode('utf-8')
+        peer = self.com.last_peer
+        duplicate, reply = self.dedup.lookup(peer, frame)
+        if duplicate:
+            if reply is not None:
+                self.com.send_message(reply)
+            self.telemetry.duplicate_received()
+            return
+        self.__last_reply = None
+        self.__execute(source, command, payload, seq)
+        self.dedup.remember(peer, frame, self.__last_reply)
+
+    def __fragment(self, source, payload, seq):
+        """
+        Handle one fragment of a bulk message. The complete message is executed
+        once; its answer is repeated if the master sends fragments of it again.
+        """
+        if self.__added_source != source:
+            return
+        try:
+            ack = self.bulk.on_fragment(payload)
+        except ValueError:
+            self.__reply(b"NACK", "", seq)
+            return
+        if ack is not None:
+            self.__reply(b"FACK", ack, seq)
+        if self.bulk.ready:
+            reply, reply_payload = self.__execute_bulk(self.bulk.take())
+            self.__reply(reply, reply_payload, seq)
+            self.__bulk_reply = bytes(self.__template)
+            if reply == b"OKAY" and self.__reboot:
+                # New firmware installed, the answer is on its way
+                time.sleep_ms(200)
+                machine.reset()
+        elif self.bulk.complete and ack is not None and self.__bulk_reply is not None:
+            self.com.send_message(self.__bulk_reply)
+
+    def __execute_bulk(self, message):
+        """Execute a bulk message (lamp command and its data) and return the answer (command as bytes, payload)."""
+        command = bytes(message[:4]).decode()
+        data = message[4:]
+        self.__reboot = False
+        try:
+            if command == "SONG":
+                # Song name, a zero byte, then the 3-byte records played by soundControl
+                data = bytes(data)
+                end = data.index(b"\x00")
+                self.buzzer.add_song(data[:end].decode(), data[end + 1:])
+                return b"OKAY", ""
+            if command == "OTAB":
+                # Begin or resume a firmware file: "name$size$crc32[$R]", R starts again from 0
+                fields = bytes(data).decode().split("$")
+                restart = len(fields) > 3 and fields[3] == "R"
+                return b"OKAY", self.updater.begin(fields[0], int(fields[1]), int(fields[2], 16), restart)
+            if command == "OTAD":
+                # Offset (4 bytes), CRC-32 of the chunk (4 bytes), chunk
+                offset = int.from_bytes(bytes(data[0:4]), "big")
+                crc = int.from_bytes(bytes(data[4:8]), "big")
+                self.updater.write(offset, crc, data[8:])
+                return b"OKAY", str(self.updater.offset)
+            if command == "OTAE":
+                self.updater.end()
+                return b"OKAY", ""
+            if command == "OTAC":
+                # Install all received files and restart
+                installed = ota.commit()
+                self.__reboot = installed > 0
+                return b"OKAY", str(installed)
+        except Exception as e:
+            print("BULK ERROR", command, e)
+        return b"NACK", ""
+
+    def __from_master(self):
+        """True if the frame being handled comes from the master the lamp is paired with (or it isn't paired)."""
+        if self.config is None or not self.config.paired():
+            return True
+        return self.config.master == self.com.last_peer
+
+    def __execute(self, source, command, payload, seq):
+        """Execute a command and send the replies, which carry the sequence number of the command."""
         if command:
             if command == "SRCH":
                 # Handle search command
-                buffer = self.encode_message(source, "RESP", self.com.get_mac())
                 self.__added_source = self.com.get_mac()
+                if self.config is not None:
+                    self.config.pair(self.com.last_peer)
                 random_sleep_time = random.uniform(0.05, 0.5)  # Random delay between 50ms and 500ms
                 time.sleep(random_sleep_time)
-                self.com.send_message(buffer)
+                self.__reply(b"RESP", self.__added_source, seq, destination=source)
             elif command == "HRBT":
                 # Handle heartbeat command
                 if self.__added_source == source:
-                    buffer = self.encode_message(self.__added_source, "HRBT", "")
-                    self.com.send_message(buffer)
+                    self.__reply(b"HRBT", "", seq)
                     self.led.debug_toggle()
             elif command == "COLR":
                 # Handle color change command
                 if self.__added_source == source:
                     try:
                         self.led.set_leds(payload)
-                        buffer = self.encode_message(self.__added_source, "OKAY", "")
-                        self.com.send_message(buffer)
+                        self.__reply(b"OKAY", "", seq)
                     except:
-                        buffer = self.encode_message(self.__added_source, "NACK", "")
-                        self.com.send_message(buffer)
+                        self.__reply(b"NACK", "", seq)
             elif command == "SENS":
                 # Handle sensor data request command
                 if self.__added_source == source:
                     payload_buffer = self.sensor.get_sensor_data()
-                    buffer = self.encode_message(self.__added_source, "SENS", payload_buffer)
-                    self.com.send_message(buffer)
+                    self.__reply(b"SENS", payload_buffer, seq)
             elif command == "TONE":
                 # Handle tone command
                 if self.__added_source == source:
                     if self.buzzer.is_song_available(payload):
-                        buffer = self.encode_message(self.__added_source, "BUSY", "")
-                        self.com.send_message(buffer)
+                        self.__reply(b"BUSY", "", seq)
                         self.buzzer.play_song(payload)
-                        buffer = self.encode_message(self.__added_source, "OKAY", "")
-                        self.com.send_message(buffer)
+                        self.__reply(b"OKAY", "", seq)
+                    else:
+                        self.__reply(b"NACK", "", seq)
+            elif command == "BOOT":
+                # Handle boot profile request, payload is the page number
+                if self.__added_source == source:
+                    try:
+                        reply = bootprofile.page(int(payload))
+                    except:
+                        self.__reply(b"NACK", "", seq)
+                    else:
+                        self.__reply(b"BOOT", reply, seq)
+            elif command == "CONF":
+                # Handle configuration: "key" reads, "key=value" changes, "save" writes now, "reset" restores defaults
+                if self.__added_source == source:
+                    try:
+                        key, _, value = payload.partition("=")
+                        if key == "save":
+                            self.config.service(force=True)
+                            reply = str(self.config.writes)
+                        elif key == "reset":
+                            self.config.defaults()
+                            self.config.changed()
+                            reply = ""
+                        else:
+                            if value:
+                                self.config.set(key, value)
+                            reply = self.config.get(key)
+                    except:
+                        self.__reply(b"NACK", "", seq)
+                    else:
+                        self.__reply(b"CONF", reply, seq)
+                        if key == "chan" and value and self.config.channel:
+                            # Answered on the old channel; from now on only a master on the new one reaches the lamp,
+                            # so the setting is written now
+                            self.config.service(force=True)
+                            self.com.set_channel(self.config.channel)
+            elif command == "SCNS":
+                # Handle scene programming: "nn" reads scene nn, "nn-" deletes it, "nnRRGGBBWWAAUU$fade_ms$effect" stores it
+                if self.__added_source == source:
+                    try:
+                        number = int(payload[0:2], 16)
+                        if len(payload) > 2:
+                            self.scenes.set(number, payload[2:])
+                            reply = ""
+                        else:
+                            reply = self.scenes.get(number)
+                    except:
+                        self.__reply(b"NACK", "", seq)
+                    else:
+                        self.__reply(b"SCNS", reply, seq)
+            elif command == "RULE":
+                # Handle alarm rules: "nn" reads rule nn, "nn-" deletes it, "nn<rule>" stores it, "?" the active rules
+                if self.__added_source == source:
+                    try:
+                        if payload == "?":
+                            reply = "%02X" % self.rules.active_mask()
+                        else:
+                            number = int(payload[0:2], 16)
+                            if len(payload) > 2:
+                                self.rules.set(number, payload[2:])
+                                reply = ""
+                            else:
+                                reply = self.rules.get(number)
+                    except:
+                        self.__reply(b"NACK", "", seq)
+                    else:
+                        self.__reply(b"RULE", reply, seq)
+            elif command == "SCNR":
+                # Handle scene recall, broadcast to all lamps: "nn" or "nngg" for the lamps in group gg,
+                # a song name after the group ("--" for all lamps) is played after the recall (master button alarm).
+                # Not answered, the master sends the frame more than once instead
+                if self.__added_source and self.__from_master():
+                    number = int(payload[0:2], 16)
+                    group = payload[2:4]
+                    if group in ("", "--") or (self.config is not None and self.config.in_group(int(group, 16))):
+                        self.scenes.recall(number, self.led)
+                        if len(payload) > 4:
+                            self.buzzer.play_song(payload[4:])
+            elif command == "HLTH":
+                # Handle health telemetry request, payload is the page number
+                if self.__added_source == source:
+                    try:
+                        reply = self.telemetry.page(int(payload))
+                    except:
+                        self.__reply(b"NACK", "", seq)
                     else:
-                        buffer = self.encode_message(self.__added_source, "NACK", "")
-                        self.com.send_message(buffer)
+                        self.__reply(b"HLTH", reply, seq)
             else:
-                buffer = self.encode_message(self.__added_source, "NACK", "")
-                self.com.send_message(buffer)                
+                self.__reply(b"NACK", "", seq)                
@@ -0,0 +1,178 @@
+import struct
+import ubinascii
+import record
+
+PATH = "lamp.cfg"
+
+# Record (record.py) with the payload length as number of items, one byte each.
+# Version 1 payload: master MAC, group mask, LTR308 resolution/rate/gain,
+# temperature/humidity offset (0.01), TVOC offset, lux scale (0.001),
+# default colour (R G B W A UV), LED PWM frequency.
+# Version 2 appends the radio channel (0 keeps the radio's default).
+# Newer versions only append fields, so an older lamp reads the fields it
+# knows and a newer lamp keeps the defaults for fields missing in an old record.
+_PAYLOAD = "<6sHBBBhhhH6sHB"
+_PAYLOAD_SIZE = struct.calcsize(_PAYLOAD)
+
+NO_MASTER = b"\x00" * 6
+MAX_GROUPS = 16
+
+# Keys of the CONF command
+KEYS = ("master", "groups", "ltr", "t_off", "h_off", "v_off", "l_scale", "colour", "pwm", "chan")
+
+
+class LampConfig(record.FlashRecord):
+    """
+    Settings of the lamp kept in a small binary record on flash, written
+    by service() as described in record.py.
+    """
+
+    MAGIC = b"LC"
+    VERSION = 2
+    NAME = "config"
+
+    def __init__(self, path=PATH):
+        """
+        Args:
+            path (str): File of the record, None keeps the settings in RAM only.
+        """
+        super().__init__(path)
+
+    def defaults(self):
+        self.master = NO_MASTER
+        self.groups = 0
+        self.ltr_resolution = 0x02
+        self.ltr_rate = 0x02
+        self.ltr_gain = 0x01
+        self.temperature_offset = 0     # 0.01 degC
+        self.humidity_offset = 0        # 0.01 %
+        self.tvoc_offset = 0            # ppb
+        self.lux_scale = 1000           # 0.001
+        self.colour = b"\x00" * 6
+        self.pwm_freq = 16000
+        self.channel = 0                # ESP-NOW channel of the master, 0 for the default
+
+    def encode(self):
+        payload = struct.pack(_PAYLOAD, self.master, self.groups, self.ltr_resolution, self.ltr_rate,
+                              self.ltr_gain, self.temperature_offset, self.humidity_offset,
+                              self.tvoc_offset, self.lux_scale, self.colour, self.pwm_freq, self.channel)
+        return self.frame(len(payload), payload)
+
+    def decode(self, data):
+        """Applies a record; raises ValueError if it is damaged."""
+        _, length = self.check(data)
+        # Fields the record doesn't have keep their defaults
+        self.defaults()
+        start = record.HEADER_SIZE
+        payload = bytearray(self.encode()[start:start + _PAYLOAD_SIZE])
+        known = min(length, _PAYLOAD_SIZE)
+        payload[:known] = data[start:start + known]
+        (self.master, self.groups, self.ltr_resolution, self.ltr_rate, self.ltr_gain,
+         self.temperature_offset, self.humidity_offset, self.tvoc_offset, self.lux_scale,
+         self.colour, self.pwm_freq, self.channel) = struct.unpack(_PAYLOAD, payload)
+
+    def paired(self):
+        return self.master != NO_MASTER
+
+    def pair(self, mac):
+        """Remembers the master (ESP-NOW peer address, 6 bytes) that found the lamp."""
+        if mac and bytes(mac) != self.master:
+            self.master = bytes(mac)
+            self.changed()
+
+    def in_group(self, group):
+        return 0 <= group < MAX_GROUPS and (self.groups >> group) & 1 == 1
+
+    def colour_hex(self):
+        """Default colour in the format of ledControl.set_leds, None if it is off."""
+        if self.colour == b"\x00" * 6:
+            return None
+        return "0x" + "".join("%02X" % c for c in self.colour)
+
+    def get(self, key):
+        """Returns a setting as text for the CONF command."""
+        if key == "master":
+            return ":".join("%02x" % b for b in self.master)
+        if key == "groups":
+            groups = ",".join(str(g) for g in range(MAX_GROUPS) if self.in_group(g))
+            # The list of many groups doesn't fit a payload, the mask does
+            return groups if len(groups) <= 24 else "0x%04x" % self.groups
+        if key == "ltr":
+            return "%d,%d,%d" % (self.ltr_resolution, self.ltr_rate, self.ltr_gain)
+        if key == "t_off":
+            return "%.2f" % (self.temperature_offset / 100)
+        if key == "h_off":
+            return "%.2f" % (self.humidity_offset / 100)
+        if key == "v_off":
+            return str(self.tvoc_offset)
+        if key == "l_scale":
+            return "%.3f" % (self.lux_scale / 1000)
+        if key == "colour":
+            return "".join("%02X" % c for c in self.colour)
+        if key == "pwm":
+            return str(self.pwm_freq)
+        if key == "chan":
+            return str(self.channel)
+        raise ValueError("Unknown key")
+
+    def set(self, key, value):
+        """Changes a setting from CONF text; raises ValueError for a bad key or value."""
+        if key == "master":
+            if value == "-":
+                self.master = NO_MASTER
+            else:
+                mac = ubinascii.unhexlify(value.replace(":", ""))
+                if len(mac) != 6:
+                    raise ValueError("Bad MAC")
+                self.master = mac
+        elif key == "groups":
+            mask = 0
+            if value.startswith("0x"):
+                value = ",".join(str(g) for g in range(MAX_GROUPS) if (int(value, 16) >> g) & 1)
+            for group in value.split(","):
+                if group:
+                    group = int(group)
+                    if not 0 <= group < MAX_GROUPS:
+                        raise ValueError("Bad group")
+                    mask |= 1 << group
+            self.groups = mask
+        elif key == "ltr":
+            resolution, rate, gain = (int(v) for v in value.split(","))
+            if not (0 <= resolution <= 7 and 0 <= rate <= 7 and 0 <= gain <= 4):
+                raise ValueError("Bad LTR setting")
+            self.ltr_resolution, self.ltr_rate, self.ltr_gain = resolution, rate, gain
+        elif key == "t_off":
+            self.temperature_offset = self.__int16(round(float(value) * 100))
+        elif key == "h_off":
+            self.humidity_offset = self.__int16(round(float(value) * 100))
+        elif key == "v_off":
+            self.tvoc_offset = self.__int16(int(value))
+        elif key == "l_scale":
+            scale = round(float(value) * 1000)
+            if not 0 < scale <= 0xFFFF:
+                raise ValueError("Bad scale")
+            self.lux_scale = scale
+        elif key == "colour":
+            colour = ubinascii.unhexlify(value)
+            if len(colour) != 6:
+                raise ValueError("Bad colour")
+            self.colour = colour
+        elif key == "pwm":
+            freq = int(value)
+            if not 100 <= freq <= 40000:
+                raise ValueError("Bad PWM frequency")
+            self.pwm_freq = freq
+        elif key == "chan":
+            channel = int(value)
+            if not 0 <= channel <= 13:
+                raise ValueError("Bad channel")
+            self.channel = channel
+        else:
+            raise ValueError("Unknown key")
+        self.changed()
+
+    @staticmethod
+    def __int16(value):
+        if not -32768 <= value <= 32767:
+            raise ValueError("Value out of range")
+        return value
@@ -0,0 +1,78 @@
+WINDOW = 8        # Requests remembered per sender
+MAX_SOURCES = 4   # Senders remembered (masters), the oldest is dropped first
+FRAME_LEN = 59    # Radio frame: *mac(17) cmd(4) seq(2) payload(32) checksum(2)*
+REQUEST_LEN = 55  # frame[1:56]: destination, command, sequence number and payload
+
+
+class DuplicateFilter:
+    """
+    Remembers the last WINDOW requests of each sender with the reply sent to them.
+
+    A request is identified by its frame: sequence number and content, so a
+    master that restarts its sequence numbers is not mistaken for a retry.
+    Requests and replies are copied into buffers allocated once, when the
+    sender is first seen, and compared byte by byte, so looking up and
+    remembering a frame doesn't allocate.
+    """
+
+    def __init__(self):
+        self.sources = {}
+        self.order = []
+
+    def __entry(self, peer):
+        entry = self.sources.get(peer)
+        if entry is None:
+            if len(self.order) >= MAX_SOURCES:
+                del self.sources[self.order.pop(0)]
+            # [next slot, slot used, requests, replies, slot has a reply]
+            entry = [0, bytearray(WINDOW), [bytearray(REQUEST_LEN) for _ in range(WINDOW)],
+                     [bytearray(FRAME_LEN) for _ in range(WINDOW)], bytearray(WINDOW)]
+            self.sources[peer] = entry
+            self.order.append(peer)
+        return entry
+
+    @staticmethod
+    def __same(request, frame):
+        # Sequence number first, it differs between most requests
+        if request[21] != frame[22] or request[22] != frame[23]:
+            return False
+        for i in range(REQUEST_LEN):
+            if request[i] != frame[i + 1]:
+                return False
+        return True
+
+    def lookup(self, peer, frame):
+        """
+        Checks whether a request frame was already handled.
+
+        Returns:
+            tuple: (True, cached reply frame or None) for a duplicate, (False, None) otherwise.
+        """
+        entry = self.sources.get(peer)
+        if entry is None:
+            return False, None
+        used = entry[1]
+        requests = entry[2]
+        for slot in range(WINDOW):
+            if used[slot] and self.__same(requests[slot], frame):
+                if entry[4][slot]:
+                    return True, entry[3][slot]
+                return True, None
+        return False, None
+
+    def remember(self, peer, frame, reply):
+        """Stores a handled request frame and its last reply frame (None if it wasn't answered)."""
+        entry = self.__entry(peer)
+        slot = entry[0]
+        request = entry[2][slot]
+        for i in range(REQUEST_LEN):
+            request[i] = frame[i + 1]
+        if reply is None:
+            entry[4][slot] = 0
+        else:
+            stored = entry[3][slot]
+            for i in range(FRAME_LEN):
+                stored[i] = reply[i]
+            entry[4][slot] = 1
+        entry[1][slot] = 1
+        entry[0] = (slot + 1) % WINDOW
@@ -6,6 +6,8 @@ import ubinascii
 class ESP_COM:
     
     __bcast_mac = b'\xff\xff\xff\xff\xff\xff'  # Broadcast MAC address
+    last_peer = None  # MAC address of the sender of the last received frame
+    MAX_KNOWN = 8  # Sender addresses kept by receive(), see __known_peer
 
     def __init__(self):
         # Initialize WLAN module in station mode
@@ -21,10 +23,16 @@ class ESP_COM:
         # Add broadcast peer
         self.add_bcast()
 
+        self.__mac = ubinascii.hexlify(self.wireless.config('mac'), ':').decode('utf-8')
+        self.__known = []
+
     def get_mac(self):
         """Return the MAC address of the ESP device."""
-        mac = ubinascii.hexlify(self.wireless.config('mac'), ':').decode('utf-8')
-        return mac
+        return self.__mac
+
+    def set_channel(self, channel):
+        """Move to the radio channel of the master (1-13)."""
+        self.wireless.config(channel=channel)
 
     def add_bcast(self):
         """Add the broadcast MAC address to the ESP-NOW peers."""
@@ -33,12 +41,52 @@ class ESP_COM:
     def received_message(self):
         """Check for received messages and return the message as a string."""
         mac, message = self.e.recv()
+        self.last_peer = mac
         if message:
             output = message.decode('utf-8')
         else:
             output = ""
         return output
 
+    def receive(self):
+        """
+        Return the next received frame or None if there is none, without waiting.
+
+        The frame is a buffer owned by ESP-NOW and reused for the next frame,
+        so it must be handled (or copied) before receive() is called again.
+        """
+        mac, message = self.e.irecv(0)
+        if mac is None:
+            return None
+        self.last_peer = self.__known_peer(mac)
+        return message
+
+    def __known_peer(self, mac):
+        """
+        Return a bytes object equal to `mac` that is kept for later frames of
+        the same sender, so last_peer can be used as a dictionary key without
+        allocating a new object for every frame.
+        """
+        for known in self.__known:
+            if known == mac:
+                return known
+        if len(self.__known) >= self.MAX_KNOWN:
+            self.__known.pop(0)
+        known = bytes(mac)
+        self.__known.append(known)
+        return known
+
+    def peers(self):
+        """Return the ESP-NOW peers table: {mac: [rssi, time_ms]} for every peer heard."""
+        return self.e.peers_table
+
+    def peer_rssi(self, mac):
+        """Return the last RSSI received from a peer, 0 if it was never heard."""
+        info = self.e.peers_table.get(mac)
+        if info is None:
+            return 0
+        return info[0]
+
     def check_received(self):
         """Check if any message has been received."""
         return self.e.any()
@@ -1,18 +1,39 @@
 from machine import Pin, PWM
+import random
+import time
+
+# Effects after a fade (scenes.py)
+EFFECT_NONE = 0
+EFFECT_BREATHE = 1
+EFFECT_FLICKER = 2
+
+BREATHE_MS = 4000   # Period of the breathe effect
+FLICKER_MS = 80     # Time between two brightness changes of the flicker effect
+STEP_MS = 20        # Shortest time between two PWM updates of a fade or effect
 
 class LEDController:
-    def __init__(self):
+    def __init__(self, freq=16000):
         # Initialize PWM for each LED with a default duty cycle
-        self.ledR = PWM(Pin(7), freq=16000, duty_u16=32768)
-        self.ledG = PWM(Pin(15), freq=16000, duty_u16=32768)
-        self.ledB = PWM(Pin(16), freq=16000, duty_u16=32768)
-        self.ledW = PWM(Pin(17), freq=16000, duty_u16=32768)
-        self.ledA = PWM(Pin(8), freq=16000, duty_u16=32768)
-        self.ledUV = PWM(Pin(18), freq=16000, duty_u16=32768)
+        self.ledR = PWM(Pin(7), freq=freq, duty_u16=32768)
+        self.ledG = PWM(Pin(15), freq=freq, duty_u16=32768)
+        self.ledB = PWM(Pin(16), freq=freq, duty_u16=32768)
+        self.ledW = PWM(Pin(17), freq=freq, duty_u16=32768)
+        self.ledA = PWM(Pin(8), freq=freq, duty_u16=32768)
+        self.ledUV = PWM(Pin(18), freq=freq, duty_u16=32768)
         
         # Store all LED PWM objects in a list for easy management
         self.leds = [self.ledR, self.ledG, self.ledB, self.ledW, self.ledA, self.ledUV]
         
+        # Duty of every LED, and the fade or effect in progress (see fade_to)
+        self.duties = [0] * 6
+        self.active = False
+        self.__from = [0] * 6
+        self.__to = [0] * 6
+        self.__start = 0
+        self.__fade_ms = 0
+        self.__effect = EFFECT_NONE
+        self.__next = 0
+        
         # Turn off all LEDs initially
         self.turn_off()
         
@@ -42,16 +63,66 @@ class LEDController:
         mapped_duties = [int(d * 1023 / 255) for d in duties]  # Map to PWM range
         return mapped_duties
 
+    def __write(self, duties):
+        for i in range(6):
+            if duties[i] != self.duties[i]:
+                self.leds[i].duty(duties[i])
+                self.duties[i] = duties[i]
+
     def set_leds(self, hex_code):
         """Set the LEDs to the brightness values specified by the hex code."""
         duties = self.hex_to_duty(hex_code)
-        for led, duty in zip(self.leds, duties):
-            led.duty(duty)
+        self.active = False
+        self.__write(duties)
 
     def turn_off(self):
         """Turn off all LEDs."""
+        self.active = False
         for led in self.leds:
             led.duty(0)
+        self.duties = [0] * 6
+
+    def fade_to(self, levels, fade_ms=0, effect=EFFECT_NONE):
+        """
+        Fade from the current brightness to `levels` (six values 0-255) in
+        fade_ms, then run the effect. service() does the work, so the main
+        loop keeps answering frames during a fade.
+        """
+        self.__from = list(self.duties)
+        self.__to = [int(level * 1023 / 255) for level in levels]
+        self.__start = time.ticks_ms()
+        self.__fade_ms = fade_ms
+        self.__effect = effect
+        self.__next = self.__start
+        self.active = True
+        self.service()
+
+    def service(self):
+        """Advance the fade or effect in progress. Called from the main loop."""
+        if not self.active:
+            return
+        now = time.ticks_ms()
+        if time.ticks_diff(now, self.__next) < 0:
+            return
+        self.__next = time.ticks_add(now, STEP_MS)
+        elapsed = time.ticks_diff(now, self.__start)
+        if elapsed < self.__fade_ms:
+            self.__write([a + (b - a) * elapsed // self.__fade_ms for a, b in zip(self.__from, self.__to)])
+            return
+        if self.__effect == EFFECT_BREATHE:
+            # Between 30 % and 100 % of the scene brightness and back
+            phase = (elapsed - self.__fade_ms) % BREATHE_MS
+            if phase > BREATHE_MS // 2:
+                phase = BREATHE_MS - phase
+            scale = 307 + 717 * phase // (BREATHE_MS // 2)
+        elif self.__effect == EFFECT_FLICKER:
+            self.__next = time.ticks_add(now, FLICKER_MS)
+            scale = random.randint(650, 1024)
+        else:
+            self.__write(self.__to)
+            self.active = False
+            return
+        self.__write([duty * scale // 1024 for duty in self.__to])
             
     def debug_on(self):
         """Turn the debug LED on."""
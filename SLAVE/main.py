@@ -1,3 +1,8 @@
+import bootprofile
+bootprofile.stage("main")
+# Finish a firmware update that was interrupted before the other modules are imported
+import ota
+ota.recover()
 from machine import Pin, PWM, I2C
 import machine
 import time
@@ -7,17 +12,42 @@ import ledControl
 import sensorControl
 import soundControl
 import sounds
+import telemetry
+import config
+import scenes
+import rules
+bootprofile.stage("imprt")
+
+# Radio first, so the lamp can answer a search as early as possible
+com = espnowcom.ESP_COM()
+bootprofile.stage("radio")
 
 debug_led = Pin(6, Pin.OUT, value=0)
 debug_led.off()
 
+# Settings stored on flash (pairing, groups, sensor settings, default colour)
+settings = config.LampConfig()
+if settings.channel:
+    # The channel of the master the lamp belongs to, when there are several
+    com.set_channel(settings.channel)
+scene_table = scenes.SceneTable()
+bootprofile.stage("conf")
+
+led = ledControl.LEDController(settings.pwm_freq)
+if settings.colour_hex():
+    led.set_leds(settings.colour_hex())
+bootprofile.stage("leds")
 buzzer = soundControl.Buzzer(pin=9)
-sensor = sensorControl.SENSOR_CONTROL()
-com = espnowcom.ESP_COM()
-led = ledControl.LEDController()
-com_handler = command_handler.CMDHandler(com,led,sensor,buzzer)
 buzzer.add_song("STARUP", sounds.startup_sound)
 buzzer.add_song("ALARM", sounds.alarm_sound)
+bootprofile.stage("buzz")
+# Alarm rules, checked with every sensor sample so they work without the PC or the master
+rule_table = rules.RuleTable(led, scene_table, buzzer)
+# Only the I2C bus; the sensors are initialised from the main loop (sensor.service)
+sensor = sensorControl.SENSOR_CONTROL(settings, rule_table)
+health = telemetry.LampTelemetry(com)
+com_handler = command_handler.CMDHandler(com,led,sensor,buzzer,health,settings,scene_table,rule_table)
+bootprofile.stage("ready")
 print(com.get_mac())
 
 
@@ -25,10 +55,38 @@ print(com.get_mac())
 #I reported the bug to the development team of micropython
 
 while True:
-    if com.check_received():
-        try:
-            received_message = com.received_message()
-            source, command, payload = com_handler.decode_message(received_message)
-            com_handler.handle_command(source, command, payload)
-        except:
-            print("MESSAGE TO OTHER DEVICE OR ERROR")
\ No newline at end of file
+    loop_start = time.ticks_us()
+    # Fades and effects of a recalled scene
+    led.service()
+    frame = com.receive()
+    if frame:
+        health.frame_received()
+        command = None
+        # Replies of other lamps and commands for other lamps are dropped before decoding
+        if com_handler.accepts(frame):
+            try:
+                source, command, seq, payload = com_handler.decode_message(frame)
+            except:
+                health.decode_failed()
+        if command:
+            health.frame_decoded(source, command)
+            handler_start = time.ticks_ms()
+            try:
+                com_handler.handle_command(source, command, payload, seq, frame)
+            except Exception as e:
+                health.handler_failed()
+                print("COMMAND HANDLER ERROR", command, e)
+            health.handler_time(time.ticks_diff(time.ticks_ms(), handler_start))
+    else:
+        # Nothing to answer: bring up the next sensor that isn't running yet, sample for the alarm rules,
+        # write changed settings, collect garbage before a command has to wait for it
+        sensor.service()
+        sensor.sample_if_due()
+        for event in rule_table.take_events():
+            com_handler.push_event("ALRM", event)
+        rule_table.play()
+        settings.service()
+        scene_table.service()
+        rule_table.service()
+        health.collect_if_due()
+    health.loop_time(time.ticks_diff(time.ticks_us(), loop_start))
\ No newline at end of file
@@ -0,0 +1,150 @@
+import os
+import ubinascii
+
+PART = ".part"          # File being received, resumed after an interruption
+NEW = ".new"            # Complete and verified, installed by commit()
+MANIFEST = "ota_commit" # Files being installed, replayed by recover() after a reset
+MAX_NAME = 24
+READ_SIZE = 512
+
+
+def _exists(path):
+    try:
+        os.stat(path)
+        return True
+    except OSError:
+        return False
+
+
+def _crc_of(path):
+    """CRC-32 of a file, 0 if it doesn't exist."""
+    crc = 0
+    buffer = bytearray(READ_SIZE)
+    view = memoryview(buffer)
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                n = f.readinto(buffer)
+                if not n:
+                    break
+                crc = ubinascii.crc32(view[:n], crc)
+    except OSError:
+        return 0
+    return crc
+
+
+def _install(names):
+    for name in names:
+        if _exists(name + NEW):
+            # rename replaces the old file in one step on littlefs, so a reset leaves the old or the new one
+            os.rename(name + NEW, name)
+
+
+def recover():
+    """Finishes an installation that was interrupted by a reset. Called first thing at boot."""
+    try:
+        with open(MANIFEST, 'r') as f:
+            names = f.read().split()
+    except OSError:
+        return
+    _install(names)
+    os.remove(MANIFEST)
+
+
+def commit():
+    """
+    Installs every verified file. The list is written to MANIFEST (via a
+    rename, so it is complete or absent) before the first file is replaced,
+    so a reset halfway through is finished by recover() and the lamp never
+    boots a mix of old and new files. Returns the number of files installed.
+    """
+    names = [entry[:-len(NEW)] for entry in os.listdir() if entry.endswith(NEW)]
+    if not names:
+        return 0
+    with open(MANIFEST + ".tmp", 'w') as f:
+        f.write("\n".join(names))
+    os.rename(MANIFEST + ".tmp", MANIFEST)
+    _install(names)
+    os.remove(MANIFEST)
+    return len(names)
+
+
+class Updater:
+    """Receives one firmware file at a time into a staging file."""
+
+    def __init__(self):
+        self.name = None
+        self.file = None
+        self.size = 0
+        self.crc = 0
+        self.offset = 0
+        self.staged_crc = 0
+
+    def __close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def begin(self, name, size, crc, restart=False):
+        """
+        Starts or resumes receiving a file.
+
+        Returns:
+            str: "offset$staged_crc$installed_crc" (CRCs in hex). The sender
+            continues at offset if the staged CRC matches its own data, or
+            begins again with restart.
+        """
+        if not name or len(name) > MAX_NAME or '/' in name or name.startswith(MANIFEST):
+            raise ValueError("Bad file name")
+        self.__close()
+        self.name = name
+        self.size = size
+        self.crc = crc
+        part = name + PART
+        if not restart and _exists(name + NEW) and _crc_of(name + NEW) == crc:
+            # Already received and verified
+            self.offset = size
+            self.staged_crc = crc
+        else:
+            if _exists(part) and (restart or os.stat(part)[6] > size):
+                os.remove(part)
+            self.offset = os.stat(part)[6] if _exists(part) else 0
+            self.staged_crc = _crc_of(part)
+        return "%d$%08x$%08x" % (self.offset, self.staged_crc, _crc_of(name))
+
+    def write(self, offset, chunk_crc, data):
+        """
+        Appends a chunk at offset after checking its CRC. A chunk that was
+        already written (repeated message) is accepted and ignored.
+        """
+        if self.name is None:
+            raise ValueError("No file being received")
+        if ubinascii.crc32(data) != chunk_crc:
+            raise ValueError("Chunk CRC does not match")
+        if offset + len(data) <= self.offset:
+            return
+        if offset != self.offset or offset + len(data) > self.size:
+            raise ValueError("Chunk out of order")
+        if self.file is None:
+            self.file = open(self.name + PART, 'ab')
+        self.file.write(data)
+        self.file.flush()
+        self.offset += len(data)
+        self.staged_crc = ubinascii.crc32(data, self.staged_crc)
+
+    def end(self):
+        """Verifies the complete file and marks it for installation."""
+        if self.name is None:
+            raise ValueError("No file being received")
+        self.__close()
+        part = self.name + PART
+        if self.offset != self.size or self.staged_crc != self.crc:
+            if _exists(part):
+                os.remove(part)
+            raise ValueError("File CRC does not match")
+        if self.size == 0:
+            with open(part, 'wb'):
+                pass
+        if _exists(part):
+            os.rename(part, self.name + NEW)
+        self.name = None
@@ -0,0 +1,99 @@
+import os
+import struct
+import time
+import ubinascii
+
+WRITE_DELAY_MS = 2000       # Changes within this time are written together
+MIN_WRITE_GAP_MS = 10000    # Shortest time between two flash writes
+
+# Record: magic, version, number of items | items | CRC-32 of everything before it
+_HEADER = "<2sBB"
+HEADER_SIZE = struct.calcsize(_HEADER)
+
+
+class FlashRecord:
+    """
+    Base of the tables kept in one small binary record on flash.
+
+    Subclasses set MAGIC, VERSION, ITEM_SIZE (bytes per item) and NAME, and
+    implement defaults(), encode() (with frame()) and decode() (with check()).
+    Changes are only written by service() after WRITE_DELAY_MS without
+    further changes and never more often than every MIN_WRITE_GAP_MS, and
+    not at all if the record didn't change. The record is written to a
+    temporary file and renamed, so a reset while writing keeps the old
+    record. A missing or damaged record gives the defaults.
+    """
+
+    MAGIC = b"??"
+    VERSION = 1
+    ITEM_SIZE = 1
+    NAME = "record"
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): File of the record, None keeps the table in RAM only.
+        """
+        self.path = path
+        self.stored = b""
+        self.dirty = False
+        self.due = 0
+        self.last_write = time.ticks_add(time.ticks_ms(), -MIN_WRITE_GAP_MS)
+        self.writes = 0
+        self.defaults()
+        if path is not None:
+            self.load()
+
+    def defaults(self):
+        pass
+
+    def frame(self, count, items):
+        """Returns the record of `count` items (bytes)."""
+        record = struct.pack(_HEADER, self.MAGIC, self.VERSION, count) + items
+        return record + struct.pack("<I", ubinascii.crc32(record))
+
+    def check(self, record):
+        """Returns (version, number of items) of a record; raises ValueError if it is damaged."""
+        if len(record) < HEADER_SIZE + 4:
+            raise ValueError("Record too short")
+        magic, version, count = struct.unpack_from(_HEADER, record)
+        end = HEADER_SIZE + count * self.ITEM_SIZE
+        if magic != self.MAGIC or len(record) != end + 4:
+            raise ValueError("Not a %s record" % self.NAME)
+        if struct.unpack_from("<I", record, end)[0] != ubinascii.crc32(record[:end]):
+            raise ValueError("%s CRC does not match" % self.NAME)
+        return version, count
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                record = f.read()
+            self.decode(record)
+            self.stored = record
+        except (OSError, ValueError) as e:
+            print("DEFAULT", self.NAME, e)
+            self.defaults()
+
+    def changed(self):
+        """Schedules a write; more changes before it is due are written with it."""
+        self.dirty = True
+        self.due = time.ticks_add(time.ticks_ms(), WRITE_DELAY_MS)
+
+    def service(self, force=False):
+        """Writes pending changes when they are due. Called from the main loop."""
+        if not self.dirty:
+            return
+        now = time.ticks_ms()
+        if not force and (time.ticks_diff(now, self.due) < 0 or
+                          time.ticks_diff(now, self.last_write) < MIN_WRITE_GAP_MS):
+            return
+        self.dirty = False
+        record = self.encode()
+        if record == self.stored or self.path is None:
+            return
+        with open(self.path + ".tmp", 'wb') as f:
+            f.write(record)
+        os.rename(self.path + ".tmp", self.path)
+        self.stored = record
+        self.last_write = now
+        self.writes += 1
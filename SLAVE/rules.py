@@ -0,0 +1,209 @@
+import struct
+import time
+import record
+import scenes
+
+PATH = "rules.bin"
+MAX_RULES = 8
+SAMPLE_MS = 2000   # Sensor period while rules are stored; alarms fire within one period
+EVENT_RULE = 1     # Flag: push an ALRM frame when the rule fires or clears
+NO_SCENE = 0xFF
+
+# Sensor letters (as in CONF t_off, h_off, v_off, l_scale) and comparators
+SENSORS = "thvl"  # temperature, humidity, TVOC, lux: index into SENSOR_CONTROL.read_values()
+OPS = "><"
+
+# Record (record.py) items, per rule: used, sensor, comparator, threshold, hysteresis,
+# scene (NO_SCENE for none), song name (empty for none), flags
+_RULE = "<BBBffB6sB"
+_RULE_SIZE = struct.calcsize(_RULE)
+
+
+class RuleTable(record.FlashRecord):
+    """
+    Alarm rules kept in a binary record on flash: when a sensor value crosses
+    a threshold the lamp recalls a scene, plays a song and pushes an ALRM
+    frame to the master, without waiting for the PC. A rule clears once the
+    value is back past the threshold by the hysteresis; the LEDs then return
+    to the levels they had before. SENSOR_CONTROL evaluates the rules with
+    every sample. The host programs them with RULE; changes are written by
+    service() like the lamp settings (record.py).
+    """
+
+    MAGIC = b"RL"
+    ITEM_SIZE = _RULE_SIZE
+    NAME = "rules"
+
+    def __init__(self, led, scene_table, buzzer, path=PATH):
+        """
+        Args:
+            led (LEDController): LEDs the scenes of the rules are recalled on.
+            scene_table (SceneTable): Scenes the rules refer to.
+            buzzer (Buzzer): Plays the songs of the rules.
+            path (str): File of the record, None keeps the rules in RAM only.
+        """
+        self.led = led
+        self.scenes = scene_table
+        self.buzzer = buzzer
+        self.active = bytearray(MAX_RULES)
+        self.next_sample = time.ticks_ms()
+        self.song = ""      # Song of a rule that fired, played by play()
+        self.events = []    # ALRM payloads "nn$active$value" not yet sent
+        self.__restore = None  # LED levels (0-255) before the first scene of a rule
+        super().__init__(path)
+
+    def defaults(self):
+        # Per rule: None or (sensor, comparator, threshold, hysteresis, scene, song, flags)
+        self.rules = [None] * MAX_RULES
+
+    def encode(self):
+        items = bytearray()
+        for rule in self.rules:
+            if rule is None:
+                items += struct.pack(_RULE, 0, 0, 0, 0.0, 0.0, NO_SCENE, b"", 0)
+            else:
+                items += struct.pack(_RULE, 1, rule[0], rule[1], rule[2], rule[3], rule[4], rule[5].encode(), rule[6])
+        return self.frame(MAX_RULES, bytes(items))
+
+    def decode(self, data):
+        """Applies a record; raises ValueError if it is damaged."""
+        _, count = self.check(data)
+        self.defaults()
+        for number in range(min(count, MAX_RULES)):
+            used, sensor, op, threshold, hysteresis, scene, song, flags = struct.unpack_from(
+                _RULE, data, record.HEADER_SIZE + number * _RULE_SIZE)
+            if used:
+                self.rules[number] = (sensor, op, threshold, hysteresis, scene, song.rstrip(b"\x00").decode(), flags)
+
+    def get(self, number):
+        """Returns a rule as text for the RULE command: "t>28.5/0.5$scene$song$event"."""
+        rule = self.rules[number]
+        if rule is None:
+            raise ValueError("No such rule")
+        scene = "-" if rule[4] == NO_SCENE else "%02X" % rule[4]
+        return "%s%s%g/%g$%s$%s$%d" % (SENSORS[rule[0]], OPS[rule[1]], rule[2], rule[3], scene,
+                                       rule[5] or "-", rule[6] & EVENT_RULE)
+
+    def set(self, number, value):
+        """
+        Stores a rule from RULE text, "-" deletes it; raises ValueError for a bad value.
+
+        Args:
+            number (int): Rule number.
+            value (str): "<sensor><comparator><threshold>[/<hysteresis>][$<scene>[$<song>[$<event>]]]"
+                with sensor t, h, v or l, comparator > or <, scene (hex) and song "-" for none,
+                event 1 (default) or 0; or "-".
+        """
+        if not 0 <= number < MAX_RULES:
+            raise ValueError("Bad rule number")
+        if value == "-":
+            rule = None
+        else:
+            fields = value.split("$")
+            sensor = SENSORS.index(fields[0][0])
+            op = OPS.index(fields[0][1])
+            threshold, _, hysteresis = fields[0][2:].partition("/")
+            threshold = float(threshold)
+            hysteresis = float(hysteresis) if hysteresis else 0.0
+            scene = fields[1] if len(fields) > 1 else "-"
+            scene = NO_SCENE if scene == "-" else int(scene, 16)
+            song = fields[2] if len(fields) > 2 else "-"
+            song = "" if song == "-" else song
+            flags = int(fields[3]) if len(fields) > 3 else EVENT_RULE
+            if (hysteresis < 0 or len(song) > 6 or flags not in (0, 1) or
+                    not (scene == NO_SCENE or 0 <= scene < scenes.MAX_SCENES)):
+                raise ValueError("Bad rule")
+            rule = (sensor, op, threshold, hysteresis, scene, song, flags)
+        if self.active[number]:
+            # A changed rule starts again from the cleared state
+            self.__clear(number, None)
+        self.rules[number] = rule
+        self.changed()
+
+    def active_mask(self):
+        """Bit n is set while rule n has fired and not cleared."""
+        mask = 0
+        for number in range(MAX_RULES):
+            if self.active[number]:
+                mask |= 1 << number
+        return mask
+
+    def sample_due(self):
+        """True if rules are stored and the last sample is SAMPLE_MS old."""
+        if time.ticks_diff(time.ticks_ms(), self.next_sample) < 0:
+            return False
+        for rule in self.rules:
+            if rule is not None:
+                return True
+        return False
+
+    def evaluate(self, values):
+        """
+        Checks every rule against a sample and runs the actions of the rules that fire or clear.
+
+        Args:
+            values (tuple): (temperature, humidity, tvoc, lux) as read by SENSOR_CONTROL;
+                nan, a negative TVOC and lux None are missing values and change nothing.
+        """
+        self.next_sample = time.ticks_add(time.ticks_ms(), SAMPLE_MS)
+        for number in range(MAX_RULES):
+            rule = self.rules[number]
+            if rule is None:
+                continue
+            value = values[rule[0]]
+            if value is None or value != value or (rule[0] == 2 and value < 0):
+                continue
+            threshold = rule[2]
+            if rule[1] == 0:
+                fired = value > threshold
+                cleared = value < threshold - rule[3]
+            else:
+                fired = value < threshold
+                cleared = value > threshold + rule[3]
+            if not self.active[number] and fired:
+                self.__fire(number, rule, value)
+            elif self.active[number] and cleared:
+                self.__clear(number, value)
+
+    def __scene_active(self):
+        for number in range(MAX_RULES):
+            rule = self.rules[number]
+            if self.active[number] and rule is not None and rule[4] != NO_SCENE:
+                return True
+        return False
+
+    def __fire(self, number, rule, value):
+        if rule[4] != NO_SCENE:
+            if not self.__scene_active():
+                self.__restore = [duty * 255 // 1023 for duty in self.led.duties]
+            self.scenes.recall(rule[4], self.led)
+        self.active[number] = 1
+        if rule[5]:
+            self.song = rule[5]
+        if rule[6] & EVENT_RULE:
+            self.events.append("%02X$1$%.2f" % (number, value))
+
+    def __clear(self, number, value):
+        """Clears an active rule; value None if the rule was changed rather than cleared by a sample."""
+        rule = self.rules[number]
+        self.active[number] = 0
+        if rule is None:
+            return
+        if rule[4] != NO_SCENE and self.__restore is not None and not self.__scene_active():
+            self.led.fade_to(self.__restore)
+            self.__restore = None
+        if value is not None and rule[6] & EVENT_RULE:
+            self.events.append("%02X$0$%.2f" % (number, value))
+
+    def take_events(self):
+        """Returns and forgets the ALRM payloads "nn$active$value" of the rules that fired or cleared."""
+        events = self.events
+        self.events = []
+        return events
+
+    def play(self):
+        """Plays the song of the last rule that fired, once. Blocks like TONE."""
+        if self.song:
+            song = self.song
+            self.song = ""
+            self.buzzer.play_song(song)
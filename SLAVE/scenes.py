@@ -0,0 +1,92 @@
+import struct
+import ubinascii
+import record
+
+PATH = "scenes.bin"
+MAX_SCENES = 16
+MAX_FADE_MS = 0xFFFF
+
+EFFECTS = 3  # Effects run by ledControl after the fade: none, breathe, flicker
+
+# Record (record.py) items, per scene: used, levels (R G B W A UV), fade time in ms, effect
+_SCENE = "<B6sHB"
+_SCENE_SIZE = struct.calcsize(_SCENE)
+
+
+class SceneTable(record.FlashRecord):
+    """
+    Numbered scenes (channel levels, fade time, effect) kept in a binary record
+    on flash. The host programs them with SCNS; SCNR, broadcast by the master,
+    recalls a scene on every lamp at once. Changes are written by service()
+    like the lamp settings (record.py).
+    """
+
+    MAGIC = b"SN"
+    ITEM_SIZE = _SCENE_SIZE
+    NAME = "scenes"
+
+    def __init__(self, path=PATH):
+        """
+        Args:
+            path (str): File of the record, None keeps the scenes in RAM only.
+        """
+        super().__init__(path)
+
+    def defaults(self):
+        # Per scene: None or (levels bytes, fade ms, effect)
+        self.scenes = [None] * MAX_SCENES
+
+    def encode(self):
+        items = bytearray()
+        for scene in self.scenes:
+            if scene is None:
+                items += struct.pack(_SCENE, 0, b"\x00" * 6, 0, 0)
+            else:
+                items += struct.pack(_SCENE, 1, scene[0], scene[1], scene[2])
+        return self.frame(MAX_SCENES, bytes(items))
+
+    def decode(self, data):
+        """Applies a record; raises ValueError if it is damaged."""
+        _, count = self.check(data)
+        self.defaults()
+        for number in range(min(count, MAX_SCENES)):
+            used, levels, fade_ms, effect = struct.unpack_from(_SCENE, data, record.HEADER_SIZE + number * _SCENE_SIZE)
+            if used:
+                self.scenes[number] = (levels, fade_ms, effect)
+
+    def get(self, number):
+        """Returns a scene as text for the SCNS command: "RRGGBBWWAAUU$fade_ms$effect"."""
+        scene = self.scenes[number]
+        if scene is None:
+            raise ValueError("No such scene")
+        return "%s$%d$%d" % ("".join("%02X" % c for c in scene[0]), scene[1], scene[2])
+
+    def set(self, number, value):
+        """
+        Stores a scene from SCNS text, "-" deletes it; raises ValueError for a bad value.
+
+        Args:
+            number (int): Scene number.
+            value (str): "RRGGBBWWAAUU[$fade_ms[$effect]]" or "-".
+        """
+        if not 0 <= number < MAX_SCENES:
+            raise ValueError("Bad scene number")
+        if value == "-":
+            self.scenes[number] = None
+        else:
+            fields = value.split("$")
+            levels = ubinascii.unhexlify(fields[0])
+            fade_ms = int(fields[1]) if len(fields) > 1 else 0
+            effect = int(fields[2]) if len(fields) > 2 else 0
+            if len(levels) != 6 or not 0 <= fade_ms <= MAX_FADE_MS or not 0 <= effect < EFFECTS:
+                raise ValueError("Bad scene")
+            self.scenes[number] = (levels, fade_ms, effect)
+        self.changed()
+
+    def recall(self, number, led):
+        """Starts a scene on the LEDs; False if there is no such scene."""
+        scene = self.scenes[number] if 0 <= number < MAX_SCENES else None
+        if scene is None:
+            return False
+        led.fade_to(scene[0], scene[1], scene[2])
+        return True
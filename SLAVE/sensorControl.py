@@ -1,39 +1,150 @@
+import time
 import ahtx0
 import ltr308
+import bootprofile
 from ags10 import AGS10
 from machine import I2C, Pin
 
+RETRY_MS = 5000  # Wait before a failed sensor is initialised again
+
 class SENSOR_CONTROL:
-    def __init__(self):
+    """
+    Reads the AHT20, AGS10 and LTR308 sensors.
+
+    The constructor only sets up the I2C bus so the lamp can answer on the
+    radio right away. The sensors are initialised later, one at a time, by
+    service() from the main loop or on the first read. A sensor that fails
+    doesn't affect the others: its values are reported as missing and it is
+    initialised again after RETRY_MS. LTR308 settings and calibration
+    offsets come from the lamp configuration (config.py) if one is given.
+    Every sample is checked against the alarm rules (rules.py) if a rule
+    table is given; sample_if_due() takes samples for them without a SENS.
+    """
+
+    def __init__(self, config=None, rules=None):
+        self.config = config
+        self.rules = rules
         # Initialize I2C bus with specified pins and frequency
         self.sensor_i2c = I2C(0, scl=Pin(5), sda=Pin(4), freq=100000)
 
-        # Initialize AHT20 sensor for temperature and humidity
-        self.aht20_sensor = ahtx0.AHT20(self.sensor_i2c)
-        # Initialize AGS10 sensor for air quality (TVOC)
-        self.ags10_sensor = AGS10(self.sensor_i2c)
-        # Initialize LTR308 sensor for ambient light
-        self.ltr_sensor = ltr308.LTR308ALS(self.sensor_i2c)
+        self.aht20_sensor = None
+        self.ags10_sensor = None
+        self.ltr_sensor = None
+        self.failures = [0, 0, 0]  # Failed initialisations per sensor (aht, ags, ltr)
+        self.started = [0, 0, 0]   # Sensors that were initialised at least once
+        self.next_try = [0, 0, 0]  # Earliest ticks_ms of the next initialisation per sensor
+
+    def __init_sensor(self, index):
+        """Initialise one sensor, returns True on success."""
+        name = ("aht", "ags", "ltr")[index]
+        try:
+            if index == 0:
+                # Initialize AHT20 sensor for temperature and humidity
+                self.aht20_sensor = ahtx0.AHT20(self.sensor_i2c)
+            elif index == 1:
+                # Initialize AGS10 sensor for air quality (TVOC)
+                self.ags10_sensor = AGS10(self.sensor_i2c)
+            else:
+                # Initialize LTR308 sensor for ambient light
+                ltr_sensor = ltr308.LTR308ALS(self.sensor_i2c)
+                if self.config is not None:
+                    ltr_sensor.set_als_meas_rate(self.config.ltr_resolution, self.config.ltr_rate)
+                    ltr_sensor.set_als_gain(self.config.ltr_gain)
+                else:
+                    ltr_sensor.set_als_meas_rate(0x02, 0x02)  # Set ALS measurement rate
+                    ltr_sensor.set_als_gain(0x01)  # Set ALS gain
+                self.ltr_sensor = ltr_sensor
+        except Exception:
+            self.failures[index] += 1
+            self.next_try[index] = time.ticks_add(time.ticks_ms(), RETRY_MS)
+            if self.failures[index] == 1:
+                bootprofile.stage(name + "!")
+            return False
+        if not self.started[index]:
+            self.started[index] = 1
+            bootprofile.stage(name)
+        return True
+
+    def __missing(self):
+        """Return the index of the first sensor that is not running and due for initialisation, or -1."""
+        sensors = (self.aht20_sensor, self.ags10_sensor, self.ltr_sensor)
+        now = time.ticks_ms()
+        for index in range(3):
+            if sensors[index] is None and time.ticks_diff(now, self.next_try[index]) >= 0:
+                return index
+        return -1
+
+    def service(self):
+        """Initialise at most one missing sensor. Called from the main loop while no frame is waiting."""
+        index = self.__missing()
+        if index >= 0:
+            self.__init_sensor(index)
+
+    def read_values(self):
+        """
+        Read all sensors and return calibrated (temperature, humidity, tvoc, lux).
+        Missing values are nan (temperature, humidity), -1 (TVOC) and None (lux).
+        The values are checked against the alarm rules.
+        """
+        # Sensors that are not running yet are initialised first
+        index = self.__missing()
+        while index >= 0:
+            self.__init_sensor(index)
+            index = self.__missing()
+
+        temperature = float('nan')
+        humidity = float('nan')
+        tvoc = -1
+        lux = None
+        if self.aht20_sensor is not None:
+            try:
+                # Read temperature and humidity from AHT20 sensor
+                temperature = self.aht20_sensor.temperature
+                humidity = self.aht20_sensor.relative_humidity
+            except Exception:
+                self.aht20_sensor = None
+
+        if self.ags10_sensor is not None:
+            try:
+                # Read TVOC from AGS10 sensor
+                tvoc = self.ags10_sensor.total_volatile_organic_compounds_ppb
+            except Exception:
+                self.ags10_sensor = None
+
+        if self.ltr_sensor is not None:
+            try:
+                # Read lux (ambient light) from LTR308 sensor if new data is available
+                if self.ltr_sensor.new_data_available():
+                    lux = self.ltr_sensor.read_lux()
+            except Exception:
+                self.ltr_sensor = None
+
+        config = self.config
+        if config is not None:
+            # Calibration (nan and missing values stay as they are)
+            temperature += config.temperature_offset / 100
+            humidity += config.humidity_offset / 100
+            if tvoc >= 0:
+                tvoc = max(tvoc + config.tvoc_offset, 0)
+            if lux is not None:
+                lux = lux * config.lux_scale / 1000
+
+        values = (temperature, humidity, tvoc, lux)
+        if self.rules is not None:
+            self.rules.evaluate(values)
+        return values
 
-        # Configure LTR308 sensor settings
-        self.ltr_sensor.set_als_meas_rate(0x02, 0x02)  # Set ALS measurement rate
-        self.ltr_sensor.set_als_gain(0x01)  # Set ALS gain
+    def sample_if_due(self):
+        """Take a sample for the alarm rules if one is due. Called from the main loop while no frame is waiting."""
+        if self.rules is not None and self.rules.sample_due():
+            self.read_values()
 
     def get_sensor_data(self):
-        """Read data from all sensors and generate a payload string"""
-        # Read temperature from AHT20 sensor
-        temperature = self.aht20_sensor.temperature
-        # Read humidity from AHT20 sensor
-        humidity = self.aht20_sensor.relative_humidity
-
-        # Read TVOC from AGS10 sensor
-        tvoc = self.ags10_sensor.total_volatile_organic_compounds_ppb
-
-        # Read lux (ambient light) from LTR308 sensor if new data is available
-        if self.ltr_sensor.new_data_available():
-            lux = self.ltr_sensor.read_lux()
-        else:
-            lux = None
+        """
+        Read data from all sensors and generate a payload string "temperature$humidity$tvoc[$lux]".
+        Missing values are reported as "nan" (temperature, humidity) and -1 (TVOC).
+        """
+        temperature, humidity, tvoc, lux = self.read_values()
 
         # Generate payload string with sensor data
         payload = f"{temperature:.2f}${humidity:.2f}${tvoc}"
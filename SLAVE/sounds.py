@@ -1,13 +1,5 @@
-gong = [
-    ('C5',0.75),   ('E5',0.75),   ('G5',0.75)
-]
-alarm_sound = [
-    ('C6', 0.2), ('P', 0.1), ('C6', 0.2), ('P', 0.1), ('C6', 0.2),  # Beep beep beep
-    ('G5', 0.2), ('P', 0.1), ('G5', 0.2), ('P', 0.1), ('G5', 0.2),  # Lower beep beep beep
-    ('C6', 0.2), ('P', 0.1), ('C6', 0.2), ('P', 0.1), ('C6', 0.2),  # Beep beep beep
-    ('G5', 0.2), ('P', 0.1), ('G5', 0.2), ('P', 0.1), ('G5', 0.2)   # Lower beep beep beep
-]
-startup_sound = [
-    ('C4', 0.2), ('E4', 0.2), ('G4', 0.2), ('C5', 0.4),  # C E G C (arpeggio up)
-    ('G4', 0.2), ('E4', 0.2), ('C4', 0.4)  # G E C (arpeggio down)
-]
\ No newline at end of file
+# Generated by HOST/songc.py from HOST/songs.txt, edit the source and run the compiler again.
+# Each song is a sequence of 3-byte records: note index (soundControl.NOTE_FREQS), duration in ms.
+gong = b'1\x02\xee5\x02\xee8\x02\xee'  # 3 notes, 2250 ms
+alarm_sound = b'=\x00\xc8\x00\x00d=\x00\xc8\x00\x00d=\x00\xc88\x00\xc8\x00\x00d8\x00\xc8\x00\x00d8\x00\xc8=\x00\xc8\x00\x00d=\x00\xc8\x00\x00d=\x00\xc88\x00\xc8\x00\x00d8\x00\xc8\x00\x00d8\x00\xc8'  # 20 notes, 3200 ms
+startup_sound = b'%\x00\xc8)\x00\xc8,\x00\xc81\x01\x90,\x00\xc8)\x00\xc8%\x01\x90'  # 7 notes, 1800 ms
@@ -0,0 +1,123 @@
+import gc
+import time
+
+MAX_VALUE = 99999  # Largest value reported, keeps every page within 32 characters
+PEERS_PER_PAGE = 3
+FIRST_PEER_PAGE = 4
+GC_ALLOC_BYTES = 16384  # Bytes allocated since the last collection that make collect_if_due collect
+GC_LOW_HEAP = 8192  # Free heap below which collect_if_due always collects
+
+
+class LampTelemetry:
+    """Health counters of a lamp, reported page by page through the HLTH command."""
+
+    def __init__(self, espcom):
+        self.com = espcom
+        self.own_mac = espcom.get_mac()
+        self.boot_time = time.time()
+        self.frames_rx = 0
+        self.frames_mine = 0
+        self.decode_errors = 0
+        self.handler_errors = 0
+        self.duplicates = 0
+        self.loop_avg_us = 0
+        self.loop_max_us = 0
+        self.block_max_ms = 0
+        self.block_total_ms = 0
+        self.gc_count = 0
+        self.gc_max_us = 0
+        self.gc_avg_us = 0
+        self.min_free = gc.mem_free()
+        self.__alloc_after_gc = gc.mem_alloc()
+
+    def frame_received(self):
+        self.frames_rx += 1
+
+    def frame_decoded(self, source, command):
+        """Count a valid frame that is addressed to this lamp (or a search)."""
+        if source == self.own_mac or command == "SRCH":
+            self.frames_mine += 1
+
+    def decode_failed(self):
+        """Count a frame for this lamp that could not be decoded."""
+        self.decode_errors += 1
+
+    def handler_failed(self):
+        self.handler_errors += 1
+
+    def duplicate_received(self):
+        """Count a retransmitted command that was answered from the reply cache."""
+        self.duplicates += 1
+
+    def handler_time(self, elapsed_ms):
+        """Record the time a command handler blocked the main loop."""
+        self.block_total_ms += elapsed_ms
+        if elapsed_ms > self.block_max_ms:
+            self.block_max_ms = elapsed_ms
+
+    def loop_time(self, elapsed_us):
+        """Record one main loop iteration (moving average over 16 iterations)."""
+        self.loop_avg_us += (elapsed_us - self.loop_avg_us) // 16
+        if elapsed_us > self.loop_max_us:
+            self.loop_max_us = elapsed_us
+
+    def collect_if_due(self):
+        """
+        Run the garbage collector while the lamp is idle, once enough has been
+        allocated since the last collection or the heap runs low, so it rarely
+        has to run in the middle of a command. Records how long every
+        collection takes and the lowest free heap seen.
+        """
+        free = gc.mem_free()
+        if free < self.min_free:
+            self.min_free = free
+        if gc.mem_alloc() - self.__alloc_after_gc < GC_ALLOC_BYTES and free > GC_LOW_HEAP:
+            return
+        start = time.ticks_us()
+        gc.collect()
+        elapsed_us = time.ticks_diff(time.ticks_us(), start)
+        self.gc_count += 1
+        self.gc_avg_us += (elapsed_us - self.gc_avg_us) // 8
+        if elapsed_us > self.gc_max_us:
+            self.gc_max_us = elapsed_us
+        self.__alloc_after_gc = gc.mem_alloc()
+
+    def __peer_rssi(self):
+        """Return a list of "xxxx=rssi" entries (last two MAC bytes in hex) for every peer heard."""
+        entries = []
+        for mac, info in self.com.peers().items():
+            entries.append(f"{mac[-2]:02x}{mac[-1]:02x}={info[0]}")
+        return entries
+
+    def page(self, number):
+        """
+        Returns one page of health data:
+        0: "rx$mine$decode_errors$handler_errors$master_rssi"
+        1: "loop_avg_us$loop_max_us$block_max_ms$block_total_s" (maxima reset after reading)
+        2: "free_heap_kb$uptime_min$peer_count$duplicates"
+        3: "free_heap_kb$min_free_kb$gc_count$gc_max_us$gc_avg_us" (gc maximum reset after reading)
+        4+: "xxxx=rssi;..." per-peer RSSI, three peers per page
+        """
+        def fmt(*values):
+            return "$".join(str(min(v, MAX_VALUE)) for v in values)
+
+        if number == 0:
+            master_rssi = self.com.peer_rssi(self.com.last_peer)
+            return fmt(self.frames_rx, self.frames_mine, self.decode_errors, self.handler_errors) + f"${master_rssi}"
+        if number == 1:
+            payload = fmt(self.loop_avg_us, self.loop_max_us, self.block_max_ms, self.block_total_ms // 1000)
+            self.loop_max_us = 0
+            self.block_max_ms = 0
+            return payload
+        if number == 2:
+            uptime_min = int(time.time() - self.boot_time) // 60
+            return fmt(gc.mem_free() // 1024, uptime_min, len(self.com.peers()), self.duplicates)
+        if number == 3:
+            payload = fmt(gc.mem_free() // 1024, self.min_free // 1024, self.gc_count, self.gc_max_us, self.gc_avg_us)
+            self.gc_max_us = 0
+            return payload
+        first = (number - FIRST_PEER_PAGE) * PEERS_PER_PAGE
+        entries = self.__peer_rssi()
+        if first >= len(entries):
+            raise ValueError("No such health page")
+        return ";".join(entries[first:first + PEERS_PER_PAGE])